@@ -0,0 +1,64 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""Peak RSS of tarfile.TarFile.add against the streaming TarWriter
+
+Usage:
+    python benchmarks/archive_memory.py [file_count ...]
+
+Each measurement archives a generated tree of empty files to /dev/null in a
+fresh child process, and reports the peak RSS of that child.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+TARFILE = '''
+import sys, tarfile
+with open(sys.argv[2], 'wb') as out, tarfile.open(fileobj=out, mode='w|') as tar:
+    tar.add(sys.argv[1], arcname='backup')
+'''
+
+TARWRITER = '''
+import sys
+from eljef.backup.archive import write_tree
+with open(sys.argv[2], 'wb') as out:
+    write_tree(out, sys.argv[1], 'backup')
+'''
+
+FILES_PER_DIR = 1000
+
+
+def make_tree(path: str, count: int) -> None:
+    """Creates count empty files under path"""
+    for num in range(count):
+        subdir = os.path.join(path, f"{num // FILES_PER_DIR:06d}")
+        if num % FILES_PER_DIR == 0:
+            os.makedirs(subdir)
+        with open(os.path.join(subdir, f"{num:09d}.eml"), 'wb'):
+            pass
+
+
+def peak_rss(script: str, path: str) -> int:
+    """Runs script in a child process and returns its peak RSS in KiB"""
+    cmd = [sys.executable, '-c', 'import os, resource, sys; exec(sys.argv[3]); '
+           'print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)', path, os.devnull, script]
+    result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    return int(result.stdout.decode().split()[-1])
+
+
+def main() -> None:
+    """Main function"""
+    counts = [int(count) for count in sys.argv[1:]] or [10000, 50000, 200000]
+    print(f"{'files':>10} {'tarfile KiB':>12} {'TarWriter KiB':>14}")
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp, count)
+            print(f"{count:>10} {peak_rss(TARFILE, tmp):>12} {peak_rss(TARWRITER, tmp):>14}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
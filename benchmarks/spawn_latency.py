@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""Spawn latency of the old preexec_fn demotion against native credential arguments
+
+Usage:
+    python benchmarks/spawn_latency.py [spawns] [threads] [ballast_mib]
+
+Each method spawns /bin/true spawns times, from threads threads at once, as the
+current user and group, so no privileges are needed. ballast_mib MiB of memory is
+allocated first, as fork copies the page tables of the whole parent process while
+vfork does not.
+
+    preexec_fn   - subprocess.run with preexec_fn calling setgid and setuid, as
+                   Plugin.exec did before
+    credentials  - subprocess.run with the arguments from process.credentials
+    no run_as    - subprocess.run without changing credentials, which can use
+                   vfork or posix_spawn
+"""
+
+import concurrent.futures
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eljef.backup.process import credentials  # noqa: E402 pylint: disable=wrong-import-position
+
+CMD = ['/bin/true']
+
+
+def demote(uid: int, gid: int):
+    """Returns the preexec_fn Plugin.demote used to return"""
+    def set_uid_gid():
+        os.setgid(gid)
+        os.setuid(uid)
+
+    return set_uid_gid
+
+
+def spawn(kwargs: dict) -> float:
+    """Spawns CMD and returns the seconds taken"""
+    start = time.perf_counter()
+    subprocess.run(CMD, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, **kwargs)
+
+    return time.perf_counter() - start
+
+
+def measure(kwargs_factory, spawns: int, threads: int) -> list:
+    """Spawns CMD spawns times from threads threads and returns each latency"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda _: spawn(kwargs_factory()), range(spawns)))
+
+
+def main() -> None:
+    """Main function"""
+    spawns = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    ballast = bytearray(int(sys.argv[3]) * 1024 * 1024 if len(sys.argv) > 3 else 0)
+    ballast[::4096] = b'x' * len(ballast[::4096])
+
+    uid, gid = os.getuid(), os.getgid()
+    methods = (
+        ('preexec_fn', lambda: {'preexec_fn': demote(uid, gid)}),
+        ('credentials', lambda: credentials(uid, gid)),
+        ('no run_as', dict),
+    )
+
+    print(f"{spawns} spawns, {threads} threads, {len(ballast) // 1024 // 1024} MiB ballast")
+    print(f"{'method':>12} {'total s':>8} {'mean ms':>8} {'p50 ms':>7} {'p99 ms':>7}")
+    for name, kwargs_factory in methods:
+        start = time.perf_counter()
+        latencies = sorted(measure(kwargs_factory, spawns, threads))
+        total = time.perf_counter() - start
+        print(f"{name:>12} {total:>8.2f} {statistics.mean(latencies) * 1000:>8.2f} "
+              f"{latencies[len(latencies) // 2] * 1000:>7.2f} {latencies[int(len(latencies) * 0.99)] * 1000:>7.2f}",
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""Copy time of the rsync engine against the native engine of local_rsync
+
+Usage:
+    python benchmarks/sync_engines.py [small_files] [large_files] [large_mib] [workers]
+
+Two trees are generated in a temporary directory on the same filesystem the copies
+are written to: small_files files of 4 KiB in directories of 1000, and large_files
+files of large_mib MiB. Each engine copies each tree twice:
+
+    full         - into an empty directory, as the first backup does
+    incremental  - into an empty directory with the first copy as link dest, as
+                   every later backup with incremental set does
+
+The page cache is not dropped between runs, so every run after the first reads
+the source from memory. Engines are skipped if they are not available.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eljef.backup.sync import TreeSync  # noqa: E402 pylint: disable=wrong-import-position
+
+FILES_PER_DIR = 1000
+
+
+def make_small(path: str, count: int) -> None:
+    """Creates count files of 4 KiB under path"""
+    data = os.urandom(4096)
+    for num in range(count):
+        subdir = os.path.join(path, f"{num // FILES_PER_DIR:06d}")
+        if num % FILES_PER_DIR == 0:
+            os.makedirs(subdir)
+        with open(os.path.join(subdir, f"{num:09d}.dat"), 'wb') as small_file:
+            small_file.write(data)
+
+
+def make_large(path: str, count: int, mib: int) -> None:
+    """Creates count files of mib MiB under path"""
+    os.makedirs(path)
+    data = os.urandom(1024 * 1024)
+    for num in range(count):
+        with open(os.path.join(path, f"{num:06d}.dat"), 'wb') as large_file:
+            for _ in range(mib):
+                large_file.write(data)
+
+
+def rsync(source: str, dest: str, link_dest: str, _: int) -> None:
+    """Copies source into dest with rsync -a, as the rsync engine does"""
+    cmd = ['rsync', '-a'] + ([f"--link-dest={link_dest}"] if link_dest else []) + [f"{source}/", f"{dest}/"]
+    subprocess.run(cmd, check=True)
+
+
+def native(source: str, dest: str, link_dest: str, workers: int) -> None:
+    """Copies source into dest with TreeSync, as the native engine does"""
+    if not TreeSync(source, dest, link_dest=link_dest, workers=workers).run():
+        raise RuntimeError(f"native copy of {source} failed")
+
+
+def timed(copy, source: str, dest: str, link_dest: str, workers: int) -> float:
+    """Copies source into a new dest and returns the seconds taken"""
+    os.makedirs(dest)
+    start = time.perf_counter()
+    copy(source, dest, link_dest, workers)
+
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Main function"""
+    small = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    large = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    mib = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+
+    engines = [('native', native)]
+    if shutil.which('rsync'):
+        engines.insert(0, ('rsync', rsync))
+    else:
+        print('rsync not found, skipping the rsync engine')
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get('BENCH_DIR')) as tmp:
+        trees = (('small', f"{small} x 4 KiB"), ('large', f"{large} x {mib} MiB"))
+        make_small(os.path.join(tmp, 'small'), small)
+        make_large(os.path.join(tmp, 'large'), large, mib)
+
+        print(f"{'tree':>16} {'engine':>8} {'full s':>8} {'incremental s':>14}")
+        for tree, description in trees:
+            source = os.path.join(tmp, tree)
+            for name, copy in engines:
+                full_path = os.path.join(tmp, f"{tree}-{name}-full")
+                full = timed(copy, source, full_path, '', workers)
+                incremental = timed(copy, source, os.path.join(tmp, f"{tree}-{name}-incremental"), full_path, workers)
+                print(f"{description:>16} {name:>8} {full:>8.2f} {incremental:>14.2f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
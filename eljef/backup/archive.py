@@ -0,0 +1,466 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Streaming Tar Archiver"""
+
+import logging
+import os
+import sqlite3
+import stat
+import tarfile
+import zlib
+
+from typing import (BinaryIO, Callable, Dict, List, Optional, Tuple)
+
+try:
+    import grp
+    import pwd
+except ImportError:  # pragma: no cover
+    grp = pwd = None
+
+LOGGER = logging.getLogger(__name__)
+
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    '7z', 'aac', 'apk', 'avi', 'avif', 'br', 'bz2', 'deb', 'docx', 'epub', 'flac', 'gif', 'gz', 'heic', 'jar',
+    'jpeg', 'jpg', 'lz4', 'lzma', 'm4a', 'm4v', 'mkv', 'mov', 'mp3', 'mp4', 'odp', 'ods', 'odt', 'ogg', 'opus',
+    'png', 'pptx', 'rar', 'rpm', 'tbz2', 'tgz', 'txz', 'webm', 'webp', 'whl', 'xlsx', 'xz', 'zip', 'zst',
+})
+"""INCOMPRESSIBLE_EXTENSIONS holds lower case extensions of file formats that are already compressed"""
+
+LINKS_IN_MEMORY = 65536
+"""LINKS_IN_MEMORY is the number of hard linked inodes remembered in memory, further inodes are kept on disk"""
+
+SAMPLE_RATIO = 0.95
+"""SAMPLE_RATIO is the trial compression ratio at or above which a sample is considered incompressible"""
+
+SAMPLE_SIZE = 64 * 1024
+"""SAMPLE_SIZE is the amount of data trial compressed, files smaller than this are never sampled"""
+
+_TYPES = (
+    (stat.S_ISDIR, tarfile.DIRTYPE),
+    (stat.S_ISFIFO, tarfile.FIFOTYPE),
+    (stat.S_ISLNK, tarfile.SYMTYPE),
+    (stat.S_ISCHR, tarfile.CHRTYPE),
+    (stat.S_ISBLK, tarfile.BLKTYPE),
+)
+
+
+class InodeLinks:
+    """Remembers a value for each inode with more than one hard link, until all its links are seen
+
+    An inode is forgotten once as many links to it have been seen as it has. Links outside
+    of the archived tree are never seen, which is the case for every unchanged file of an
+    incremental backup linked to the previous backup, so after LINKS_IN_MEMORY inodes are
+    held, further inodes are kept in a private temporary SQLite database on disk, which
+    SQLite removes when it is closed. Memory use does not depend on the number of files.
+    """
+
+    def __init__(self) -> None:
+        self._db: Optional[sqlite3.Connection] = None
+        self._memory: Dict[Tuple[int, int], Tuple[str, int]] = {}
+
+    def __len__(self) -> int:
+        on_disk = self._db.execute('SELECT COUNT(*) FROM links').fetchone()[0] if self._db else 0
+
+        return len(self._memory) + on_disk
+
+    def add(self, stat_result: os.stat_result, value: str) -> None:
+        """Remembers value for the inode of the first link seen to it
+
+        Args:
+            stat_result: lstat result of the link
+            value: value to remember
+        """
+        inode = (stat_result.st_ino, stat_result.st_dev)
+        if len(self._memory) < LINKS_IN_MEMORY:
+            self._memory[inode] = (value, stat_result.st_nlink - 1)
+            return
+
+        if self._db is None:
+            self._db = sqlite3.connect('')
+            self._db.execute('CREATE TABLE links (ino INTEGER, dev INTEGER, value TEXT, remaining INTEGER, '
+                             'PRIMARY KEY (ino, dev))')
+        self._db.execute('INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)', (*inode, value, stat_result.st_nlink - 1))
+
+    def close(self) -> None:
+        """Forgets every inode, removing the database if one was used"""
+        self._memory.clear()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def link(self, stat_result: os.stat_result) -> Optional[str]:
+        """Counts a further link to an inode, forgetting the inode once all its links are seen
+
+        Args:
+            stat_result: lstat result of the link
+
+        Returns:
+            the value remembered for the inode, or None if it is not remembered
+        """
+        inode = (stat_result.st_ino, stat_result.st_dev)
+        if inode in self._memory:
+            value, remaining = self._memory.pop(inode)
+            if remaining > 1:
+                self._memory[inode] = (value, remaining - 1)
+            return value
+        if self._db is None:
+            return None
+
+        row = self._db.execute('SELECT value, remaining FROM links WHERE ino = ? AND dev = ?', inode).fetchone()
+        if row is None:
+            return None
+        if row[1] > 1:
+            self._db.execute('UPDATE links SET remaining = ? WHERE ino = ? AND dev = ?', (row[1] - 1, *inode))
+        else:
+            self._db.execute('DELETE FROM links WHERE ino = ? AND dev = ?', inode)
+
+        return row[0]
+
+
+class OwnerNames:
+    """Looks up user and group names, caching them as TarFile does"""
+
+    def __init__(self) -> None:
+        self._groups: Dict[int, str] = {}
+        self._users: Dict[int, str] = {}
+
+    def gname(self, gid: int) -> str:
+        """Returns the cached group name of gid"""
+        if gid not in self._groups:
+            try:
+                self._groups[gid] = grp.getgrgid(gid)[0] if grp else ''
+            except KeyError:
+                self._groups[gid] = ''
+
+        return self._groups[gid]
+
+    def uname(self, uid: int) -> str:
+        """Returns the cached user name of uid"""
+        if uid not in self._users:
+            try:
+                self._users[uid] = pwd.getpwuid(uid)[0] if pwd else ''
+            except KeyError:
+                self._users[uid] = ''
+
+        return self._users[uid]
+
+
+class TarWriter:
+    """Writes a tar archive as a stream without keeping state for archived members
+
+    tarfile.TarFile keeps a TarInfo for every archived member, so its memory use grows
+    with the number of files. TarWriter walks directories with os.scandir and writes each
+    header and its data immediately. Memory is bounded by the largest single directory,
+    which is sorted to match the member order of TarFile.add. The only per-file state kept
+    is the archive name of files with more than one hard link, which is needed to write
+    hard link members, held in InodeLinks until every link to the file has been archived.
+
+    The output is byte for byte the same as tarfile.open(fileobj=fileobj, mode='w|')
+    adding the same paths.
+
+    If fileobj has an archive index, as a ParallelCompressor writing an index does,
+    every member is recorded in it with its tar offsets.
+
+    Args:
+        fileobj: writable binary file object to write the archive to
+        tar_format: tarfile format to write headers in
+    """
+
+    encoding = tarfile.ENCODING
+    errors = 'surrogateescape'
+
+    def __init__(self, fileobj: BinaryIO, tar_format: int = tarfile.DEFAULT_FORMAT) -> None:
+        self.fileobj = fileobj
+        self.index = getattr(fileobj, 'index', None)
+        self.format = tar_format
+        self.offset = 0
+        self.closed = False
+
+        self._links = InodeLinks()
+        self._owners = OwnerNames()
+
+    def __enter__(self) -> "TarWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+
+    def _hard_link(self, arcname: str, stat_result: os.stat_result) -> str:
+        """Returns the archive name a regular file is a hard link to
+
+        Files with more than one hard link are remembered by inode, so later links to the
+        same inode are written as hard link members.
+
+        Args:
+            arcname: name of the file in the archive
+            stat_result: lstat result of the file
+
+        Returns:
+            the archive name of the first archived link to the same inode, or an empty
+            string if the file is to be archived with its data
+        """
+        if stat_result.st_nlink < 2 or not stat_result.st_ino:
+            return ''
+
+        first = self._links.link(stat_result)
+        if first is None:
+            self._links.add(stat_result, arcname)
+            return ''
+
+        return first if first != arcname else ''
+
+    def _write(self, data: bytes) -> None:
+        """Writes data to the archive, tracking the archive offset"""
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def tarinfo(self, path: str, arcname: str, stat_result: os.stat_result) -> Optional[tarfile.TarInfo]:
+        """Builds a TarInfo in the same way as TarFile.gettarinfo
+
+        Args:
+            path: full path to the file
+            arcname: name of the file in the archive
+            stat_result: lstat result of path
+
+        Returns:
+            a TarInfo for the file, or None if the file type cannot be archived
+        """
+        arcname = os.path.splitdrive(arcname)[1].replace(os.sep, '/').lstrip('/')
+        mode = stat_result.st_mode
+        linkname = ''
+
+        if stat.S_ISREG(mode):
+            linkname = self._hard_link(arcname, stat_result)
+            member_type = tarfile.LNKTYPE if linkname else tarfile.REGTYPE
+        else:
+            member_type = next((found for check, found in _TYPES if check(mode)), None)
+            if member_type is None:
+                return None
+            if member_type == tarfile.SYMTYPE:
+                linkname = os.readlink(path)
+
+        info = tarfile.TarInfo(arcname)
+        info.mode = mode
+        info.uid = stat_result.st_uid
+        info.gid = stat_result.st_gid
+        info.size = stat_result.st_size if member_type == tarfile.REGTYPE else 0
+        info.mtime = stat_result.st_mtime
+        info.type = member_type
+        info.linkname = linkname
+        if pwd:
+            info.uname = self._owners.uname(info.uid)
+        if grp:
+            info.gname = self._owners.gname(info.gid)
+        if member_type in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+            info.devmajor = os.major(stat_result.st_rdev)
+            info.devminor = os.minor(stat_result.st_rdev)
+
+        return info
+
+    def add(self, path: str, arcname: str) -> None:
+        """Adds a path to the archive, recursing into directories
+
+        Args:
+            path: full path to add
+            arcname: name of path in the archive
+        """
+        stat_result = os.lstat(path)
+        self._add_one(path, arcname, stat_result)
+
+        stack: List[Tuple[str, str, List[str]]] = []
+        if stat.S_ISDIR(stat_result.st_mode):
+            stack.append((path, arcname, _sorted_names(path)))
+
+        while stack:
+            dir_path, dir_arcname, names = stack[-1]
+            if not names:
+                stack.pop()
+                continue
+
+            name = names.pop()
+            full_path = os.path.join(dir_path, name)
+            full_arcname = os.path.join(dir_arcname, name)
+            stat_result = os.lstat(full_path)
+            if self._add_one(full_path, full_arcname, stat_result) and stat.S_ISDIR(stat_result.st_mode):
+                stack.append((full_path, full_arcname, _sorted_names(full_path)))
+
+    def _add_one(self, path: str, arcname: str, stat_result: os.stat_result) -> bool:
+        """Writes a single member to the archive
+
+        Args:
+            path: full path to the member
+            arcname: name of the member in the archive
+            stat_result: lstat result of path
+
+        Returns:
+            True if the member was written, False if its type is not supported
+        """
+        info = self.tarinfo(path, arcname, stat_result)
+        if info is None:
+            LOGGER.debug("tarfile: Unsupported type %r", path)
+            return False
+
+        start = self.offset
+        if info.isreg():
+            with open(path, 'rb') as data:
+                self.add_file(info, data)
+        else:
+            self.add_file(info)
+        if self.index is not None:
+            self.index.add_member(info, start, self.offset)
+
+        return True
+
+    def add_file(self, info: tarfile.TarInfo, fileobj: Optional[BinaryIO] = None) -> None:
+        """Writes a header and, for regular files, info.size bytes of data from fileobj
+
+        Args:
+            info: member information
+            fileobj: binary file object to read member data from
+        """
+        self._write(info.tobuf(self.format, self.encoding, self.errors))
+        if fileobj is not None:
+            tarfile.copyfileobj(fileobj, self.fileobj, info.size)
+            blocks, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            self.offset += blocks * tarfile.BLOCKSIZE
+
+    def close(self) -> None:
+        """Writes the end of archive marker and pads the archive to a full record"""
+        if self.closed:
+            return
+
+        self.closed = True
+        self._links.close()
+        self._write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        remainder = self.offset % tarfile.RECORDSIZE
+        if remainder > 0:
+            self._write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+
+
+class SplitTarWriter(TarWriter):
+    """Writes incompressible regular files to a second tar archive
+
+    Regular files that is_incompressible reports as already compressed are written to the
+    stored archive, which is opened on first use and is usually written uncompressed or with
+    a fast codec. Every other member, including directories, is written to the main archive.
+    All links to an inode go to the archive its first link went to, so hard links stay
+    within one archive. Extracting both archives into the same directory restores the full
+    tree.
+
+    Args:
+        fileobj: writable binary file object to write the main archive to
+        open_stored: callable returning the writable binary file object for the stored archive
+        tar_format: tarfile format to write headers in
+
+    Attributes:
+        stored: writer for the stored archive, None until an incompressible file is found
+    """
+
+    def __init__(self, fileobj: BinaryIO, open_stored: Callable[[], BinaryIO],
+                 tar_format: int = tarfile.DEFAULT_FORMAT) -> None:
+        super().__init__(fileobj, tar_format)
+        self.stored: Optional[TarWriter] = None
+
+        self._open_stored = open_stored
+        self._routes = InodeLinks()
+
+    def _is_stored(self, path: str, stat_result: os.stat_result) -> bool:
+        """Returns True if a regular file is written to the stored archive
+
+        Args:
+            path: full path to the file
+            stat_result: lstat result of the file
+        """
+        if stat_result.st_nlink == 1:
+            return is_incompressible(path, stat_result.st_size)
+
+        route = self._routes.link(stat_result)
+        if route is None:
+            route = 'stored' if is_incompressible(path, stat_result.st_size) else ''
+            self._routes.add(stat_result, route)
+
+        return route == 'stored'
+
+    def _add_one(self, path: str, arcname: str, stat_result: os.stat_result) -> bool:
+        if stat.S_ISREG(stat_result.st_mode) and self._is_stored(path, stat_result):
+            if self.stored is None:
+                self.stored = TarWriter(self._open_stored(), self.format)
+            return self.stored._add_one(path, arcname, stat_result)  # pylint: disable=protected-access
+
+        return super()._add_one(path, arcname, stat_result)
+
+    def close(self) -> None:
+        """Closes the main archive and the stored archive, if it was opened"""
+        if self.stored is not None:
+            self.stored.close()
+        self._routes.close()
+
+        super().close()
+
+
+def is_incompressible(path: str, size: int) -> bool:
+    """Checks if a file is already compressed
+
+    Files are checked by extension first. Files without a known extension that are at
+    least SAMPLE_SIZE bytes have a sample from their middle trial compressed with a fast
+    codec.
+
+    Args:
+        path: full path to the file
+        size: size of the file
+
+    Returns:
+        True if compressing the file is not expected to reduce its size
+    """
+    if os.path.splitext(path)[1][1:].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    if size < SAMPLE_SIZE:
+        return False
+
+    try:
+        with open(path, 'rb') as sampled:
+            sampled.seek(size // 2 - SAMPLE_SIZE // 2)
+            sample = sampled.read(SAMPLE_SIZE)
+    except OSError:
+        return False
+
+    return len(zlib.compress(sample, 1)) >= len(sample) * SAMPLE_RATIO
+
+
+def _sorted_names(path: str) -> List[str]:
+    """Returns the names in a directory in reverse sorted order, ready to be popped in sorted order
+
+    Args:
+        path: full path to the directory
+
+    Returns:
+        list of names in the directory
+    """
+    with os.scandir(path) as entries:
+        return sorted((entry.name for entry in entries), reverse=True)
+
+
+def write_tree(fileobj: BinaryIO, path: str, arcname: str,
+               open_stored: Optional[Callable[[], BinaryIO]] = None) -> int:
+    """Writes a directory tree as a tar archive
+
+    Args:
+        fileobj: writable binary file object to write the archive to
+        path: full path to the directory tree
+        arcname: name of path in the archive
+        open_stored: if set, incompressible files are written to a second archive in the
+                     binary file object returned by this callable
+
+    Returns:
+        size of the written archive
+    """
+    writer = SplitTarWriter(fileobj, open_stored) if open_stored else TarWriter(fileobj)
+    with writer:
+        writer.add(path, arcname)
+
+    return writer.offset
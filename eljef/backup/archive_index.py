@@ -0,0 +1,269 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Random Access Archive Index"""
+
+import bisect
+import gzip
+import io
+import json
+import logging
+import os
+import tarfile
+
+from typing import (Dict, Iterator, List, Optional, Tuple)
+
+from eljef.backup.compression import (INDEX, PARTIAL, Codec, codec_of)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ArchiveIndex:
+    """Writes the sidecar index of an archive made of independently compressed frames
+
+    The index is a gzip compressed file of JSON lines. Each archived member is written
+    as soon as it is archived, holding the member name, the uncompressed tar offsets the
+    member starts and ends at, and the link target of hard links. The last line holds the
+    frame table: the compressed offset and size, and the uncompressed offset and size, of
+    every frame. Memory use does not depend on the number of members.
+
+    Args:
+        archive_path: full path to the archive being indexed
+    """
+
+    def __init__(self, archive_path: str) -> None:
+        self.path = f"{archive_path}.{INDEX}"
+        self.frames: List[List[int]] = []
+
+        self._compressed = 0
+        self._uncompressed = 0
+        self._file = gzip.open(f"{self.path}.{PARTIAL}", 'wt', encoding='utf-8')  # pylint: disable=consider-using-with
+
+    def abort(self) -> None:
+        """Stops indexing and removes the partial index"""
+        if self._file.closed:
+            return
+
+        self._file.close()
+        try:
+            os.remove(f"{self.path}.{PARTIAL}")
+        except FileNotFoundError:
+            pass
+
+    def add_frame(self, compressed_size: int, uncompressed_size: int) -> None:
+        """Records the next frame written to the archive
+
+        Args:
+            compressed_size: size of the frame in the archive
+            uncompressed_size: size of the data in the frame
+        """
+        self.frames.append([self._compressed, compressed_size, self._uncompressed, uncompressed_size])
+        self._compressed += compressed_size
+        self._uncompressed += uncompressed_size
+
+    def add_member(self, info: tarfile.TarInfo, start: int, end: int) -> None:
+        """Records an archived member
+
+        Args:
+            info: member information
+            start: uncompressed tar offset of the first header of the member
+            end: uncompressed tar offset after the data of the member
+        """
+        entry = {'n': info.name, 's': start, 'e': end}
+        if info.islnk():
+            entry['l'] = info.linkname
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def close(self) -> None:
+        """Writes the frame table and moves the index into place"""
+        if self._file.closed:
+            return
+
+        self._file.write(json.dumps({'frames': self.frames}, separators=(',', ':')) + '\n')
+        self._file.close()
+        os.replace(f"{self.path}.{PARTIAL}", self.path)
+
+    def copy_members(self, index_path: str) -> None:
+        """Copies the member entries of another index of the same tar stream
+
+        Args:
+            index_path: full path to the index to copy members from
+        """
+        with gzip.open(index_path, 'rt', encoding='utf-8') as index:
+            for line in index:
+                if not line.startswith('{"frames"'):
+                    self._file.write(line)
+
+
+class FrameReader:
+    """Reads ranges of the uncompressed tar stream by decompressing only the frames holding them
+
+    Args:
+        archive_path: full path to the archive
+        codec: codec of the archive
+        frames: frame table from the archive index
+    """
+
+    def __init__(self, archive_path: str, codec: Codec, frames: List[List[int]]) -> None:
+        self.codec = codec
+        self.frames = frames
+        self.decompressed = 0
+
+        self._cached: Tuple[int, bytes] = (-1, b'')
+        self._file = open(archive_path, 'rb')  # pylint: disable=consider-using-with
+        self._starts = [frame[2] for frame in frames]
+
+    def __enter__(self) -> "FrameReader":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._file.close()
+
+    def _frame(self, num: int) -> bytes:
+        """Returns the decompressed data of a frame, caching the last frame read"""
+        if self._cached[0] != num:
+            compressed_offset, compressed_size = self.frames[num][:2]
+            self._file.seek(compressed_offset)
+            with self.codec.reader(io.BytesIO(self._file.read(compressed_size))) as reader:
+                self._cached = (num, reader.read())
+            self.decompressed += 1
+
+        return self._cached[1]
+
+    def read_at(self, offset: int, end: int) -> memoryview:
+        """Reads from an uncompressed offset up to end or the end of the frame holding it
+
+        Args:
+            offset: uncompressed offset to read from
+            end: uncompressed offset to read to at most
+
+        Returns:
+            the uncompressed data, empty at the end of the tar stream
+        """
+        num = bisect.bisect_right(self._starts, offset) - 1
+        if num < 0:
+            return memoryview(b'')
+
+        return memoryview(self._frame(num))[offset - self._starts[num]:end - self._starts[num]]
+
+    def open(self, start: int, end: int) -> io.BufferedReader:
+        """Opens a range of the uncompressed tar stream, decompressing one frame at a time as it is read
+
+        Args:
+            start: uncompressed offset to read from
+            end: uncompressed offset to read to
+
+        Returns:
+            a file object reading the uncompressed data between start and end
+        """
+        return io.BufferedReader(_FrameRange(self, start, end))
+
+
+class _FrameRange(io.RawIOBase):
+    """Raw file object reading a range of the uncompressed tar stream from a FrameReader"""
+
+    def __init__(self, reader: FrameReader, start: int, end: int) -> None:
+        super().__init__()
+        self._reader = reader
+        self._offset = start
+        self._end = end
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._reader.read_at(self._offset, min(self._end, self._offset + len(buffer)))
+        buffer[:len(data)] = data
+        self._offset += len(data)
+
+        return len(data)
+
+
+def _index_entries(index_path: str) -> Iterator[dict]:
+    """Yields every line of an index
+
+    Args:
+        index_path: full path to the index
+
+    Returns:
+        iterator of decoded index lines
+    """
+    with gzip.open(index_path, 'rt', encoding='utf-8') as index:
+        for line in index:
+            yield json.loads(line)
+
+
+def _select(index_path: str, paths: List[str]) -> Tuple[Dict[str, dict], List[List[int]]]:
+    """Finds index entries of paths, the members below them, and the targets of selected hard links
+
+    Args:
+        index_path: full path to the index
+        paths: archive member names to select
+
+    Returns:
+        A tuple of selected entries keyed by member name and the frame table
+    """
+    wanted = [path.strip('/') for path in paths]
+    selected: Dict[str, dict] = {}
+    frames: List[List[int]] = []
+    link_targets = set()
+
+    for entry in _index_entries(index_path):
+        if 'frames' in entry:
+            frames = entry['frames']
+        elif any(entry['n'] == path or entry['n'].startswith(f"{path}/") for path in wanted):
+            selected[entry['n']] = entry
+            if 'l' in entry:
+                link_targets.add(entry['l'])
+
+    link_targets -= set(selected)
+    if link_targets:
+        for entry in _index_entries(index_path):
+            if 'n' in entry and entry['n'] in link_targets:
+                selected[entry['n']] = entry
+
+    return selected, frames
+
+
+def extract(archive_path: str, paths: List[str], output_path: str, index_path: Optional[str] = None) -> int:
+    """Extracts members from an archive using its index, decompressing only the frames holding them
+
+    Args:
+        archive_path: full path to the archive
+        paths: member names to extract, directories are extracted with everything below them
+        output_path: full path to the directory to extract into
+        index_path: full path to the index, defaults to the archive path with .idx appended
+
+    Notes:
+        Members are extracted with the tar extraction filter, so no member is written outside
+        of output_path, and setuid, setgid and group or other write bits are not restored.
+        Each member is read from the frames holding it one frame at a time, so memory use
+        does not depend on the size of the member.
+
+    Returns:
+        number of members extracted
+
+    Raises:
+        FileNotFoundError: the archive or index does not exist, or no members matched paths
+        ValueError: the archive is not an archive of a registered codec
+    """
+    codec = codec_of(archive_path)
+    if codec is None:
+        raise ValueError(f"not an archive of a registered codec: {archive_path}")
+
+    selected, frames = _select(index_path or f"{archive_path}.{INDEX}", paths)
+    if not selected:
+        raise FileNotFoundError(f"no members found for: {', '.join(paths)}")
+
+    with FrameReader(archive_path, codec, frames) as reader:
+        for entry in sorted(selected.values(), key=lambda found: found['s']):
+            with reader.open(entry['s'], entry['e']) as member_data, \
+                    tarfile.open(fileobj=member_data, mode='r|') as tar:
+                if hasattr(tarfile, 'tar_filter'):
+                    tar.extraction_filter = staticmethod(tarfile.tar_filter)
+                for member in tar:
+                    tar.extract(member, output_path)
+        LOGGER.info("extracted %d members from %s, decompressed %d of %d frames", len(selected), archive_path,
+                    reader.decompressed, len(frames))
+
+    return len(selected)
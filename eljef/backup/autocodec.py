@@ -0,0 +1,238 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+# pylint: disable=too-few-public-methods
+
+"""Automatic Codec Selection"""
+
+import logging
+import os
+import random
+import stat
+import time
+
+from typing import (List, Tuple)
+
+from eljef.backup.compression import (CODECS, get_codec, validate_codec, worker_count)
+
+LOGGER = logging.getLogger(__name__)
+
+SAMPLE_CHUNK = 1024 * 1024
+"""SAMPLE_CHUNK is the default amount of data read from each sampled file"""
+
+SAMPLE_FILES = 32
+"""SAMPLE_FILES is the default number of files sampled"""
+
+
+class CodecSample:
+    """Measured performance of a codec on sampled data
+
+    Args:
+        codec: name of the codec
+        level: compression level
+        ratio: compressed size divided by uncompressed size
+        speed: single worker compression speed in MB/s
+    """
+
+    def __init__(self, codec: str, level: int, ratio: float, speed: float) -> None:
+        self.codec = codec
+        self.level = level
+        self.ratio = ratio
+        self.speed = speed
+
+    def minutes(self, total_size: int, workers: int) -> float:
+        """Estimates the minutes needed to compress data with this codec
+
+        Args:
+            total_size: amount of data to compress in bytes
+            workers: number of compression workers
+
+        Returns:
+            estimated minutes
+        """
+        return total_size / (self.speed * 1000000 * worker_count(workers)) / 60
+
+
+class AutoCodec:
+    """Settings for automatic codec selection
+
+    Attributes:
+        candidates: list of (codec, level) tuples to measure
+        max_minutes: pick the best ratio estimated to finish within this many minutes, 0 disables
+        min_speed: pick the best ratio compressing at least this many MB/s per worker, 0 disables
+        sample_chunk: amount of data read from each sampled file
+        sample_files: maximum number of files sampled
+
+    Notes:
+        If no candidate meets the targets, the fastest candidate is picked.
+        If no targets are set, the best ratio is picked.
+    """
+
+    def __init__(self) -> None:
+        self.candidates: List[Tuple[str, int]] = [(codec.name, codec.default_level)
+                                                  for codec in CODECS.values() if codec.available]
+        self.max_minutes = 0
+        self.min_speed = 0
+        self.sample_chunk = SAMPLE_CHUNK
+        self.sample_files = SAMPLE_FILES
+
+    def setup(self, info: dict) -> str:
+        """Loads settings from a configuration dictionary
+
+        Args:
+            info: dictionary of auto settings from a configuration file
+
+        Returns:
+            An empty string if no errors, error message otherwise.
+        """
+        candidates = info.get('candidates')
+        if candidates:
+            if not isinstance(candidates, list):
+                return 'candidates not list'
+            self.candidates = []
+            for candidate in candidates:
+                if not isinstance(candidate, dict):
+                    return 'each candidate must contain a codec'
+                codec, level, msg = validate_codec(candidate.get('codec', ''), candidate.get('level'))
+                if msg:
+                    return msg
+                self.candidates.append((codec, level))
+
+        for setting in ('max_minutes', 'min_speed', 'sample_chunk', 'sample_files'):
+            value = info.get(setting, getattr(self, setting))
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                return f"{setting} must be a positive number"
+            setattr(self, setting, value)
+
+        if self.sample_chunk < 1 or self.sample_files < 1:
+            return 'sample_chunk and sample_files must be greater than zero'
+
+        return ''
+
+    def select(self, path: str, workers: int) -> CodecSample:
+        """Samples files in path and picks the codec meeting the configured targets
+
+        Args:
+            path: full path to the directory to be compressed
+            workers: number of compression workers
+
+        Returns:
+            measurements of the picked codec
+        """
+        sample, total_size = sample_directory(path, int(self.sample_files), int(self.sample_chunk))
+        measured = measure_codecs(sample, self.candidates)
+        for result in measured:
+            LOGGER.info("auto codec: %s level %d: ratio %.3f, %.1f MB/s, estimated %.1f minutes",
+                        result.codec, result.level, result.ratio, result.speed, result.minutes(total_size, workers))
+
+        chosen = pick_codec(measured, total_size, workers, self.max_minutes, self.min_speed)
+        LOGGER.info("auto codec: chose %s level %d for %d bytes sampled from %d bytes", chosen.codec, chosen.level,
+                    len(sample), total_size)
+
+        return chosen
+
+
+def measure_codecs(sample: bytes, candidates: List[Tuple[str, int]]) -> List[CodecSample]:
+    """Compresses sampled data with each candidate codec
+
+    Args:
+        sample: sampled data
+        candidates: list of (codec, level) tuples to measure
+
+    Returns:
+        list of measurements in candidate order
+    """
+    measured = []
+    for name, level in candidates:
+        codec = get_codec(name)
+        start = time.perf_counter()
+        compressed = codec.compress(sample, level)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        ratio = len(compressed) / len(sample) if sample else 1.0
+        measured.append(CodecSample(name, level, ratio, max(len(sample), 1) / elapsed / 1000000))
+
+    return measured
+
+
+# pylint: disable=too-many-arguments
+def pick_codec(measured: List[CodecSample], total_size: int, workers: int, max_minutes: float,
+               min_speed: float) -> CodecSample:
+    """Picks the codec with the best ratio that meets the targets
+
+    Args:
+        measured: list of codec measurements
+        total_size: amount of data to compress in bytes
+        workers: number of compression workers
+        max_minutes: maximum estimated minutes, 0 disables this target
+        min_speed: minimum speed per worker in MB/s, 0 disables this target
+
+    Returns:
+        the picked measurement, or the fastest measurement if none meet the targets
+    """
+    meets = [result for result in measured if not max_minutes or result.minutes(total_size, workers) <= max_minutes]
+    meets = [result for result in meets if not min_speed or result.speed >= min_speed]
+    if meets:
+        return min(meets, key=lambda result: result.ratio)
+
+    return max(measured, key=lambda result: result.speed)
+
+
+def _choose_files(path: str, max_files: int) -> Tuple[List[Tuple[str, int]], int]:
+    """Chooses up to max_files regular files of a directory tree, each equally likely to be chosen
+
+    Args:
+        path: full path to the directory to choose files from
+        max_files: maximum number of files to choose
+
+    Returns:
+        A tuple of the full path and size of each chosen file, and the total size of all
+        regular files in path
+    """
+    chosen: List[Tuple[str, int]] = []
+    total_size = 0
+    seen = 0
+    rand = random.Random(0)
+
+    for root, _, files in os.walk(path):
+        for name in files:
+            full_path = os.path.join(root, name)
+            try:
+                stat_result = os.lstat(full_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(stat_result.st_mode) or not stat_result.st_size:
+                continue
+            size = stat_result.st_size
+            total_size += size
+            seen += 1
+            if len(chosen) < max_files:
+                chosen.append((full_path, size))
+            else:
+                pos = rand.randrange(seen)
+                if pos < max_files:
+                    chosen[pos] = (full_path, size)
+
+    return chosen, total_size
+
+
+def sample_directory(path: str, max_files: int, chunk_size: int) -> Tuple[bytes, int]:
+    """Reads a bounded sample of data from files in a directory tree
+
+    Args:
+        path: full path to the directory to sample
+        max_files: maximum number of files to sample
+        chunk_size: amount of data read from the middle of each sampled file
+
+    Returns:
+        A tuple of the sampled data and the total size of all regular files in path
+    """
+    chosen, total_size = _choose_files(path, max_files)
+    sample = bytearray()
+    for full_path, size in chosen:
+        try:
+            with open(full_path, 'rb') as sampled:
+                sampled.seek(max(0, size // 2 - chunk_size // 2))
+                sample += sampled.read(chunk_size)
+        except OSError:
+            continue
+
+    return bytes(sample), total_size
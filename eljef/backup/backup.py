@@ -3,16 +3,21 @@
 
 """Backup Functionality"""
 
+import contextlib
 import datetime
 import inspect
 import glob
 import logging
 import os
 import pkgutil
-import tarfile
 
-from typing import Union
+from typing import (Optional, Union)
 
+from eljef.backup.archive import write_tree
+from eljef.backup.archive_index import ArchiveIndex
+from eljef.backup.compression import (STORED, ParallelCompressor, find_archives, get_codec)
+from eljef.backup.history import (HISTORY_FILE, History)
+from eljef.backup.journal import (JOURNAL, Journal)
 from eljef.backup.notifiers.holder import Holder
 from eljef.backup.plugins.plugin import SetupPlugin
 from eljef.backup.project import (Paths, Projects)
@@ -23,19 +28,48 @@
 
 LOGGER = logging.getLogger(__name__)
 
+NAME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+"""NAME_FORMAT is the datetime format used to name parent backup directories"""
 
-def compress_backup_directory(backup_path: str, parent_path: str, backup_name: str):
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def compress_backup_directory(backup_path: str, parent_path: str, backup_name: str, codec: str = 'bz2',
+                              level: Optional[int] = None, workers: int = 0, stored_codec: str = '',
+                              stored_level: Optional[int] = None, index: bool = False) -> str:
     """Compresses the backup directory
 
     Args:
         backup_path: full path to base backup directory
         parent_path: full path to the parent backup directory
         backup_name: name of the backup folder for the currently running backup
+        codec: name of the registered codec to compress with
+        level: compression level, None uses the default level of the codec
+        workers: number of compression workers, zero or less uses one per cpu
+        stored_codec: if set, files that are already compressed are written to a separate
+                      <backup_name>.stored archive using this codec instead of codec
+        stored_level: compression level for stored_codec, None uses the default level of the codec
+        index: write a <archive>.idx sidecar index for each archive, used to extract single members
+
+    Returns:
+        full path to the created archive
     """
-    tar_path = os.path.join(backup_path, f"{backup_name}.tar.bz2")
+    codec_object = get_codec(codec)
+    tar_path = os.path.join(backup_path, f"{backup_name}.{codec_object.extension}")
+
+    with contextlib.ExitStack() as stack:
+        stream = stack.enter_context(ParallelCompressor(tar_path, codec_object, level, workers,
+                                                        index=ArchiveIndex(tar_path) if index else None))
 
-    with tarfile.open(tar_path, "w:bz2") as tar:
-        tar.add(parent_path, arcname=backup_name)
+        def open_stored() -> ParallelCompressor:
+            stored_codec_object = get_codec(stored_codec)
+            stored_path = os.path.join(backup_path, f"{backup_name}.{STORED}.{stored_codec_object.extension}")
+            LOGGER.debug("writing already compressed files to: %s", stored_path)
+            return stack.enter_context(ParallelCompressor(stored_path, stored_codec_object, stored_level, workers,
+                                                          index=ArchiveIndex(stored_path) if index else None))
+
+        write_tree(stream, parent_path, backup_name, open_stored if stored_codec else None)
+
+    return tar_path
 
 
 def create_child_backup_directory(backup_path: str, child: str) -> str:
@@ -56,6 +90,38 @@ def create_child_backup_directory(backup_path: str, child: str) -> str:
     return path
 
 
+def find_previous_backup(backups_path: str, backup_name: str) -> str:
+    """Finds the most recent complete backup directory made before a backup
+
+    Backups that still have a journal did not complete and are skipped, as are backups
+    only kept as archives.
+
+    Args:
+        backups_path: full path to the base backups directory
+        backup_name: name of the current backup
+
+    Returns:
+        full path to the previous backup directory, or an empty string if there is none
+    """
+    try:
+        names = os.listdir(backups_path)
+    except OSError:
+        return ''
+
+    for name in sorted(names, reverse=True):
+        if name >= backup_name or os.path.exists(os.path.join(backups_path, f"{name}.{JOURNAL}")):
+            continue
+        try:
+            datetime.datetime.strptime(name, NAME_FORMAT)
+        except ValueError:
+            continue
+        full_path = os.path.join(backups_path, name)
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            return full_path
+
+    return ''
+
+
 def rsync_terminate_path(path: str) -> str:
     """adds a trailing slash to the end of the path
 
@@ -73,12 +139,21 @@ def rsync_terminate_path(path: str) -> str:
 
 # pylint: disable=too-many-instance-attributes
 class Backup:
-    """The Backup running class."""
-    def __init__(self, console: bool, config_file: str, defaults: dict) -> None:
+    """The Backup running class.
+
+    Args:
+        console: print notifications to the console
+        config_file: path to the backup configuration file
+        defaults: default settings
+        resume: name of a failed backup to resume, skipping the stages it completed
+    """
+    def __init__(self, console: bool, config_file: str, defaults: dict, resume: str = '') -> None:
         self._config_file = config_file
 
+        self._journal = Journal('')
         self._parent_dir = ''
-        self._parent_name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self._parent_name = resume or datetime.datetime.now().strftime(NAME_FORMAT)
+        self._resume = bool(resume)
 
         self._projects: Union[Projects, None] = None
 
@@ -133,19 +208,29 @@ def __failure_cleanup(self) -> bool:
             False always
         """
         if not self._settings.backup.skip_backup_directory and self._settings.backup.clean_on_failure:
+            self.__delete_failed_backup()
+        elif self._journal.path:
+            LOGGER.warning("resume this backup with: --resume %s", self._parent_name)
+
+        return False
+
+    def __delete_failed_backup(self) -> None:
+        """Deletes the directory, archives and journal of a failed backup"""
+        try:
+            fops.delete(self._parent_dir)
+        except Exception as exception_object:  # pylint: disable=broad-exception-caught
+            self._notif.failure(f"load config: {exception_object}")
+        for archive in find_archives(self._settings.backup.path, self._parent_name):
             try:
-                fops.delete(self._parent_dir)
+                fops.delete(archive)
+            except FileNotFoundError:
+                pass
             except Exception as exception_object:  # pylint: disable=broad-exception-caught
                 self._notif.failure(f"load config: {exception_object}")
-            for ext in ('tar.gz', 'tar.bz2'):
-                try:
-                    fops.delete(f"{self._parent_dir}.{ext}")
-                except FileNotFoundError:
-                    pass
-                except Exception as exception_object:  # pylint: disable=broad-exception-caught
-                    self._notif.failure(f"load config: {exception_object}")
-
-        return False
+        try:
+            self._journal.delete()
+        except OSError as exception_object:
+            self._notif.failure(f"delete journal: {exception_object}")
 
     def load_config(self) -> bool:
         """Loads the configuration file and any project files loaded in projects_folder if defined
@@ -200,6 +285,41 @@ def __load_configs(self, folder_path: str) -> dict:
         with fops.pushd(full_path):
             return self.__load_configs_from_folder()
 
+    def __resume_error(self) -> str:
+        """Returns why the backup being resumed cannot be resumed
+
+        Returns:
+            the reason, or an empty string if the backup can be resumed
+        """
+        settings = self._settings.backup
+        if settings.clean_on_failure and not settings.get('continue_on_failure', False):
+            return 'clean_on_failure deletes failed backups, set it to false to resume backups'
+        if settings.path and not settings.skip_backup_directory and \
+                not os.path.isdir(os.path.join(settings.path, self._parent_name)):
+            return 'its backup directory no longer exists'
+
+        return ''
+
+    def load_journal(self) -> bool:
+        """Starts the journal of this backup, or loads it when resuming a failed backup
+
+        Returns:
+            True if successful, False otherwise
+        """
+        path = self._settings.backup.path
+        resume_error = self.__resume_error() if self._resume else ''
+        if resume_error:
+            self._notif.failure(f"load journal: cannot resume {self._parent_name}: {resume_error}")
+            return False
+        try:
+            self._journal = Journal(os.path.join(path, f"{self._parent_name}.{JOURNAL}") if path else '',
+                                    self._resume)
+        except Exception as exception_object:  # pylint: disable=broad-exception-caught
+            self._notif.failure(f"load journal: {exception_object}")
+            return False
+
+        return True
+
     def load_notifier_configs(self) -> bool:
         """Loads configs for notifiers.
 
@@ -272,13 +392,39 @@ def prepare(self) -> bool:
         """
         try:
             paths = Paths(self._settings.backup.path, self._parent_dir, self._parent_name)
-            self._projects = Projects(paths, self._plugins, self._project_configs)
+            history_file = self._settings.backup.get('history_file')
+            if history_file is None and self._settings.backup.path:
+                history_file = os.path.join(self._settings.backup.path, HISTORY_FILE)
+            self._projects = Projects(paths, self._plugins, self._project_configs,
+                                      self._settings.backup.get('pipeline_depth', 1),
+                                      self._settings.backup.get('max_parallel_projects', 1),
+                                      self._settings.backup.get('resource_limits', {}),
+                                      History(history_file or ''),
+                                      self._settings.backup.get('time_budget', 0), self._journal,
+                                      self._settings.backup.get('continue_on_failure', False))
         except Exception as exception_object:  # pylint: disable=broad-exception-caught
             self._notif.failure(f"prepare projects: {exception_object}")
             return self.__failure_cleanup()
 
         return True
 
+    def __partial_failure(self, error_msg: str) -> bool:
+        """Reports projects that did not complete, keeping the backups of projects that did
+
+        Args:
+            error_msg: error message of the run
+
+        Returns:
+            False always
+        """
+        self._notif.failure(f"backup {self._parent_name}: {error_msg}\n{self._projects.summary()}")
+        if 'completed' not in self._projects.status.values():
+            return self.__failure_cleanup()
+        if self._journal.path:
+            LOGGER.warning("resume this backup with: --resume %s", self._parent_name)
+
+        return False
+
     def run(self) -> bool:
         """Runs all projects.
 
@@ -287,8 +433,10 @@ def run(self) -> bool:
         """
         try:
             finished, error_msg, project = self._projects.run()
+            if not finished and self._projects.continue_on_failure:
+                return self.__partial_failure(error_msg)
             if not finished:
-                self._notif.failure(f"{project}: {error_msg}")
+                self._notif.failure(f"{project}: {error_msg}" if project else error_msg)
                 return self.__failure_cleanup()
         except Exception as exception_object:  # pylint: disable=broad-exception-caught
             self._notif.failure(f"run projects: {exception_object}")
@@ -298,4 +446,13 @@ def run(self) -> bool:
 
     def success(self) -> None:
         """Prints a success message to all notifiers"""
-        self._notif.success(f"backup successful: {self._parent_name}")
+        msg = f"backup successful: {self._parent_name}"
+        if self._projects is not None and self._projects.regressions:
+            msg += f" (slower than usual: {', '.join(self._projects.regressions)})"
+
+        try:
+            self._journal.delete()
+        except OSError as exception_object:
+            LOGGER.warning("cannot delete journal %s: %s", self._journal.path, exception_object)
+
+        self._notif.success(msg)
@@ -10,6 +10,19 @@
             {'dest': 'debug_log', 'action': 'store_true', 'help': 'Enable debug output.'}),
     cli.Arg(['-f', '--file'],
             {'dest': 'config_file', 'metavar': 'config.yaml', 'help': 'Path to configuration file.'}),
+    cli.Arg(['-m', '--member'],
+            {'dest': 'extract_members', 'metavar': 'path', 'action': 'append', 'default': [],
+             'help': 'Path in the archive to extract with --extract. May be given more than once.'}),
+    cli.Arg(['-o', '--output'],
+            {'dest': 'extract_output', 'metavar': 'directory', 'default': '.',
+             'help': 'Directory to extract into with --extract. Defaults to the current directory.'}),
+    cli.Arg(['-r', '--resume'],
+            {'dest': 'resume_name', 'metavar': 'backup_name', 'default': '',
+             'help': 'Resume a failed backup, such as 2023-06-01_00-00-00, skipping the steps it completed. '
+                     'Needs clean_on_failure set to false, or continue_on_failure set to true.'}),
     cli.Arg(['-v', '--version'],
-            {'dest': 'version_out', 'action': 'store_true', 'help': 'Print version and exit.'})
+            {'dest': 'version_out', 'action': 'store_true', 'help': 'Print version and exit.'}),
+    cli.Arg(['-x', '--extract'],
+            {'dest': 'extract_archive', 'metavar': 'archive',
+             'help': 'Extract --member paths from an indexed archive instead of running a backup.'})
 ]
@@ -5,6 +5,7 @@
 
 import logging
 
+from eljef.backup.archive_index import extract
 from eljef.backup.backup import Backup
 from eljef.backup.cli.__args__ import CMD_LINE_ARGS
 from eljef.backup.cli.__vars__ import (DEFAULTS, PROJECT_DESCRIPTION, PROJECT_NAME, PROJECT_VERSION)
@@ -24,6 +25,27 @@ def check_fail(ret: bool) -> None:
         raise SystemExit(1)
 
 
+def extract_members(archive: str, members: list, output: str) -> None:
+    """Extracts members from an indexed archive and exits.
+
+    Args:
+        archive: path to the archive
+        members: paths in the archive to extract
+        output: directory to extract into
+    """
+    if not members:
+        LOGGER.fatal('extract: no --member paths given')
+        raise SystemExit(1)
+
+    try:
+        extract(archive, members, output)
+    except Exception as exception_object:  # pylint: disable=broad-exception-caught
+        LOGGER.fatal("extract: %s", exception_object)
+        raise SystemExit(1) from exception_object
+
+    raise SystemExit(0)
+
+
 def main() -> None:
     """Main function"""
     args = cli.args_simple(PROJECT_NAME, PROJECT_DESCRIPTION, CMD_LINE_ARGS)
@@ -33,12 +55,16 @@ def main() -> None:
 
     setup_app_logging(args.debug_log)
 
-    backup = Backup(True, args.config_file, DEFAULTS)
+    if args.extract_archive:
+        extract_members(args.extract_archive, args.extract_members, args.extract_output)
+
+    backup = Backup(True, args.config_file, DEFAULTS, args.resume_name)
     check_fail(backup.load_config())
     check_fail(backup.load_notifier_configs())
     check_fail(backup.enable_notifiers())
     check_fail(backup.load_plugins())
     check_fail(backup.load_project_configs())
+    check_fail(backup.load_journal())
     check_fail(backup.create_parent_backup_directory())
     check_fail(backup.prepare())
     check_fail(backup.run())
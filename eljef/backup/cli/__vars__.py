@@ -16,11 +16,16 @@
 DEFAULTS = {
     'backup': {
         'clean_on_failure': True,
+        'continue_on_failure': False,
         'skip_backup_directory': False,
+        'max_parallel_projects': 1,
         'path': '',
+        'pipeline_depth': 1,
         'notifiers_folder': '',
         'notifiers': {},
         'projects_folder': '',
-        'projects': {}
+        'projects': {},
+        'resource_limits': {},
+        'time_budget': 0
     }
 }
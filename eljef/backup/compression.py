@@ -0,0 +1,533 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Parallel Block Compression"""
+
+import bz2
+import collections
+import concurrent.futures
+import functools
+import gzip
+import importlib.util
+import io
+import logging
+import lzma
+import os
+import time
+
+from typing import (BinaryIO, Callable, Deque, Dict, List, Optional, Tuple, Union)
+
+try:
+    import lz4.frame
+except ImportError:  # pragma: no cover
+    lz4 = None  # pylint: disable=invalid-name
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # pylint: disable=invalid-name
+
+LOGGER = logging.getLogger(__name__)
+
+BLOCK_SIZE = 8 * 1024 * 1024
+"""BLOCK_SIZE is the amount of uncompressed data compressed into each independent stream"""
+
+INDEX = 'idx'
+"""INDEX is added after the extension of archive index files"""
+
+PARTIAL = 'part'
+"""PARTIAL is added after the extension of archives that are still being written"""
+
+STORED = 'stored'
+"""STORED is added before the extension of archives holding files that were already compressed"""
+
+
+class Codec:
+    """Compression codec used for archives
+
+    Args:
+        name: name of the codec as used in configuration files
+        extension: archive file extension, without a leading period
+        compress: function compressing one block at a level into a complete stream
+        reader: function wrapping a readable binary file object with a stream that decompresses
+                all concatenated streams in it
+        default_level: level used when no level is configured
+        levels: inclusive minimum and maximum supported levels
+        module: name of the python module required by this codec, if any
+
+    Notes:
+        Every codec must produce streams that are valid when concatenated, so blocks
+        compressed in parallel form one standard file.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, name: str, extension: str, compress: Callable[[bytes, int], bytes],
+                 reader: Callable[[BinaryIO], BinaryIO], default_level: int, levels: Tuple[int, int],
+                 module: str = '') -> None:
+        self.name = name
+        self.extension = extension
+        self.compress = compress
+        self.reader = reader
+        self.default_level = default_level
+        self.levels = levels
+        self.module = module
+
+    @property
+    def available(self) -> bool:
+        """True if the module required by this codec is installed"""
+        return not self.module or importlib.util.find_spec(self.module) is not None
+
+    def validate_level(self, level: Optional[int]) -> Tuple[int, str]:
+        """Checks a configured level against the levels supported by this codec
+
+        Args:
+            level: configured level, None uses the default level
+
+        Returns:
+            A tuple of the level to use and an error message if the level is not valid
+        """
+        if level is None:
+            return self.default_level, ''
+        if isinstance(level, bool) or not isinstance(level, int):
+            return 0, 'level must be an integer'
+        if not self.levels[0] <= level <= self.levels[1]:
+            return 0, f"{self.name} level must be between {self.levels[0]} and {self.levels[1]}"
+
+        return level, ''
+
+
+def _compress_bz2(data: bytes, level: int) -> bytes:
+    """Compresses a block into a complete bzip2 stream"""
+    return bz2.compress(data, level)
+
+
+def _compress_gzip(data: bytes, level: int) -> bytes:
+    """Compresses a block into a complete gzip member"""
+    return gzip.compress(data, level, mtime=0)
+
+
+def _compress_lz4(data: bytes, level: int) -> bytes:
+    """Compresses a block into a complete lz4 frame"""
+    return lz4.frame.compress(data, compression_level=level)
+
+
+def _compress_none(data: bytes, level: int) -> bytes:  # pylint: disable=unused-argument
+    """Returns a block unchanged"""
+    return data
+
+
+def _compress_xz(data: bytes, level: int) -> bytes:
+    """Compresses a block into a complete xz stream"""
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+
+def _compress_zstd(data: bytes, level: int) -> bytes:
+    """Compresses a block into a complete zstd frame"""
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _reader_bz2(fileobj: BinaryIO) -> BinaryIO:
+    """Opens a bzip2 stream for reading"""
+    return bz2.BZ2File(fileobj, 'rb')
+
+
+def _reader_gzip(fileobj: BinaryIO) -> BinaryIO:
+    """Opens a gzip stream for reading"""
+    return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+def _reader_lz4(fileobj: BinaryIO) -> BinaryIO:
+    """Opens an lz4 stream for reading"""
+    return lz4.frame.LZ4FrameFile(fileobj, 'rb')
+
+
+def _reader_none(fileobj: BinaryIO) -> BinaryIO:
+    """Returns an uncompressed stream unchanged"""
+    return fileobj
+
+
+def _reader_xz(fileobj: BinaryIO) -> BinaryIO:
+    """Opens an xz stream for reading"""
+    return lzma.LZMAFile(fileobj, 'rb')
+
+
+def _reader_zstd(fileobj: BinaryIO) -> BinaryIO:
+    """Opens a zstd stream for reading"""
+    return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+
+
+CODECS: Dict[str, Codec] = {}
+"""CODECS is the registry of archive codecs keyed by codec name"""
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def recompress_archive(source: str, target: str, codec: Union[Codec, str], level: Optional[int] = None,
+                       workers: int = 0, deadline: float = 0, index=None) -> None:
+    """Recompresses an archive with another codec
+
+    Args:
+        source: full path to an archive of a registered codec
+        target: full path to the archive to write
+        codec: registered codec, or name of a registered codec, to compress target with
+        level: compression level, None uses the default level of the codec
+        workers: number of compression workers, zero or less uses one per cpu
+        deadline: time.time() after which recompression is stopped, 0 disables the deadline
+        index: if set, frames of target are recorded in this archive index
+
+    Raises:
+        TimeoutError: the deadline passed, the partial target has been removed
+        ValueError: source is not an archive of a registered codec
+    """
+    source_codec = codec_of(source)
+    if source_codec is None:
+        raise ValueError(f"not an archive of a registered codec: {source}")
+
+    with open(source, 'rb') as raw, source_codec.reader(raw) as reader:
+        with ParallelCompressor(target, codec, level, workers, index=index) as stream:
+            while True:
+                data = reader.read(BLOCK_SIZE)
+                if not data:
+                    break
+                stream.write(data)
+                if deadline and time.time() > deadline:
+                    raise TimeoutError(f"deadline passed recompressing {source}")
+
+
+def register_codec(codec: Codec) -> None:
+    """Adds a codec to the registry
+
+    Args:
+        codec: codec to register
+    """
+    CODECS[codec.name] = codec
+
+
+register_codec(Codec('bz2', 'tar.bz2', _compress_bz2, _reader_bz2, 9, (1, 9)))
+register_codec(Codec('gzip', 'tar.gz', _compress_gzip, _reader_gzip, 6, (0, 9)))
+register_codec(Codec('lz4', 'tar.lz4', _compress_lz4, _reader_lz4, 0, (0, 16), 'lz4'))
+register_codec(Codec('none', 'tar', _compress_none, _reader_none, 0, (0, 0)))
+register_codec(Codec('xz', 'tar.xz', _compress_xz, _reader_xz, 6, (0, 9)))
+register_codec(Codec('zstd', 'tar.zst', _compress_zstd, _reader_zstd, 3, (1, 22), 'zstandard'))
+
+
+def archive_extensions() -> List[str]:
+    """Returns archive extensions of all registered codecs, longest first
+
+    Returns:
+        list of archive extensions without a leading period
+    """
+    return sorted({codec.extension for codec in CODECS.values()}, key=len, reverse=True)
+
+
+def archive_name(file_name: str) -> str:
+    """Returns the backup name of an archive file
+
+    Args:
+        file_name: name of a file in the backups directory
+
+    Returns:
+        the backup name, or an empty string if file_name is not an archive of a registered codec
+        or the index of one
+    """
+    if file_name.endswith(f".{INDEX}"):
+        file_name = file_name[:-len(INDEX) - 1]
+
+    for extension in archive_extensions():
+        for suffix in (f".{STORED}.{extension}", f".{extension}"):
+            if file_name.endswith(suffix) and len(file_name) > len(suffix):
+                return file_name[:-len(suffix)]
+
+    return ''
+
+
+def find_archives(backups_path: str, backup_name: str, sidecars: bool = True) -> List[str]:
+    """Finds existing archives of a backup
+
+    Args:
+        backups_path: full path to base backups directory
+        backup_name: name of the backup
+        sidecars: include archives of stored files and index files
+
+    Returns:
+        list of full paths to archives of backup_name
+    """
+    found = []
+    for extension in archive_extensions():
+        file_names = [f"{backup_name}.{extension}"]
+        if sidecars:
+            file_names += [f"{backup_name}.{extension}.{INDEX}", f"{backup_name}.{STORED}.{extension}",
+                           f"{backup_name}.{STORED}.{extension}.{INDEX}"]
+        for file_name in file_names:
+            path = os.path.join(backups_path, file_name)
+            if os.path.isfile(path):
+                found.append(path)
+
+    return found
+
+
+def directory_archives(path: str) -> List[str]:
+    """Finds archives of registered codecs held directly in a directory
+
+    Backups compressed with one archive per project keep their parent backup directory,
+    which then holds the archives of each project.
+
+    Args:
+        path: full path to a directory
+
+    Returns:
+        sorted list of archive file names in path
+    """
+    return sorted(file_name for file_name in os.listdir(path)
+                  if codec_of(file_name) is not None and os.path.isfile(os.path.join(path, file_name)))
+
+
+def codec_of(path: str) -> Optional[Codec]:
+    """Returns the registered codec of an archive
+
+    Args:
+        path: path to an archive
+
+    Returns:
+        the codec whose extension path ends with, or None if path is not an archive of a registered codec
+    """
+    for extension in archive_extensions():
+        if path.endswith(f".{extension}"):
+            return next(codec for codec in CODECS.values() if codec.extension == extension)
+
+    return None
+
+
+def get_codec(name: str) -> Codec:
+    """Returns a registered codec
+
+    Args:
+        name: name of the codec
+
+    Returns:
+        the codec registered as name
+
+    Raises:
+        ValueError: the codec is not registered
+        ImportError: the module required by the codec is not installed
+    """
+    codec = CODECS.get(name)
+    if not codec:
+        raise ValueError(f"unknown codec: {name}")
+    if not codec.available:
+        raise ImportError(f"codec {name} requires the {codec.module} module")
+
+    return codec
+
+
+def validate_codec(name: str, level: Optional[int]) -> Tuple[str, int, str]:
+    """Checks a configured codec and level
+
+    Args:
+        name: configured codec name
+        level: configured level, None uses the default level of the codec
+
+    Returns:
+        A tuple of the codec name, the level to use, and an error message if the settings are not valid
+    """
+    codec = CODECS.get(name)
+    if not codec:
+        return '', 0, f"codec must be one of {', '.join(sorted(CODECS))}"
+    if not codec.available:
+        return '', 0, f"codec {name} requires the {codec.module} module"
+
+    level, msg = codec.validate_level(level)
+    if msg:
+        return '', 0, msg
+
+    return name, level, ''
+
+
+def worker_count(workers: int) -> int:
+    """Returns the number of compression workers to use
+
+    Args:
+        workers: requested number of workers, zero or less uses one per cpu
+
+    Returns:
+        number of workers
+    """
+    if workers > 0:
+        return workers
+
+    return os.cpu_count() or 1
+
+
+class _BlockPool:
+    """Compresses blocks on a pool of worker threads, returning them in the order they were queued
+
+    Args:
+        compress: function that compresses a block into a complete stream
+        workers: number of compression workers
+    """
+
+    def __init__(self, compress: Callable[[bytes], bytes], workers: int) -> None:
+        self._compress = compress
+        self._pending: Deque[Tuple[concurrent.futures.Future, int]] = collections.deque()
+        self._workers = workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def cancel(self) -> None:
+        """Cancels queued blocks and stops the workers"""
+        for future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown()
+
+    def full(self) -> bool:
+        """Returns True if enough blocks are queued that the oldest should be written first"""
+        return len(self._pending) > self._workers * 2
+
+    def next(self) -> Tuple[bytes, int]:
+        """Waits for the oldest queued block
+
+        Returns:
+            bytes: the compressed block
+            int: size of the block before compression
+        """
+        future, uncompressed_size = self._pending.popleft()
+        return future.result(), uncompressed_size
+
+    def shutdown(self) -> None:
+        """Stops the workers"""
+        self._executor.shutdown()
+
+    def submit(self, block: bytes) -> None:
+        """Queues a block for compression
+
+        Args:
+            block: uncompressed block
+        """
+        self._pending.append((self._executor.submit(self._compress, block), len(block)))
+
+
+class ParallelCompressor(io.RawIOBase):
+    """Writable file object that compresses data in parallel
+
+    Written data is split into blocks of block_size bytes. Each block is compressed into
+    a complete, independent stream on a pool of worker threads, and the streams are
+    written to path in order. Concatenated streams of every registered codec are
+    standard multi-stream files that are readable by the normal tools.
+
+    Data is written to path with a .part suffix, which is renamed to path when the file
+    is closed, so a file at path is always complete. The partial file is removed if
+    writing is aborted.
+
+    Args:
+        path: full path to the compressed file to write
+        codec: registered codec, or name of a registered codec, to compress with
+        level: compression level, None uses the default level of the codec
+        workers: number of compression workers, zero or less uses one per cpu
+        block_size: amount of uncompressed data in each block
+        index: if set, every written frame is recorded in this archive index, which is
+               closed along with the file
+
+    Attributes:
+        index: the archive index frames are recorded in, or None
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, path: str, codec: Union[Codec, str] = 'bz2', level: Optional[int] = None,
+                 workers: int = 0, block_size: int = BLOCK_SIZE, index=None) -> None:
+        super().__init__()
+        if isinstance(codec, str):
+            codec = get_codec(codec)
+        level, msg = codec.validate_level(level)
+        if msg:
+            raise ValueError(msg)
+
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._pool = _BlockPool(functools.partial(codec.compress, level=level), worker_count(workers))
+        self._path = path
+        self.index = index
+        self._file = open(f"{path}.{PARTIAL}", 'wb')  # pylint: disable=consider-using-with
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _submit(self, block: bytes) -> None:
+        """Queues a block for compression, writing finished blocks to keep memory bounded
+
+        Args:
+            block: uncompressed block
+        """
+        self._pool.submit(block)
+        while self._pool.full():
+            self._write_next()
+
+    def _write_next(self) -> None:
+        """Waits for the oldest queued block and writes it to the file"""
+        frame, uncompressed_size = self._pool.next()
+        self._file.write(frame)
+        if self.index is not None:
+            self.index.add_frame(len(frame), uncompressed_size)
+
+    def abort(self) -> None:
+        """Stops compression without writing queued blocks"""
+        if self.closed:
+            return
+
+        self._pool.cancel()
+        self._file.close()
+        if self.index is not None:
+            self.index.abort()
+        super().close()
+
+        try:
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        """Compresses and writes remaining data, then closes the file"""
+        if self.closed:
+            return
+
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pool:
+                self._write_next()
+            if self.index is not None:
+                self.index.close()
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._pool.shutdown()
+            self._file.close()
+            super().close()
+
+        os.replace(self._file.name, self._path)
+
+    def writable(self) -> bool:
+        """Returns True as this is a writable stream"""
+        return True
+
+    def write(self, data) -> int:  # pylint: disable=arguments-renamed
+        """Writes data to the compressed stream
+
+        Args:
+            data: bytes-like object to write
+
+        Returns:
+            number of bytes written
+        """
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+
+        return len(data)
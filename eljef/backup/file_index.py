@@ -0,0 +1,120 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Persistent Directory State Index"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from typing import (Dict, List, Tuple)
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FULL_DAYS = 7
+"""INDEX_FULL_DAYS is how many days an index is trusted for before a source is walked in full again"""
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, dest TEXT, excludes TEXT, full_walk REAL)',
+    'CREATE TABLE IF NOT EXISTS dirs (source TEXT, rel TEXT, ino INTEGER, mtime_ns INTEGER, '
+    'PRIMARY KEY (source, rel))',
+)
+
+DirState = Tuple[int, int]
+"""DirState is the inode number and modification time in nanoseconds of a directory"""
+
+
+class FileIndex:
+    """Keeps the state of the directories of sources as of their last complete copy
+
+    A directory keeps its modification time while no entry is added to, removed from
+    or renamed in it, so its entries are the same as in the copy made when it last had
+    that modification time. Only the entries are taken from the copy: the size and
+    modification time of each file are compared with the source as usual, the copy
+    holding them as of the last run. Sources are walked in full again every full_days
+    days, in case a directory was changed without its modification time changing.
+
+    The index is only a cache: if it cannot be read or written, sources are walked in
+    full.
+
+    Args:
+        path: full path to the SQLite index file
+        full_days: days the index is trusted for after a source was walked in full
+    """
+
+    def __init__(self, path: str, full_days: int = INDEX_FULL_DAYS) -> None:
+        self.path = path
+        self.full_days = full_days
+
+        self._db = None
+        try:
+            self._db = sqlite3.connect(path)
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+        except sqlite3.Error as exception_object:
+            LOGGER.warning("index: walking sources in full, cannot open %s: %s", path, exception_object)
+            self.close()
+
+    def close(self) -> None:
+        """Closes the index"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def load(self, source: str, link_dest: str, excludes: List[str]) -> Dict[str, DirState]:
+        """Returns the state of the directories of a source, if link_dest is the copy they describe
+
+        Args:
+            source: full path to the source
+            link_dest: full path to the previous copy of the source
+            excludes: exclude patterns the source is copied with
+
+        Returns:
+            state of each directory keyed by path relative to source, empty if the source
+            is to be walked in full
+        """
+        if self._db is None or not link_dest:
+            return {}
+
+        try:
+            row = self._db.execute('SELECT dest, excludes, full_walk FROM sources WHERE source = ?',
+                                   (source,)).fetchone()
+            if not row or row[0] != os.path.normpath(link_dest) or row[1] != json.dumps(excludes) or \
+                    time.time() - row[2] > self.full_days * 86400:
+                return {}
+            return {rel: (ino, mtime_ns) for rel, ino, mtime_ns in
+                    self._db.execute('SELECT rel, ino, mtime_ns FROM dirs WHERE source = ?', (source,))}
+        except sqlite3.Error as exception_object:
+            LOGGER.warning("index: walking %s in full, cannot read %s: %s", source, self.path, exception_object)
+            return {}
+
+    # pylint: disable=too-many-arguments
+    def save(self, source: str, dest: str, excludes: List[str], dirs: List[Tuple[str, int, int]],
+             full: bool) -> None:
+        """Replaces the state of the directories of a source with those of a complete copy
+
+        Args:
+            source: full path to the source
+            dest: full path to the copy
+            excludes: exclude patterns the source was copied with
+            dirs: path relative to source, inode number and modification time in nanoseconds
+                  of every directory copied
+            full: the source was walked in full
+        """
+        if self._db is None:
+            return
+
+        try:
+            with self._db:
+                row = self._db.execute('SELECT full_walk FROM sources WHERE source = ?', (source,)).fetchone()
+                full_walk = time.time() if full or not row else row[0]
+                self._db.execute('DELETE FROM dirs WHERE source = ?', (source,))
+                self._db.executemany('INSERT INTO dirs VALUES (?, ?, ?, ?)',
+                                     ((source, rel, ino, mtime_ns) for rel, ino, mtime_ns in dirs))
+                self._db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                                 (source, os.path.normpath(dest), json.dumps(excludes), full_walk))
+        except sqlite3.Error as exception_object:
+            LOGGER.warning("index: cannot save %s to %s: %s", source, self.path, exception_object)
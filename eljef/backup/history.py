@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Stage Duration History"""
+
+import json
+import logging
+import os
+import statistics
+
+from typing import (Dict, List)
+
+LOGGER = logging.getLogger(__name__)
+
+HISTORY_FILE = '.history.json'
+"""HISTORY_FILE is the default name of the history file in the backups path"""
+
+HISTORY_RUNS = 10
+"""HISTORY_RUNS is the number of durations kept for each stage"""
+
+REGRESSION_FACTOR = 2.0
+"""REGRESSION_FACTOR is how many times its expected duration a project must take to be flagged"""
+
+REGRESSION_MIN_SECONDS = 60.0
+"""REGRESSION_MIN_SECONDS is how many seconds over its expected duration a project must take to be flagged"""
+
+
+class History:
+    """Stores durations of previous runs of each stage, keyed by project and stage name
+
+    Durations of the last HISTORY_RUNS successful runs of every stage are kept. The
+    expected duration of a stage is the median of its kept durations, which is not
+    thrown off by a single slow run.
+
+    Args:
+        path: full path to the history file, an empty path keeps no history
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.projects: Dict[str, Dict[str, List[float]]] = {}
+
+        self._load()
+
+    def _load(self) -> None:
+        """Loads the history file, starting an empty history if it does not exist or cannot be read"""
+        if not self.path:
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as history:
+                self.projects = json.load(history).get('projects', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as exception_object:
+            LOGGER.warning("history: starting a new history, cannot read %s: %s", self.path, exception_object)
+            self.projects = {}
+
+    def expected(self, project: str) -> float:
+        """Returns the expected duration of a project
+
+        Args:
+            project: key of the project
+
+        Returns:
+            sum of the median duration of each stage in seconds, 0 if there is no history
+        """
+        return sum(statistics.median(durations) for durations in self.projects.get(project, {}).values()
+                   if durations)
+
+    def record(self, project: str, durations: Dict[str, float]) -> bool:
+        """Records the stage durations of a project run, flagging the run if it regressed
+
+        The run is compared to the history before it is recorded.
+
+        Args:
+            project: key of the project
+            durations: duration in seconds of each stage that ran, keyed by stage name
+
+        Returns:
+            True if the run took more than REGRESSION_FACTOR times, and REGRESSION_MIN_SECONDS
+            more than, its expected duration
+        """
+        expected = self.expected(project)
+        total = sum(durations.values())
+        regressed = bool(expected) and total > expected * REGRESSION_FACTOR and \
+            total - expected > REGRESSION_MIN_SECONDS
+        if regressed:
+            LOGGER.warning("history: %s took %.0f seconds, expected %.0f seconds", project, total, expected)
+
+        stages = self.projects.setdefault(project, {})
+        for stage, duration in durations.items():
+            stages[stage] = (stages.get(stage, []) + [round(duration, 3)])[-HISTORY_RUNS:]
+
+        return regressed
+
+    def save(self) -> None:
+        """Atomically writes the history file"""
+        if not self.path:
+            return
+
+        partial = f"{self.path}.part"
+        with open(partial, 'w', encoding='utf-8') as history:
+            json.dump({'projects': self.projects}, history, indent=2, sort_keys=True)
+        os.replace(partial, self.path)
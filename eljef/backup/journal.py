@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Backup Run Journal"""
+
+import json
+import logging
+import os
+import threading
+
+from typing import (Dict, Set)
+
+LOGGER = logging.getLogger(__name__)
+
+JOURNAL = 'journal'
+"""JOURNAL is the extension of the journal file written next to the parent backup directory"""
+
+
+class Journal:
+    """Records the stages a backup has completed, so a failed backup can be resumed
+
+    Every completed stage is appended to the journal file as one JSON line as soon as it
+    completes, and synced to disk, so the journal survives the backup being killed. A
+    line cut short by a crash is ignored when the journal is loaded.
+
+    Args:
+        path: full path to the journal file, an empty path keeps no journal
+        resume: load the stages completed by the backup being resumed instead of starting
+                a new journal
+
+    Raises:
+        FileNotFoundError: resume is set and the journal file does not exist
+    """
+
+    def __init__(self, path: str, resume: bool = False) -> None:
+        self.path = path
+        self.completed: Dict[str, Set[str]] = {}
+
+        self._lock = threading.Lock()
+
+        if not self.path:
+            return
+        if resume:
+            self._load()
+        else:
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+
+    def _load(self) -> None:
+        """Loads the stages completed by the backup being resumed"""
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"no journal to resume from: {self.path}")
+
+        with open(self.path, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                    self.completed.setdefault(entry['project'], set()).add(entry['stage'])
+                except (ValueError, KeyError, TypeError):
+                    LOGGER.warning("journal: ignoring unreadable entry in %s", self.path)
+
+    def delete(self) -> None:
+        """Deletes the journal file, once the backup no longer needs to be resumed"""
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def done(self, project: str, stage: str) -> bool:
+        """Returns True if a stage was completed by the backup being resumed
+
+        Args:
+            project: key of the project
+            stage: name of the stage
+        """
+        return stage in self.completed.get(project, set())
+
+    def record(self, project: str, stage: str) -> None:
+        """Records a completed stage
+
+        Args:
+            project: key of the project
+            stage: name of the stage
+        """
+        with self._lock:
+            self.completed.setdefault(project, set()).add(stage)
+            if not self.path:
+                return
+            with open(self.path, 'a', encoding='utf-8') as journal:
+                journal.write(json.dumps({'project': project, 'stage': stage}) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
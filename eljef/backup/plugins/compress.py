@@ -4,21 +4,65 @@
 
 """Backup Compression Plugin"""
 
+import concurrent.futures
 import logging
+import os
 
-from typing import Tuple
+from typing import (List, Tuple)
 
+from eljef.backup.autocodec import AutoCodec
 from eljef.backup.backup import compress_backup_directory
+from eljef.backup.compression import (validate_codec, worker_count)
 from eljef.backup.project import Paths
 from eljef.backup.plugins import plugin
 from eljef.core import fops
 
 LOGGER = logging.getLogger(__name__)
 
+AUTO = 'auto'
+"""AUTO is the codec setting that selects a codec by sampling the backup"""
+
+SCOPE_BACKUP = 'backup'
+"""SCOPE_BACKUP compresses the whole parent backup directory into one archive"""
+
+SCOPE_PROJECT = 'project'
+"""SCOPE_PROJECT compresses the backup directory of the project the plugin belongs to"""
+
+SCOPE_PROJECTS = 'projects'
+"""SCOPE_PROJECTS compresses every project directory in the parent backup directory into its own archive"""
+
+SCOPES = (SCOPE_BACKUP, SCOPE_PROJECT, SCOPE_PROJECTS)
+
+
+class ArchiveSettings:
+    """Codecs archives are written with
+
+    Attributes:
+        codec: name of the codec, or auto to select one by sampling each directory compressed
+        level: compression level, None uses the default level of the codec
+        index: an archive index is written next to each archive
+        stored_codec: if set, files that are already compressed are written to a separate
+                      archive with this codec
+        stored_level: compression level for stored_codec, None uses the default level of the codec
+    """
+
+    def __init__(self) -> None:
+        self.codec = 'bz2'
+        self.level = None
+        self.index = True
+        self.stored_codec = ''
+        self.stored_level = None
+
 
 class CompressPlugin(plugin.Plugin):
     """Compresses backups
 
+    Notes:
+        Per project archives are written to the parent backup directory as
+        <project directory>.<ext>, with the project directory as the archive root, and
+        each project directory is removed once its archive is complete. Extracting the
+        archives into the parent backup directory restores it.
+
     Args:
         paths: paths and backup name
         project: name of project
@@ -27,6 +71,81 @@ class CompressPlugin(plugin.Plugin):
     def __init__(self, paths: Paths, project: str) -> None:
         super().__init__(paths, project)
         self.do_compress = False
+        self.archive = ArchiveSettings()
+        self.auto = AutoCodec()
+        self.max_parallel = 0
+        self.scope = SCOPE_BACKUP
+        self.workers = 0
+
+    def _compress(self, backups_path: str, path: str, name: str, workers: int) -> None:
+        """Compresses a directory into backups_path, selecting the codec first when it is auto
+
+        Args:
+            backups_path: full path to the directory to write the archive to
+            path: full path to the directory to compress
+            name: name of the archive and of path in the archive
+            workers: number of compression workers
+        """
+        archive = self.archive
+        codec = archive.codec
+        level = archive.level
+        if codec == AUTO:
+            chosen = self.auto.select(path, workers)
+            codec = chosen.codec
+            level = chosen.level
+        compress_backup_directory(backups_path, path, name, codec, level, workers, archive.stored_codec,
+                                  archive.stored_level, archive.index)
+
+    def _compress_project(self, subdir: str, workers: int) -> None:
+        """Compresses a project directory to an archive in the parent backup directory and removes it
+
+        Args:
+            subdir: name of the project directory in the parent backup directory
+            workers: number of compression workers
+        """
+        path = os.path.join(self.paths.backup_path, subdir)
+        self._compress(self.paths.backup_path, path, subdir, workers)
+        fops.delete(path)
+        LOGGER.info("compressed project: %s", subdir)
+
+    def _compress_projects(self, subdirs: List[str]) -> Tuple[bool, str]:
+        """Compresses project directories concurrently, max_parallel at a time
+
+        Args:
+            subdirs: names of project directories in the parent backup directory
+
+        Returns:
+            bool: all project directories were compressed
+            str: if compression failed, the error message explaining what failed
+        """
+        subdirs = [subdir for subdir in subdirs if os.path.isdir(os.path.join(self.paths.backup_path, subdir))]
+        if not subdirs:
+            return True, ''
+
+        parallel = min(self.max_parallel, len(subdirs)) if self.max_parallel > 0 else len(subdirs)
+        workers = self.workers if self.workers > 0 else max(1, worker_count(0) // parallel)
+        errors = []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as pool:
+            compressions = {pool.submit(self._compress_project, subdir, workers): subdir for subdir in subdirs}
+            for future in concurrent.futures.as_completed(compressions):
+                try:
+                    future.result()
+                except Exception as exception_object:  # pylint: disable=broad-exception-caught
+                    errors.append(f"compress {compressions[future]}: {exception_object}")
+
+        if errors:
+            return False, '; '.join(sorted(errors))
+
+        return True, ''
+
+    def implied_resources(self) -> List[str]:
+        """Compression uses the cpu and the disk holding the backups
+
+        Returns:
+            list of resource tags
+        """
+        return ['cpu', f"disk:{self.paths.backups_path}"]
 
     def run(self) -> Tuple[bool, str]:
         """Run operations for this plugin
@@ -39,9 +158,18 @@ def run(self) -> Tuple[bool, str]:
             bool: operations completed successfully
             str: if operations failed, the error message explaining what failed
         """
-        if self.do_compress:
-            compress_backup_directory(self.paths.backups_path, self.paths.backup_path, self.paths.backup_name)
-            fops.delete(self.paths.backup_path)
+        if not self.do_compress:
+            return True, ''
+
+        if self.scope == SCOPE_PROJECTS:
+            return self._compress_projects(sorted(name for name in os.listdir(self.paths.backup_path)
+                                                  if os.path.isdir(os.path.join(self.paths.backup_path, name))))
+
+        if self.scope == SCOPE_PROJECT:
+            return self._compress_projects([self.paths.subdir if self.paths.subdir else self.project])
+
+        self._compress(self.paths.backups_path, self.paths.backup_path, self.paths.backup_name, self.workers)
+        fops.delete(self.paths.backup_path)
 
         return True, ''
 
@@ -68,4 +196,64 @@ def setup(self, paths: Paths, project: str, info: dict) -> object:
         compress_plugin = CompressPlugin(paths, project)
         compress_plugin.do_compress = info.get('do_compress', False)
 
+        workers = info.get('workers', 0)
+        if not isinstance(workers, int):
+            return self.failure('workers must be an integer')
+        compress_plugin.workers = workers
+
+        index = info.get('index', True)
+        if not isinstance(index, bool):
+            return self.failure('index must be true or false')
+        compress_plugin.archive.index = index
+
+        max_parallel = info.get('max_parallel', 0)
+        if not isinstance(max_parallel, int) or max_parallel < 0:
+            return self.failure('max_parallel must be a positive integer')
+        compress_plugin.max_parallel = max_parallel
+
+        scope = info.get('scope', SCOPE_BACKUP)
+        if scope not in SCOPES:
+            return self.failure(f"scope must be one of: {', '.join(SCOPES)}")
+        compress_plugin.scope = scope
+
+        msg = self._setup_codec(compress_plugin, info)
+        if msg:
+            return self.failure(msg)
+
         return compress_plugin
+
+    @staticmethod
+    def _setup_codec(compress_plugin: CompressPlugin, info: dict) -> str:
+        """Sets up the codecs of a compress plugin
+
+        Args:
+            compress_plugin: plugin being set up
+            info: dictionary of information from configuration file, specific to this plugin
+
+        Returns:
+            An empty string if no errors, error message otherwise.
+        """
+        if info.get('stored_codec'):
+            stored_codec, stored_level, msg = validate_codec(info.get('stored_codec'), info.get('stored_level'))
+            if msg:
+                return f"stored_codec: {msg}"
+            compress_plugin.archive.stored_codec = stored_codec
+            compress_plugin.archive.stored_level = stored_level
+
+        if info.get('codec') == AUTO:
+            auto_info = info.get('auto', {})
+            if not isinstance(auto_info, dict):
+                return 'auto must be a dictionary'
+            msg = compress_plugin.auto.setup(auto_info)
+            if msg:
+                return f"auto: {msg}"
+            compress_plugin.archive.codec = AUTO
+            return ''
+
+        codec, level, msg = validate_codec(info.get('codec', 'bz2'), info.get('level'))
+        if msg:
+            return msg
+        compress_plugin.archive.codec = codec
+        compress_plugin.archive.level = level
+
+        return ''
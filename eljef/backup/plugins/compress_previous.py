@@ -4,12 +4,16 @@
 
 """Compress Previous Backups Plugin"""
 
+import concurrent.futures
 import logging
+import multiprocessing
 import os
 
-from typing import Tuple
+from typing import (List, Tuple)
 
 from eljef.backup.backup import compress_backup_directory
+from eljef.backup.compression import (directory_archives, find_archives, validate_codec, worker_count)
+from eljef.backup.journal import JOURNAL
 from eljef.backup.project import Paths
 from eljef.backup.plugins import plugin
 from eljef.core import fops
@@ -18,7 +22,65 @@
 
 
 class CompressPreviousPlugin(plugin.Plugin):
-    """Compresses Previous backups"""
+    """Compresses Previous backups
+
+    Args:
+        paths: paths and backup name
+        project: name of project
+    """
+
+    def __init__(self, paths: Paths, project: str) -> None:
+        super().__init__(paths, project)
+        self.codec = 'bz2'
+        self.level = None
+        self.index = True
+        self.stored_codec = ''
+        self.stored_level = None
+        self.processes = 1
+        self.workers = 0
+
+    def _pending_backups(self) -> Tuple[List[str], List[str]]:
+        """Returns names of backup directories that need to be compressed or deleted
+
+        The directory of the currently running backup, which may still be written to,
+        directories of failed backups that still have a journal, as they may be resumed,
+        and directories holding per project archives are skipped. Directories that already
+        have a complete archive, left behind when a previous run stopped before deleting
+        them, only need to be deleted.
+
+        Returns:
+            list: sorted names of backup directories to compress
+            list: sorted names of backup directories to delete
+        """
+        pending = []
+        archived = []
+        for name in sorted(os.listdir(self.paths.backups_path)):
+            if not os.path.isdir(os.path.join(self.paths.backups_path, name)):
+                continue
+            if name == self.paths.backup_name:
+                LOGGER.debug("skipping running backup: %s", name)
+                continue
+            if os.path.exists(os.path.join(self.paths.backups_path, f"{name}.{JOURNAL}")):
+                LOGGER.info("skipping failed backup that can be resumed: %s", name)
+                continue
+            if find_archives(self.paths.backups_path, name, False):
+                LOGGER.info("deleting backup with a complete archive: %s", name)
+                archived.append(name)
+                continue
+            if directory_archives(os.path.join(self.paths.backups_path, name)):
+                LOGGER.info("skipping backup with per project archives: %s", name)
+                continue
+            pending.append(name)
+
+        return pending, archived
+
+    def implied_resources(self) -> List[str]:
+        """Compression uses the cpu and the disk holding the backups
+
+        Returns:
+            list of resource tags
+        """
+        return ['cpu', f"disk:{self.paths.backups_path}"]
 
     def run(self) -> Tuple[bool, str]:
         """Run operations for this plugin
@@ -31,12 +93,41 @@ def run(self) -> Tuple[bool, str]:
             bool: operations completed successfully
             str: if operations failed, the error message explaining what failed
         """
-        backups = os.listdir(self.paths.backups_path)
-        for name in backups:
-            full_path = os.path.join(self.paths.backups_path, name)
-            if os.path.isdir(full_path):
-                compress_backup_directory(self.paths.backups_path, full_path, name)
-                fops.delete(full_path)
+        workers = self.workers if self.workers > 0 else max(1, worker_count(0) // self.processes)
+        errors = []
+        pending, archived = self._pending_backups()
+
+        # stages run in threads, so the compression processes are not forked from this process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.processes,
+                                                    mp_context=multiprocessing.get_context('forkserver')) as pool, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as deleter:
+            deletes = {deleter.submit(fops.delete, os.path.join(self.paths.backups_path, name)): name
+                       for name in archived}
+            compressions = {}
+            for name in pending:
+                full_path = os.path.join(self.paths.backups_path, name)
+                future = pool.submit(compress_backup_directory, self.paths.backups_path, full_path, name, self.codec,
+                                     self.level, workers, self.stored_codec, self.stored_level, self.index)
+                compressions[future] = name
+
+            for future in concurrent.futures.as_completed(compressions):
+                name = compressions[future]
+                try:
+                    future.result()
+                except Exception as exception_object:  # pylint: disable=broad-exception-caught
+                    errors.append(f"compress {name}: {exception_object}")
+                    continue
+                LOGGER.info("compressed: %s", name)
+                deletes[deleter.submit(fops.delete, os.path.join(self.paths.backups_path, name))] = name
+
+            for future, name in deletes.items():
+                try:
+                    future.result()
+                except Exception as exception_object:  # pylint: disable=broad-exception-caught
+                    errors.append(f"delete {name}: {exception_object}")
+
+        if errors:
+            return False, '; '.join(errors)
 
         return True, ''
 
@@ -62,4 +153,32 @@ def setup(self, paths: Paths, project: str, info: dict) -> object:
         """
         compress_previous_plugin = CompressPreviousPlugin(paths, project)
 
+        workers = info.get('workers', 0)
+        if not isinstance(workers, int):
+            return self.failure('workers must be an integer')
+        compress_previous_plugin.workers = workers
+
+        index = info.get('index', True)
+        if not isinstance(index, bool):
+            return self.failure('index must be true or false')
+        compress_previous_plugin.index = index
+
+        processes = info.get('processes', 1)
+        if not isinstance(processes, int) or processes < 1:
+            return self.failure('processes must be an integer greater than zero')
+        compress_previous_plugin.processes = processes
+
+        if info.get('stored_codec'):
+            stored_codec, stored_level, msg = validate_codec(info.get('stored_codec'), info.get('stored_level'))
+            if msg:
+                return self.failure(f"stored_codec: {msg}")
+            compress_previous_plugin.stored_codec = stored_codec
+            compress_previous_plugin.stored_level = stored_level
+
+        codec, level, msg = validate_codec(info.get('codec', 'bz2'), info.get('level'))
+        if msg:
+            return self.failure(msg)
+        compress_previous_plugin.codec = codec
+        compress_previous_plugin.level = level
+
         return compress_previous_plugin
@@ -4,30 +4,82 @@
 
 """Backup Storage Limiting"""
 
+import contextlib
 import logging
 import os
+import shutil
+import stat
+import sys
 
-from typing import Tuple
+from typing import (List, Tuple)
 
+from eljef.backup.compression import archive_name
+from eljef.backup.journal import JOURNAL
 from eljef.backup.project import Paths
 from eljef.backup.plugins import plugin
-from eljef.core import fops
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _delete_error(function, path: str, _) -> None:
+    """Makes the directory that stopped a delete writable by its owner and retries
+
+    Only directory modes are changed. Files in backups may be hard links shared with newer
+    backups, and changing their mode would change it in every backup sharing them.
+
+    Args:
+        function: the function that failed
+        path: the path function failed on
+    """
+    directory = os.path.dirname(path) if function in (os.rmdir, os.remove, os.unlink) else path
+    os.chmod(directory, stat.S_IMODE(os.lstat(directory).st_mode) | stat.S_IRWXU)
+    function(path)
+
+
+def delete_backup(path: str) -> None:
+    """Deletes a backup directory or archive
+
+    Files are only ever unlinked, so files shared by hard link with newer backups are
+    left as they are in those backups.
+
+    Args:
+        path: full path to the backup directory or archive
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, **{'onexc' if sys.version_info >= (3, 12) else 'onerror': _delete_error})
+    else:
+        os.remove(path)
+
+
 class LimitPlugin(plugin.Plugin):
     """Limit Backups
 
     Args:
         paths: paths and backup name
         project: name of project
+
+    Notes:
+        A backup is a directory in the backups path, or an archive of a registered codec.
+        A backup directory and its archives are counted as one backup.
+
+        Backup directories may share files by hard link with newer backups made with
+        local_rsync incremental set. Deleting a backup only unlinks its files, so the
+        files stay in the newer backups unchanged. The journal of a deleted backup is
+        deleted with it, so a failed backup cannot be resumed once it is gone.
     """
 
     def __init__(self, paths: Paths, project: str) -> None:
         super().__init__(paths, project)
         self.total = 5
 
+    def implied_resources(self) -> List[str]:
+        """Deleting backups uses the disk holding the backups
+
+        Returns:
+            list of resource tags
+        """
+        return [f"disk:{self.paths.backups_path}"]
+
     def run(self) -> Tuple[bool, str]:
         """Run operations for this plugin
 
@@ -42,12 +94,18 @@ def run(self) -> Tuple[bool, str]:
         if self.total < 1:
             return True, ''
 
-        files = sorted(os.listdir(self.paths.backups_path))
-        current_count = len(files)
-        while current_count > self.total:
-            backup_name = files.pop(0)
-            fops.delete(os.path.join(self.paths.backups_path, backup_name))
-            current_count -= 1
+        backups = {}
+        for file_name in os.listdir(self.paths.backups_path):
+            full_path = os.path.join(self.paths.backups_path, file_name)
+            backup_name = file_name if os.path.isdir(full_path) else archive_name(file_name)
+            if backup_name:
+                backups.setdefault(backup_name, []).append(full_path)
+
+        for backup_name in sorted(backups)[:-self.total]:
+            for full_path in backups[backup_name]:
+                delete_backup(full_path)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.paths.backups_path, f"{backup_name}.{JOURNAL}"))
 
         return True, ''
 
@@ -5,15 +5,23 @@
 """Local RSYNC Plugin"""
 
 import logging
+import os
+import tempfile
 
-from typing import Tuple
+from typing import (List, Optional, Tuple)
 
-from eljef.backup.backup import (create_child_backup_directory, rsync_terminate_path)
+from eljef.backup.backup import (create_child_backup_directory, find_previous_backup, rsync_terminate_path)
+from eljef.backup.file_index import (INDEX_FULL_DAYS, FileIndex)
 from eljef.backup.plugins import plugin
 from eljef.backup.project import Paths
+from eljef.backup.shard import (SHARD_CACHE, ShardCache, plan_shards)
+from eljef.backup.sync import (SYNC_WORKERS, Excludes, TreeSync)
 
 LOGGER = logging.getLogger(__name__)
 
+ENGINES = ('native', 'rsync')
+"""ENGINES are the engines paths can be copied with"""
+
 
 def _make_backup_path(path: str, subdir: str) -> str:
     """creates the path to be used in backup operation
@@ -30,17 +38,97 @@ def _make_backup_path(path: str, subdir: str) -> str:
     return rsync_terminate_path(backup_path)
 
 
+class NativeSettings:
+    """Settings of the native engine
+
+    Args:
+        workers: number of threads copying small files
+        index_full_days: days the directory index is trusted for before paths are walked in full again
+        index_path: full path to the directory index, empty to walk paths in full every run
+    """
+
+    def __init__(self, workers: int = SYNC_WORKERS, index_full_days: int = INDEX_FULL_DAYS,
+                 index_path: str = '') -> None:
+        self.index_full_days = index_full_days
+        self.index_path = index_path
+        self.workers = workers
+
+
 class LocalRsyncPlugin(plugin.Plugin):
     """Local RSYNC Plugin Class
 
     Args:
         paths: paths and backup name
         project: name of project
+
+    Attributes:
+        native: settings of the native engine, None when paths are copied with rsync
     """
 
     def __init__(self, paths: Paths, project: str) -> None:
         super().__init__(paths, project)
+        self.incremental = False
+        self.max_parallel = 1
+        self.native: Optional[NativeSettings] = None
+        self.previous = ''
         self.rsync_paths = []
+        self.shard_cache = ''
+        self.shards = 0
+
+    @staticmethod
+    def _write_list(path: str, entries: List[str]) -> str:
+        """Writes a NUL separated --files-from list
+
+        Args:
+            path: full path to the list file
+            entries: paths relative to the source
+
+        Returns:
+            the --files-from option for path
+        """
+        with open(path, 'wb') as list_file:
+            list_file.write(b''.join(os.fsencode(entry) + b'\0' for entry in entries))
+
+        return f"--files-from={path}"
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def _shard(self, cmd: list, path: str, backup_path: str, prefix: str, counts: dict,
+               excludes: List[str]) -> Tuple[list, list]:
+        """Splits copying a path into shards copied by separate rsync commands
+
+        Args:
+            cmd: rsync command without source and destination
+            path: full path to copy, with a trailing slash
+            backup_path: full path to copy into, with a trailing slash
+            prefix: full path prefix of the --files-from lists written for path
+            counts: cached entry counts of path
+            excludes: exclude patterns path is copied with
+
+        Returns:
+            list: labels and commands copying each shard
+            list: label and command setting the attributes of directories split between shards, run
+                  once every shard is copied
+        """
+        shards, split = plan_shards(path, self.shards, counts, self.max_parallel, Excludes(excludes))
+        LOGGER.debug("%s: %d shards, %d directories split", path, len(shards), len(split) - 1)
+
+        cmds = []
+        for pos, shard in enumerate(shards):
+            files_from = self._write_list(f"{prefix}.{pos}", shard)
+            cmds.append((f"{path} shard {pos}", cmd + ['-r', '--from0', files_from, '--ignore-missing-args',
+                                                       path, backup_path]))
+        files_from = self._write_list(f"{prefix}.dirs", split)
+
+        return cmds, [(f"{path} directories", cmd + ['--from0', files_from, '--ignore-missing-args', path,
+                                                     backup_path])]
+
+    def implied_resources(self) -> List[str]:
+        """Copying writes to the disk holding the backups
+
+        Returns:
+            list of resource tags
+        """
+        return [f"disk:{self.paths.backups_path}"]
 
     def run(self) -> Tuple[bool, str]:
         """Run operations for this plugin
@@ -49,6 +137,20 @@ def run(self) -> Tuple[bool, str]:
             If the plugin is saving files, it must save them in a subdirectory
             of the parent backup directory.
 
+            Paths are copied max_parallel at a time. Every path is copied even if
+            copying another fails.
+
+            With shards set, each directory path is split into shards of about the same
+            number of entries, each copied by its own rsync. The result is the same as
+            copying the path with a single rsync -a.
+
+            With engine native, paths are copied one at a time in process by TreeSync,
+            with workers threads, instead of by rsync. With index_path also set, directories
+            unchanged since the previous backup are listed from it instead of from the path.
+
+            With incremental set, files unchanged since the most recent complete backup
+            directory are hard linked to it with rsync --link-dest instead of copied.
+
         Returns:
             bool: operations completed successfully
             str: if operations failed, the error message explaining what failed
@@ -59,31 +161,157 @@ def run(self) -> Tuple[bool, str]:
         except Exception as exception_object:  # pylint: disable=broad-exception-caught
             return False, f"create backup path: {backup_subdir}: {exception_object}"
 
-        for copy_path in self.rsync_paths:
-            full_backup_path = backup_path
-            subdir = copy_path.get('backup_dir')
-            if subdir:
+        self.previous = ''
+        if self.incremental:
+            self.previous = find_previous_backup(self.paths.backups_path, self.paths.backup_name)
+        if self.previous:
+            LOGGER.debug("%s: linking unchanged files to %s", self.project, self.previous)
+
+        if self.native is not None:
+            return self._run_native(backup_path, self.native)
+
+        cache = ShardCache(self.shard_cache if self.shards > 1 else '')
+        cmds, last_cmds = [], []
+        with tempfile.TemporaryDirectory(prefix='shards') as lists:
+            for pos, copy_path in enumerate(self.rsync_paths):
                 try:
-                    full_backup_path = _make_backup_path(backup_path, subdir)
-                except Exception as exception_object:  # pylint: disable=broad-exception-caught
-                    return False, f"create backup path: {subdir}: {exception_object}"
+                    path_cmds, dir_cmds = self._path_cmds(copy_path, backup_path, os.path.join(lists, str(pos)), cache)
+                except RuntimeError as exception_object:
+                    return False, str(exception_object)
+                cmds += path_cmds
+                last_cmds += dir_cmds
+
+            self._save_cache(cache)
+
+            success, err_msg = self.exec_parallel(cmds, self.max_parallel)
+            if success and last_cmds:
+                success, err_msg = self.exec_parallel(last_cmds, self.max_parallel)
+
+        return success, err_msg
+
+    def _path_cmds(self, copy_path: dict, backup_path: str, prefix: str, cache: ShardCache) -> Tuple[list, list]:
+        """Builds the rsync commands copying a path
+
+        Args:
+            copy_path: path definition from the configuration
+            backup_path: full path to the backup directory of the project
+            prefix: full path prefix of --files-from lists written for this path
+            cache: cached entry counts of sharded paths
+
+        Returns:
+            list: labels and commands copying the path
+            list: labels and commands to run once every path is copied
+
+        Raises:
+            RuntimeError: the backup directory of the path cannot be created, or the path cannot be sharded
+        """
+        full_backup_path = self._backup_dir(copy_path, backup_path)
+        path = rsync_terminate_path(copy_path.get('path'))
+
+        cmd = ['rsync', '-a']
+
+        excludes = copy_path.get('excludes', [])
+        for exclude in excludes:
+            cmd += ['--exclude', exclude]
 
-            path = rsync_terminate_path(copy_path.get('path'))
+        link_dest = self._link_dest(full_backup_path)
+        if link_dest:
+            cmd.append(f"--link-dest={link_dest}")
 
-            cmd = ['rsync', '-a']
+        if self.shards > 1 and os.path.isdir(path):
+            try:
+                return self._shard(cmd, path, full_backup_path, prefix, cache.counts(path, excludes), excludes)
+            except OSError as exception_object:
+                raise RuntimeError(f"shard {path}: {exception_object}") from exception_object
 
-            excludes = copy_path.get('excludes', [])
-            for exclude in excludes:
-                cmd += ['--exclude', exclude]
+        return [(copy_path.get('path'), cmd + [path, full_backup_path])], []
 
-            cmd += [path, full_backup_path]
+    @staticmethod
+    def _backup_dir(copy_path: dict, backup_path: str) -> str:
+        """Creates the directory a path is copied into
+
+        Args:
+            copy_path: path definition from the configuration
+            backup_path: full path to the backup directory of the project
+
+        Returns:
+            full path to the directory, with a trailing slash
+
+        Raises:
+            RuntimeError: the directory cannot be created
+        """
+        subdir = copy_path.get('backup_dir')
+        if not subdir:
+            return backup_path
+        try:
+            return _make_backup_path(backup_path, subdir)
+        except Exception as exception_object:  # pylint: disable=broad-exception-caught
+            raise RuntimeError(f"create backup path: {subdir}: {exception_object}") from exception_object
+
+    def _link_dest(self, full_backup_path: str) -> str:
+        """Returns the directory of the previous backup matching a directory of this backup
+
+        Args:
+            full_backup_path: full path to a directory in this backup
+
+        Returns:
+            full path to the matching directory of the previous backup, or an empty string if
+            incremental is not set or the previous backup has no such directory
+        """
+        if not self.previous:
+            return ''
+        link_dest = os.path.join(self.previous, os.path.relpath(full_backup_path, self.paths.backup_path))
 
-            success, err_msg = self.exec(cmd)
-            if not success:
-                return success, err_msg
+        return link_dest if os.path.isdir(link_dest) else ''
+
+    def _run_native(self, backup_path: str, native: NativeSettings) -> Tuple[bool, str]:
+        """Copies every path in process with TreeSync
+
+        Args:
+            backup_path: full path to the backup directory of the project
+            native: settings of the native engine
+
+        Returns:
+            bool: every path was copied
+            str: if copying failed, the errors of each path that failed
+        """
+        errors = []
+        index = FileIndex(native.index_path, native.index_full_days) if native.index_path else None
+        try:
+            for copy_path in self.rsync_paths:
+                try:
+                    full_backup_path = self._backup_dir(copy_path, backup_path)
+                except RuntimeError as exception_object:
+                    errors.append(str(exception_object))
+                    continue
+                tree = TreeSync(copy_path.get('path'), full_backup_path, copy_path.get('excludes', []),
+                                self._link_dest(full_backup_path), native.workers, self.state.deadline, index)
+                if not tree.run():
+                    errors.append(f"{copy_path.get('path')}: {tree.failed} failed: {'; '.join(tree.errors)}")
+                LOGGER.debug("%s: %d copied, %d bytes, %d linked, %d unchanged, %d directories listed from %s, "
+                             "%d failed", copy_path.get('path'), tree.copied, tree.copied_bytes, tree.linked,
+                             tree.unchanged, tree.listed_previous, tree.link_dest or 'no previous backup',
+                             tree.failed)
+        finally:
+            if index is not None:
+                index.close()
+        if errors:
+            return False, '; '.join(errors)
 
         return True, ''
 
+    @staticmethod
+    def _save_cache(cache: ShardCache) -> None:
+        """Saves the shard cache, logging a failure as the cache only speeds up planning
+
+        Args:
+            cache: the shard cache
+        """
+        try:
+            cache.save()
+        except OSError as exception_object:
+            LOGGER.warning("shards: cannot save %s: %s", cache.path, exception_object)
+
 
 class SetupLocalRsyncPlugin(plugin.SetupPlugin):
     """Set up the local rsync plugin"""
@@ -93,28 +321,131 @@ def __init__(self) -> None:
         self.name = 'local_rsync'
         self.description = 'backup paths locally using rsync'
 
-    def setup(self, paths: Paths, project: str, info: dict) -> object:
-        """Sets up a plugin for operations
+    @staticmethod
+    def _validate_paths(info: dict) -> list:
+        """Validates the paths to copy
 
         Args:
-            paths: paths and backup names
-            project: name of project this plugin is being setup for
             info: dictionary of information from configuration file, specific to this plugin
+
         Returns:
-            dict: dictionary key: stage_name => object: plugin class to be run
+            the path definitions
+
+        Raises:
+            ValueError: the paths are missing or a path definition has no path
         """
         rsync_paths = info.get('paths')
         if not rsync_paths:
-            return self.failure('paths empty')
+            raise ValueError('paths empty')
         if not isinstance(rsync_paths, list):
-            return self.failure('paths not list')
+            raise ValueError('paths not list')
+        if not all(data.get('path') for data in rsync_paths):
+            raise ValueError('paths must include a path definition')
+
+        return rsync_paths
+
+    @staticmethod
+    def _validate_shards(info: dict) -> Tuple[int, int]:
+        """Validates how many rsync commands copy paths at once, and how many shards paths are split into
+
+        Args:
+            info: dictionary of information from configuration file, specific to this plugin
+
+        Returns:
+            int: max_parallel
+            int: shards
+
+        Raises:
+            ValueError: max_parallel or shards is not a valid number
+        """
+        max_parallel = info.get('max_parallel', 1)
+        if not isinstance(max_parallel, int) or max_parallel < 1:
+            raise ValueError('max_parallel must be an integer greater than zero')
 
-        for data in rsync_paths:
-            path = data.get('path')
-            if not path:
-                return self.failure('paths must include a path definition')
+        shards = info.get('shards', 0)
+        if not isinstance(shards, int) or shards < 0:
+            raise ValueError('shards must be a positive integer')
 
+        return max_parallel, shards
+
+    @staticmethod
+    def _validate_link_dest(info: dict) -> bool:
+        """Validates the incremental setting, linking unchanged files to the previous backup
+
+        Args:
+            info: dictionary of information from configuration file, specific to this plugin
+
+        Returns:
+            True if unchanged files are linked to the previous backup
+
+        Raises:
+            ValueError: incremental is not true or false
+        """
+        incremental = info.get('incremental', False)
+        if not isinstance(incremental, bool):
+            raise ValueError('incremental must be true or false')
+
+        return incremental
+
+    @staticmethod
+    def _validate_engine(info: dict, incremental: bool, max_parallel: int, shards: int) -> Optional[NativeSettings]:
+        """Validates the engine paths are copied with, and the settings of the native engine
+
+        Args:
+            info: dictionary of information from configuration file, specific to this plugin
+            incremental: unchanged files are linked to the previous backup
+            max_parallel: number of rsync commands run at once
+            shards: number of shards paths are split into
+
+        Returns:
+            settings of the native engine, None for engine rsync
+
+        Raises:
+            ValueError: a setting is invalid, or is not supported by the engine
+        """
+        engine = info.get('engine', 'rsync')
+        index = info.get('index', False)
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of: {', '.join(ENGINES)}")
+        if not isinstance(index, bool):
+            raise ValueError('index must be true or false')
+        if index and (engine != 'native' or not incremental):
+            raise ValueError('index needs engine native and incremental')
+        if engine != 'native':
+            return None
+        if shards or max_parallel > 1:
+            raise ValueError('shards and max_parallel need engine rsync, engine native copies with workers')
+
+        native = NativeSettings(info.get('workers', SYNC_WORKERS), info.get('index_full_days', INDEX_FULL_DAYS))
+        for name in ('index_full_days', 'workers'):
+            if not isinstance(getattr(native, name), int) or getattr(native, name) < 1:
+                raise ValueError(f"{name} must be an integer greater than zero")
+
+        return native
+
+    def setup(self, paths: Paths, project: str, info: dict) -> object:
+        """Sets up a plugin for operations
+
+        Args:
+            paths: paths and backup names
+            project: name of project this plugin is being setup for
+            info: dictionary of information from configuration file, specific to this plugin
+        Returns:
+            dict: dictionary key: stage_name => object: plugin class to be run
+        """
         paths_object = LocalRsyncPlugin(paths, project)
-        paths_object.rsync_paths = rsync_paths
+        try:
+            paths_object.rsync_paths = self._validate_paths(info)
+            paths_object.max_parallel, paths_object.shards = self._validate_shards(info)
+            paths_object.incremental = self._validate_link_dest(info)
+            paths_object.native = self._validate_engine(info, paths_object.incremental, paths_object.max_parallel,
+                                                        paths_object.shards)
+        except ValueError as exception_object:
+            return self.failure(str(exception_object))
+
+        if info.get('index', False):
+            paths_object.native.index_path = info.get('index_path') or os.path.join(paths.backups_path,
+                                                                                    f".{project}.index.sqlite")
+        paths_object.shard_cache = info.get('shard_cache') or os.path.join(paths.backups_path, SHARD_CACHE)
 
         return paths_object
@@ -4,26 +4,87 @@
 
 """Base Plugin Functionality"""
 
+import asyncio
+import contextlib
 import logging
-import os
 import subprocess
+import time
 
-from typing import Callable, Tuple
+from typing import (Any, Callable, Coroutine, List, Optional, Tuple)
 
+from eljef.backup.process import (ENGINE, STDERR_TAIL, RingBuffer, credentials, preexec_credentials, run_command)
 from eljef.backup.project import Paths
 
 LOGGER = logging.getLogger(__name__)
 
 
+class StageSettings:
+    """Settings any stage can set, whatever its plugin, set from the settings of the stage
+
+    Attributes:
+        background: this stage, and every stage after it in the project, runs in the
+                    background while the following projects run
+        resources: resource tags this stage uses, such as cpu, disk:/backups or net:offsite,
+                   set from implied_resources when the stage does not set them
+        retries: number of times this stage is run again after failing
+        retry_delay: seconds waited before the first retry, doubled before each further retry
+        retry_on: exit statuses of a failed command this stage is retried on, empty retries
+                  any failure
+        stderr_tail: bytes of stderr of a command kept for its failure message
+        stdout_file: if set, stdout of commands is appended to this file instead of being
+                     discarded
+        timeout: seconds this stage may run for, None does not limit it
+    """
+
+    stderr_tail = STDERR_TAIL
+
+    def __init__(self) -> None:
+        self.background = False
+        self.resources: List[str] = []
+        self.retries = 0
+        self.retry_delay = 10.0
+        self.retry_on: List[int] = []
+        self.stdout_file = ''
+        self.timeout: Optional[float] = None
+
+
+class StageState:
+    """State of the last run of a stage
+
+    Attributes:
+        deadline: time.monotonic() after which commands of this stage are stopped, 0 if the
+                  stage has no timeout. set by Plugin.start.
+        duration: seconds the last successful run of this stage took, None if it has not run
+        project_deadline: time.monotonic() after which the project this stage belongs to
+                          times out, 0 if the project has no timeout
+        returncode: exit status of the last command of this stage that failed, None if none
+                    failed with an exit status, such as when a command timed out
+        started: time.monotonic() this stage started running at, 0 if it has not started
+    """
+
+    def __init__(self) -> None:
+        self.deadline = 0.0
+        self.duration: Optional[float] = None
+        self.project_deadline = 0.0
+        self.returncode: Optional[int] = None
+        self.started = 0.0
+
+
 class Plugin:
     """Base Plugin Class that plugins must inherit
 
+    Attributes:
+        settings: settings of this stage
+        state: state of the last run of this stage
+
     Args:
         paths: paths and backup name
         project: name of project
     """
 
     def __init__(self, paths: Paths, project: str) -> None:
+        self.settings = StageSettings()
+        self.state = StageState()
         self.gid = 0
         self.uid = 0
         self.run_as = False
@@ -34,20 +95,43 @@ def __init__(self, paths: Paths, project: str) -> None:
     def demote(uid: int, gid: int) -> Callable:
         """Demotes the subprocess to the stored uid and gid
 
+        Notes:
+            exec no longer uses this, kept for plugins that start their own subprocesses.
+
         Returns:
             a callable to demote the run subprocess
         """
-        def set_uid_gid():
-            os.setgid(gid)
-            os.setuid(uid)
-
-        return set_uid_gid
+        return preexec_credentials(uid, gid)
 
     def exec(self, cmd: list) -> Tuple[bool, str]:
         """Execute a command
 
+        Notes:
+            The command is run on the shared process engine. The calling thread waits for
+            it, so plugins calling exec work as they always have.
+
+            Output is never held in memory: with debug logging, both outputs are logged
+            line by line as they are written. Only the last stderr_tail bytes of stderr are
+            kept, for the failure message, and stdout is discarded or appended to stdout_file.
+
+            Once the stage or project timeout runs out, the command and every process it
+            started are stopped, and the stage fails.
+
+        Args:
+            cmd: command to execute
+
+        Returns;
+            A tuple of True/False if the command executed correctly and an error message if the command failed.
+        """
+        return self.run_async(self.exec_async(cmd))
+
+    async def exec_async(self, cmd: list, timeout: Optional[float] = None, label: str = '') -> Tuple[bool, str]:
+        """Execute a command, awaitable from coroutines running on the process engine
+
         Args:
             cmd: command to execute
+            timeout: seconds the command may run for, None only limits it by the stage and project timeouts
+            label: name output of the command is logged under, the command name if not set
 
         Returns;
             A tuple of True/False if the command executed correctly and an error message if the command failed.
@@ -55,24 +139,152 @@ def exec(self, cmd: list) -> Tuple[bool, str]:
         cmd_msg = ' '.join(cmd)
         LOGGER.debug(cmd_msg)
 
-        try:
-            if self.run_as:
-                LOGGER.debug("running as: %s - %s", self.uid, self.gid)
-                subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
-                               preexec_fn=self.demote(self.uid, self.gid))
-            else:
-                subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        except subprocess.CalledProcessError as exception_object:
-            if exception_object.stderr:
-                LOGGER.error(exception_object.stderr)
+        start = time.monotonic()
+        deadline = self.state.deadline
+        if deadline:
+            timeout = min(timeout, deadline - start) if timeout is not None else deadline - start
+        if timeout is not None and timeout <= 0:
+            return self._timed_out(start, cmd_msg)
+
+        with contextlib.ExitStack() as stack:
+            try:
+                result = await run_command(cmd, timeout, **self._command_kwargs(label or cmd[0], stack))
+                result.check_returncode()
+            except asyncio.TimeoutError:
+                return self._timed_out(start, cmd_msg)
+            except subprocess.CalledProcessError as exception_object:
+                self.state.returncode = exception_object.returncode
+                if exception_object.stderr:
+                    stderr = exception_object.stderr.decode(errors='replace')
+                    if label:
+                        stderr = f"{label}: {stderr}"
+                    LOGGER.error(stderr)
+
+                err_msg = f"Failed: {cmd_msg}"
+                LOGGER.error(err_msg)
+
+                return False, err_msg
+
+        return True, ''
+
+    def _command_kwargs(self, name: str, stack: contextlib.ExitStack) -> dict:
+        """Returns the arguments for run_command running a command of this stage
+
+        Args:
+            name: name output of the command is logged under
+            stack: exit stack closing the stdout file once the command has finished
+
+        Returns:
+            dictionary of keyword arguments for run_command
+        """
+        kwargs = {'stderr': RingBuffer(self.settings.stderr_tail)}
+        if self.run_as:
+            LOGGER.debug("running as: %s - %s", self.uid, self.gid)
+            kwargs.update(credentials(self.uid, self.gid))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            kwargs['on_stdout'] = self._log_line(name, 'stdout')
+            kwargs['on_stderr'] = self._log_line(name, 'stderr')
+        if self.settings.stdout_file:
+            # pylint: disable=consider-using-with
+            kwargs['stdout'] = stack.enter_context(open(self.settings.stdout_file, 'ab'))
+
+        return kwargs
+
+    def exec_parallel(self, cmds: List[Tuple[str, list]], max_parallel: int = 1) -> Tuple[bool, str]:
+        """Execute commands, up to max_parallel at once
+
+        Notes:
+            Every command is run, even after one fails, so independent commands all get
+            their work done. Output of each command is logged under its label.
+
+        Args:
+            cmds: labels and commands to execute, started in order
+            max_parallel: number of commands running at once
+
+        Returns:
+            A tuple of True/False if all commands executed correctly and the error messages of the commands
+            that failed, each prefixed with its label.
+        """
+        async def run_all() -> List[Tuple[bool, str]]:
+            slots = asyncio.Semaphore(max_parallel)
+
+            async def run_one(label: str, cmd: list) -> Tuple[bool, str]:
+                async with slots:
+                    return await self.exec_async(cmd, label=label)
 
-            err_msg = f"Failed: {cmd_msg}"
-            LOGGER.error(err_msg)
+            return await asyncio.gather(*(run_one(label, cmd) for label, cmd in cmds))
 
-            return False, err_msg
+        errors = [f"{label}: {err_msg}" for (label, _), (success, err_msg) in zip(cmds, self.run_async(run_all()))
+                  if not success]
+        if errors:
+            return False, '; '.join(errors)
 
         return True, ''
 
+    def _timed_out(self, start: float, cmd_msg: str) -> Tuple[bool, str]:
+        """Logs and returns the failure of a command that timed out
+
+        Args:
+            start: time.monotonic() the command was started at
+            cmd_msg: the command
+
+        Returns:
+            False and the error message, with how long the stage, or the command outside of a stage, ran
+        """
+        err_msg = f"Timed out after {time.monotonic() - (self.state.started or start):.1f} seconds: {cmd_msg}"
+        LOGGER.error(err_msg)
+
+        return False, err_msg
+
+    @staticmethod
+    def _log_line(name: str, output: str) -> Callable[[bytes], None]:
+        """Returns a callable logging lines of output of a command at debug level
+
+        Args:
+            name: name of the command
+            output: name of the output the lines are read from
+
+        Returns:
+            a callable logging a line
+        """
+        def log_line(line: bytes) -> None:
+            LOGGER.debug("%s %s: %s", name, output, line.decode(errors='replace').rstrip('\n'))
+
+        return log_line
+
+    @staticmethod
+    def run_async(coroutine: Coroutine[Any, Any, Any]) -> Any:
+        """Runs a coroutine on the process engine and waits for its result
+
+        Plugins supervising several commands at once can gather exec_async calls in one
+        coroutine and run it with this.
+
+        Args:
+            coroutine: coroutine to run
+
+        Returns:
+            the result of the coroutine
+        """
+        return ENGINE.run(coroutine)
+
+    def start(self) -> None:
+        """Marks this stage as started, starting its timeout"""
+        state = self.state
+        state.returncode = None
+        state.started = time.monotonic()
+        timeout = self.settings.timeout
+        deadlines = [deadline for deadline in (state.project_deadline, state.started + timeout if timeout else 0.0)
+                     if deadline]
+        state.deadline = min(deadlines, default=0.0)
+
+    def implied_resources(self) -> List[str]:
+        """Returns the resource tags a stage of this plugin uses when none are configured
+
+        Returns:
+            list of resource tags
+        """
+        return []
+
     def run(self) -> Tuple[bool, str]:
         """Run operations for this plugin
 
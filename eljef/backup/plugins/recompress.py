@@ -0,0 +1,270 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+# pylint: disable=too-few-public-methods
+
+"""Tiered Recompression Plugin"""
+
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+
+from typing import (List, Optional, Tuple)
+
+from eljef.backup.archive_index import ArchiveIndex
+from eljef.backup.backup import NAME_FORMAT
+from eljef.backup.compression import (INDEX, STORED, archive_name, codec_of, get_codec, recompress_archive,
+                                      validate_codec)
+from eljef.backup.plugins import plugin
+from eljef.backup.project import Paths
+from eljef.core import fops
+
+LOGGER = logging.getLogger(__name__)
+
+STATE_FILE = '.recompress.json'
+"""STATE_FILE is the default name of the recompress state file in the backups path"""
+
+
+def _lower_priority() -> None:
+    """Lowers the cpu and io priority of the current process"""
+    os.nice(19)
+    if shutil.which('ionice'):
+        subprocess.run(['ionice', '-c', '3', '-p', str(os.getpid())], check=False,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class RecompressPlugin(plugin.Plugin):
+    """Recompresses archives of older backups with a dense codec
+
+    Notes:
+        Archives that have reached their final codec are recorded in a state file, so
+        they are never recompressed again. Recompression runs in a child process at the
+        lowest cpu and io priority. When the time budget runs out, the archive being
+        recompressed is abandoned and is picked up again by the next run.
+
+    Args:
+        paths: paths and backup name
+        project: name of project
+    """
+
+    def __init__(self, paths: Paths, project: str) -> None:
+        super().__init__(paths, project)
+        self.age_days = 7
+        self.codec = 'xz'
+        self.level = None
+        self.state_file = ''
+        self.time_budget = 0
+        self.workers = 1
+
+    @staticmethod
+    def _backup_age(name: str, path: str) -> datetime.timedelta:
+        """Returns the age of a backup from its name, or the archive mtime if the name is not a date
+
+        Args:
+            name: name of the backup
+            path: full path to the archive of the backup
+
+        Returns:
+            age of the backup
+        """
+        try:
+            created = datetime.datetime.strptime(name, NAME_FORMAT)
+        except ValueError:
+            created = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+
+        return datetime.datetime.now() - created
+
+    def _candidates(self, final: dict) -> List[Tuple[str, str]]:
+        """Finds archives that are old enough and are not in their final codec
+
+        Args:
+            final: archive file names already in their final codec, from the state file
+
+        Returns:
+            list of backup names and full archive paths, oldest first
+        """
+        target = get_codec(self.codec)
+        candidates = []
+        for file_name in sorted(os.listdir(self.paths.backups_path)):
+            path = os.path.join(self.paths.backups_path, file_name)
+            name = archive_name(file_name)
+            if not name or codec_of(file_name) is None or file_name in final or not os.path.isfile(path) or \
+                    file_name.startswith(f"{name}.{STORED}."):
+                continue
+            if self._backup_age(name, path) < datetime.timedelta(days=self.age_days):
+                continue
+            if codec_of(file_name) is target:
+                final[file_name] = self.codec
+                continue
+            candidates.append((name, path))
+
+        return candidates
+
+    @staticmethod
+    def _recompress_index(path: str, target: str) -> Optional[ArchiveIndex]:
+        """Starts the index of a recompressed archive from the index of the source archive
+
+        Args:
+            path: full path to the source archive
+            target: full path to the recompressed archive
+
+        Returns:
+            the index for target, or None if the source archive has no index
+        """
+        source_index = f"{path}.{INDEX}"
+        if not os.path.isfile(source_index):
+            return None
+
+        index = ArchiveIndex(target)
+        index.copy_members(source_index)
+
+        return index
+
+    def _load_state(self) -> dict:
+        """Loads the state file
+
+        Returns:
+            the state dictionary, empty if the state file does not exist
+        """
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as state:
+                return json.load(state)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, state: dict) -> None:
+        """Atomically writes the state file
+
+        Args:
+            state: the state dictionary
+        """
+        partial = f"{self.state_file}.part"
+        with open(partial, 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+        os.replace(partial, self.state_file)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    # pylint: disable=too-many-positional-arguments
+    def _recompress(path: str, target: str, codec: str, level: Optional[int], workers: int, deadline: float) -> None:
+        """Recompresses an archive, carrying its index over when it has one
+
+        Args:
+            path: full path to the source archive
+            target: full path to the recompressed archive
+            codec: name of the registered codec to recompress with
+            level: compression level, None uses the default level of the codec
+            workers: number of compression workers
+            deadline: time.time() after which recompression is stopped, 0 disables the deadline
+        """
+        index = RecompressPlugin._recompress_index(path, target)
+        try:
+            recompress_archive(path, target, codec, level, workers, deadline, index)
+        except BaseException:
+            if index is not None:
+                index.abort()
+            raise
+
+    def implied_resources(self) -> List[str]:
+        """Compression uses the cpu and the disk holding the backups
+
+        Returns:
+            list of resource tags
+        """
+        return ['cpu', f"disk:{self.paths.backups_path}"]
+
+    def run(self) -> Tuple[bool, str]:
+        """Run operations for this plugin
+
+        Notes:
+            If the plugin is saving files, it must save them in a subdirectory
+            of the parent backup directory.
+
+        Returns:
+            bool: operations completed successfully
+            str: if operations failed, the error message explaining what failed
+        """
+        deadline = time.time() + self.time_budget * 60 if self.time_budget else 0
+        state = self._load_state()
+        final = {file_name: codec for file_name, codec in state.get('final', {}).items()
+                 if os.path.isfile(os.path.join(self.paths.backups_path, file_name))}
+        state['final'] = final
+        extension = get_codec(self.codec).extension
+        errors = []
+
+        # stages run in threads, so the recompression process is not forked from this process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('forkserver'),
+                                                    initializer=_lower_priority) as pool:
+            for name, path in self._candidates(final):
+                if deadline and time.time() >= deadline:
+                    LOGGER.info("recompress: time budget used, stopping before %s", name)
+                    break
+
+                target = os.path.join(self.paths.backups_path, f"{name}.{extension}")
+                if not os.path.isfile(target):
+                    LOGGER.info("recompress: %s -> %s", path, target)
+                    try:
+                        pool.submit(self._recompress, path, target, self.codec, self.level, self.workers,
+                                    deadline).result()
+                    except TimeoutError:
+                        LOGGER.info("recompress: time budget used, %s will be restarted next run", name)
+                        break
+                    except Exception as exception_object:  # pylint: disable=broad-exception-caught
+                        errors.append(f"recompress {name}: {exception_object}")
+                        continue
+
+                fops.delete(path)
+                if os.path.isfile(f"{path}.{INDEX}"):
+                    fops.delete(f"{path}.{INDEX}")
+                final[os.path.basename(target)] = self.codec
+                self._save_state(state)
+
+        self._save_state(state)
+
+        if errors:
+            return False, '; '.join(errors)
+
+        return True, ''
+
+
+class SetupRecompressPlugin(plugin.SetupPlugin):
+    """Setup Plugin Class that sets up the recompress plugin class for operations"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.name = 'recompress'
+        self.description = 'recompresses older backups with a dense codec'
+
+    def setup(self, paths: Paths, project: str, info: dict) -> object:
+        """Sets up a plugin for operations
+
+        Args:
+            paths: paths and backup names
+            project: name of project this plugin is being setup for
+            info: dictionary of information from configuration file, specific to this plugin
+
+        Returns:
+            dict: dictionary key: stage_name => object: plugin class to be run
+        """
+        recompress_plugin = RecompressPlugin(paths, project)
+
+        codec, level, msg = validate_codec(info.get('codec', 'xz'), info.get('level'))
+        if msg:
+            return self.failure(msg)
+        recompress_plugin.codec = codec
+        recompress_plugin.level = level
+
+        for setting in ('age_days', 'time_budget', 'workers'):
+            value = info.get(setting, getattr(recompress_plugin, setting))
+            if not isinstance(value, int) or value < 0:
+                return self.failure(f"{setting} must be a positive integer")
+            setattr(recompress_plugin, setting, value)
+
+        recompress_plugin.state_file = info.get('state_file') or os.path.join(paths.backups_path, STATE_FILE)
+
+        return recompress_plugin
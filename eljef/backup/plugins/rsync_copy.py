@@ -6,7 +6,7 @@
 
 import logging
 
-from typing import Tuple
+from typing import (List, Tuple)
 
 from eljef.backup.backup import rsync_terminate_path
 from eljef.backup.plugins import plugin
@@ -23,6 +23,7 @@ class RSYNCCopyPlugin(plugin.Plugin):
         project: name of project
 
     Attributes:
+        max_parallel: number of paths copied at once
         rsync_options: command line flags for the rsync command
         rsync_paths: a list of dictionaries containing paths and excludes
 
@@ -36,9 +37,18 @@ class RSYNCCopyPlugin(plugin.Plugin):
 
     def __init__(self, paths: Paths, project: str) -> None:
         super().__init__(paths, project)
+        self.max_parallel = 1
         self.rsync_options = ['-a']
         self.rsync_paths = []
 
+    def implied_resources(self) -> List[str]:
+        """Copying writes to the disk of each destination path
+
+        Returns:
+            list of resource tags
+        """
+        return sorted({f"disk:{copy_path.get('to')}" for copy_path in self.rsync_paths})
+
     def run(self) -> Tuple[bool, str]:
         """Run operations for this plugin
 
@@ -46,10 +56,14 @@ def run(self) -> Tuple[bool, str]:
             If the plugin is saving files, it must save them in a subdirectory
             of the parent backup directory.
 
+            Paths are copied max_parallel at a time. Every path is copied even if
+            copying another fails.
+
         Returns:
             bool: operations completed successfully
             str: if operations failed, the error message explaining what failed
         """
+        cmds = []
         for copy_path in self.rsync_paths:
             from_path = rsync_terminate_path(copy_path.get('from'))
             to_path = rsync_terminate_path(copy_path.get('to'))
@@ -62,11 +76,9 @@ def run(self) -> Tuple[bool, str]:
 
             cmd += [from_path, to_path]
 
-            success, err_msg = self.exec(cmd)
-            if not success:
-                return success, err_msg
+            cmds.append((f"{copy_path.get('from')} -> {copy_path.get('to')}", cmd))
 
-        return True, ''
+        return self.exec_parallel(cmds, self.max_parallel)
 
 
 class SetupRSYNCCopyPlugin(plugin.SetupPlugin):
@@ -102,7 +114,12 @@ def setup(self, paths: Paths, project: str, info: dict) -> object:
             if not path:
                 return self.failure('each path definition must contain a to')
 
+        max_parallel = info.get('max_parallel', 1)
+        if not isinstance(max_parallel, int) or max_parallel < 1:
+            return self.failure('max_parallel must be an integer greater than zero')
+
         paths_object = RSYNCCopyPlugin(paths, project)
+        paths_object.max_parallel = max_parallel
         paths_object.rsync_paths = rsync_paths
         opts = info.get('rsync_options', [])
         if opts:
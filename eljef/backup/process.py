@@ -0,0 +1,319 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Asynchronous Subprocess Engine"""
+
+import asyncio
+import collections
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+from asyncio.subprocess import Process
+from typing import (Any, BinaryIO, Callable, Coroutine, Deque, List, Optional, Union)
+
+try:
+    import pwd
+except ImportError:  # pragma: no cover
+    pwd = None
+
+LOGGER = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+"""READ_SIZE is the amount of output read from a child process at a time"""
+
+STDERR_TAIL = 64 * 1024
+"""STDERR_TAIL is the default amount of stderr kept for failure messages"""
+
+TERMINATE_GRACE = 10.0
+"""TERMINATE_GRACE is the seconds a timed out process group has to exit after SIGTERM before it is killed"""
+
+LineCallback = Callable[[bytes], None]
+"""LineCallback is called with every line a child process writes to an output"""
+
+
+class RingBuffer:
+    """Keeps the last size bytes written to it
+
+    Args:
+        size: number of bytes kept
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+        self._chunks: Deque[bytes] = collections.deque()
+        self._length = 0
+
+    def getvalue(self) -> bytes:
+        """Returns the last size bytes written"""
+        return b''.join(self._chunks)[-self.size:] if self.size else b''
+
+    def write(self, data: bytes) -> int:
+        """Writes data, dropping the oldest data over size
+
+        Args:
+            data: data to write
+
+        Returns:
+            number of bytes written
+        """
+        self._chunks.append(bytes(data))
+        self._length += len(data)
+        while self._chunks and self._length - len(self._chunks[0]) >= self.size:
+            self._length -= len(self._chunks.popleft())
+
+        return len(data)
+
+
+Sink = Union[BinaryIO, RingBuffer]
+"""Sink is a writable binary object output of a child process is written to as it is read"""
+
+
+# a ProcessResult is only read, like the subprocess.CompletedProcess it stands in for
+# pylint: disable=too-few-public-methods
+class ProcessResult:
+    """Result of a finished child process
+
+    Args:
+        cmd: command that was run
+        returncode: exit status of the child process
+        stdout: stdout kept by a ring buffer, empty if stdout was not kept in one
+        stderr: stderr kept by a ring buffer, empty if stderr was not kept in one
+    """
+
+    def __init__(self, cmd: List[str], returncode: int, stdout: bytes, stderr: bytes) -> None:
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def check_returncode(self) -> None:
+        """Raises CalledProcessError if the child process did not exit with status 0"""
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.cmd, self.stdout, self.stderr)
+
+
+class Engine:
+    """Supervises child processes from one event loop running in a background thread
+
+    Any number of threads may run coroutines on the engine at once, so concurrent stages
+    share one event loop instead of each holding a thread blocked on its child process.
+    The loop is started on first use.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop of the engine, started on first use"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='process-engine', daemon=True).start()
+
+        return self._loop
+
+    def run(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        """Runs a coroutine on the engine and waits for its result
+
+        Args:
+            coroutine: coroutine to run
+
+        Returns:
+            the result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+ENGINE = Engine()
+"""ENGINE is the engine Plugin.exec runs child processes on"""
+
+
+def _supplementary_groups(uid: int, gid: int) -> List[int]:
+    """Returns the supplementary groups of a user
+
+    Args:
+        uid: user id
+        gid: primary group id of the user
+
+    Returns:
+        group ids of the user from the group database, or only gid if uid has no user entry
+    """
+    try:
+        return os.getgrouplist(pwd.getpwuid(uid).pw_name, gid) if pwd else [gid]
+    except KeyError:
+        return [gid]
+
+
+def preexec_credentials(uid: int, gid: int) -> Callable[[], None]:
+    """Returns a preexec_fn that sets the user and group of a child process
+
+    When running as root, supplementary groups are replaced with those of uid.
+
+    Args:
+        uid: user id to run as
+        gid: group id to run as
+
+    Returns:
+        a callable to pass as preexec_fn
+    """
+    groups = _supplementary_groups(uid, gid) if os.geteuid() == 0 else None
+
+    def demote() -> None:
+        if groups is not None:
+            os.setgroups(groups)
+        os.setgid(gid)
+        os.setuid(uid)
+
+    return demote
+
+
+def credentials(uid: int, gid: int) -> dict:
+    """Returns arguments for subprocess.Popen that run a child process as a user and group
+
+    On python 3.9 and later the user, group and extra_groups arguments are used, so the
+    credentials are changed by the C child code of subprocess. No python code runs between
+    fork and exec, which is safe with other threads running and avoids the slow preexec_fn
+    path. On python 3.8, the same credentials are set with a preexec_fn.
+
+    When running as root, supplementary groups are replaced with those of uid, so the child
+    does not keep the groups of root. Otherwise they are left as they are, as only root may
+    change them.
+
+    Args:
+        uid: user id to run as
+        gid: group id to run as
+
+    Returns:
+        dictionary of keyword arguments for subprocess.Popen or asyncio.create_subprocess_exec
+    """
+    if sys.version_info < (3, 9):  # pragma: no cover
+        return {'preexec_fn': preexec_credentials(uid, gid)}
+
+    kwargs = {'user': uid, 'group': gid}
+    if os.geteuid() == 0:
+        kwargs['extra_groups'] = _supplementary_groups(uid, gid)
+
+    return kwargs
+
+
+async def _read_output(stream: asyncio.StreamReader, sink: Optional[Sink], on_line: Optional[LineCallback]) -> None:
+    """Reads an output of a child process until it is closed, keeping none of it in memory
+
+    Args:
+        stream: output of the child process
+        sink: if set, everything read is written to it
+        on_line: if set, called with every line as it is read
+    """
+    partial = b''
+    while True:
+        chunk = await stream.read(READ_SIZE)
+        if not chunk:
+            if partial and on_line is not None:
+                on_line(partial)
+            return
+        if sink is not None:
+            sink.write(chunk)
+        if on_line is not None:
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                on_line(line + b'\n')
+
+
+def _signal(process: Process, group: bool, signal_number: int) -> None:
+    """Sends a signal to a child process, or to its whole process group
+
+    Args:
+        process: the child process
+        group: signal the process group the child process leads
+        signal_number: signal to send
+    """
+    try:
+        if group:
+            os.killpg(process.pid, signal_number)
+        elif process.returncode is None:
+            process.send_signal(signal_number)
+    except ProcessLookupError:
+        pass
+
+
+async def _stop(process: Process, group: bool, grace: float = 0.0) -> None:
+    """Stops a child process that is still running and waits for it to exit
+
+    With a grace period, SIGTERM is sent first and SIGKILL only once grace runs out.
+    When group is set, the signals go to the whole process group, so children the
+    child process started, such as the ssh behind sshfs, are stopped with it.
+
+    Args:
+        process: the child process
+        group: the child process leads its own process group
+        grace: seconds the child process has to exit after SIGTERM, 0 kills it right away
+    """
+    if process.returncode is None and grace > 0:
+        _signal(process, group, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.shield(process.wait()), grace)
+        except asyncio.TimeoutError:
+            LOGGER.warning("process %s did not exit %s seconds after SIGTERM, killing it", process.pid, grace)
+    _signal(process, group, signal.SIGKILL)
+    await process.wait()
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+async def run_command(cmd: List[str], timeout: Optional[float] = None, on_stdout: Optional[LineCallback] = None,
+                      on_stderr: Optional[LineCallback] = None, stdout: Optional[Sink] = None,
+                      stderr: Optional[Sink] = None, **kwargs) -> ProcessResult:
+    """Runs a child process, streaming its stdout and stderr as they are written
+
+    Output is read in READ_SIZE chunks and passed on, so memory use does not depend on how
+    much the child process writes. Output is only kept when a sink is given: a RingBuffer
+    keeps its tail in memory, a file spools all of it. stdout that is neither kept nor
+    read line by line is sent to /dev/null without being read.
+
+    With a timeout, the child process is started in a process group of its own. When the
+    timeout runs out, the group is sent SIGTERM, then SIGKILL TERMINATE_GRACE seconds later,
+    and waited on before the timeout is raised, so no child is left behind. If the coroutine
+    is cancelled, the child process is killed right away.
+
+    Args:
+        cmd: command to run
+        timeout: seconds the child process may run for, None does not limit it
+        on_stdout: if set, called with every line the child process writes to stdout
+        on_stderr: if set, called with every line the child process writes to stderr
+        stdout: if set, stdout is written to it
+        stderr: if set, stderr is written to it
+        kwargs: further arguments for asyncio.create_subprocess_exec, such as cwd or env
+
+    Returns:
+        the result of the child process
+
+    Raises:
+        asyncio.TimeoutError: the child process ran for longer than timeout
+    """
+    read_stdout = stdout is not None or on_stdout is not None
+    group = timeout is not None
+    if group:
+        kwargs['start_new_session'] = True
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE if read_stdout else subprocess.DEVNULL,
+                                                   stderr=subprocess.PIPE, **kwargs)
+    readers = [_read_output(process.stderr, stderr, on_stderr), process.wait()]
+    if read_stdout:
+        readers.append(_read_output(process.stdout, stdout, on_stdout))
+    try:
+        returncode = (await asyncio.wait_for(asyncio.gather(*readers), timeout))[1]
+    except asyncio.TimeoutError:
+        await _stop(process, group, TERMINATE_GRACE)
+        raise
+    except BaseException:
+        await _stop(process, group)
+        raise
+
+    return ProcessResult(cmd, returncode, stdout.getvalue() if isinstance(stdout, RingBuffer) else b'',
+                         stderr.getvalue() if isinstance(stderr, RingBuffer) else b'')
@@ -4,15 +4,25 @@
 
 """Backup Project Operations"""
 
+import functools
 import logging
+import time
 
-from typing import Tuple
+from typing import (Any, Dict, List, Optional, Tuple)
 
+from eljef.backup.history import History
+from eljef.backup.journal import Journal
+from eljef.backup.scheduler import (Done, Pipeline, ResourceLimits, Scheduler, check_dependencies)
 from eljef.core.dictobj import DictObj
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _positive_number(value: Any) -> bool:
+    """Returns True if value is an integer or float greater than zero"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
 class Paths:
     """Paths holder class
 
@@ -51,10 +61,76 @@ class Project:
 
     def __init__(self, paths: Paths, project: str, plugins: DictObj, info: DictObj):
         self.project = project
+        self.journal = Journal('')
+        self.key = project
+        self.limits = ResourceLimits()
         self.map = DictObj({})
+        self.timeout: Optional[float] = None
 
         self._setup(paths, plugins, info)
 
+    @staticmethod
+    def _stage_settings(op_name: str, op_settings: dict) -> dict:
+        """Validates the settings any stage can set, whatever its plugin
+
+        Args:
+            op_name: name of the stage
+            op_settings: settings of the stage
+
+        Returns:
+            dictionary of stage settings and their values, resources is None when not set
+
+        Raises:
+            ValueError: a setting is not valid
+        """
+        settings = {'background': op_settings.get('background', False),
+                    'stdout_file': op_settings.get('stdout_file', ''),
+                    'resources': op_settings.get('resources'),
+                    'timeout': op_settings.get('timeout')}
+
+        if not isinstance(settings['background'], bool):
+            raise ValueError(f"{op_name}: background must be true or false")
+        if not isinstance(settings['stdout_file'], str):
+            raise ValueError(f"{op_name}: stdout_file must be a path")
+        tags = settings['resources']
+        if tags is not None and not (isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)):
+            raise ValueError(f"{op_name}: resources must be a list of resource tags")
+        if settings['timeout'] is not None and not _positive_number(settings['timeout']):
+            raise ValueError(f"{op_name}: timeout must be a number of seconds greater than zero")
+
+        settings.update(Project._retry_settings(op_name, op_settings))
+
+        return settings
+
+    @staticmethod
+    def _retry_settings(op_name: str, op_settings: dict) -> dict:
+        """Validates the retry settings any stage can set, whatever its plugin
+
+        Args:
+            op_name: name of the stage
+            op_settings: settings of the stage
+
+        Returns:
+            dictionary of stage settings and their values
+
+        Raises:
+            ValueError: a setting is not valid
+        """
+        settings = {'retries': op_settings.get('retries', 0),
+                    'retry_delay': op_settings.get('retry_delay', 10),
+                    'retry_on': op_settings.get('retry_on', [])}
+
+        if not isinstance(settings['retries'], int) or isinstance(settings['retries'], bool) or \
+                settings['retries'] < 0:
+            raise ValueError(f"{op_name}: retries must be a positive integer")
+        if settings['retry_delay'] != 0 and not _positive_number(settings['retry_delay']):
+            raise ValueError(f"{op_name}: retry_delay must be a positive number of seconds")
+        if not isinstance(settings['retry_on'], list) or \
+                not all(isinstance(code, int) and not isinstance(code, bool) for code in settings['retry_on']):
+            raise ValueError(f"{op_name}: retry_on must be a list of exit statuses")
+
+        return settings
+
     def _setup(self, paths: Paths, plugins: DictObj, info: DictObj) -> None:
         for op_name, op_settings in info.items():
             plugin = op_settings.get('plugin')
@@ -64,11 +140,31 @@ def _setup(self, paths: Paths, plugins: DictObj, info: DictObj) -> None:
             if plugin not in plugins:
                 raise ValueError(f"plugin not found: {plugin}")
 
-            self.map[op_name] = plugins[plugin]().setup(paths, self.project, op_settings)
+            settings = self._stage_settings(op_name, op_settings)
 
-    def run(self) -> Tuple[bool, str, str]:
+            setup_plugin = plugins[plugin]()
+            self.map[op_name] = setup_plugin.setup(paths, self.project, op_settings)
+            if self.map[op_name] is None:
+                raise ValueError(setup_plugin.error)
+            for setting, value in settings.items():
+                setattr(self.map[op_name].settings, setting, value)
+            if settings['resources'] is None:
+                self.map[op_name].settings.resources = self.map[op_name].implied_resources()
+
+    @property
+    def background(self) -> bool:
+        """True if any stage of this project runs in the background"""
+        return any(stage.settings.background for stage in self.map.values())
+
+    def run(self, pipeline: Optional[Pipeline] = None, done: Optional[Done] = None) -> Tuple[bool, str, str]:
         """Run operations for this project
 
+        Args:
+            pipeline: if set, the first stage marked background and every stage after it are
+                      queued on pipeline instead of being run
+            done: if set, called with the result once every stage has finished, which is after
+                  run returns when stages were queued on pipeline
+
         Returns:
             bool: operations completed successfully
             str: if operations failed, the error message explaining what failed
@@ -76,25 +172,94 @@ def run(self) -> Tuple[bool, str, str]:
         """
         LOGGER.info("Project: %s", self.project)
 
-        for pos in sorted(list(self.map.keys())):
-            finished, error_msg = self.map[pos].run()
+        names = sorted(list(self.map.keys()))
+        if self.timeout:
+            deadline = time.monotonic() + self.timeout
+            for name in names:
+                self.map[name].state.project_deadline = deadline
+        split = len(names)
+        if pipeline is not None:
+            split = next((pos for pos, name in enumerate(names) if self.map[name].settings.background), split)
+
+        for name in names[:split]:
+            finished, error_msg = self.run_stage(name)
             if not finished:
+                if done is not None:
+                    done(finished, error_msg)
                 return finished, error_msg, self.project
 
+        if names[split:]:
+            pipeline.submit(self.project, [functools.partial(self.run_stage, name) for name in names[split:]], done)
+        elif done is not None:
+            done(True, '')
+
         return True, '', ''
 
+    def run_stage(self, name: str) -> Tuple[bool, str]:
+        """Runs a stage of this project, unless the backup being resumed completed it
 
+        Args:
+            name: name of the stage
+
+        Returns:
+            bool: operations completed successfully
+            str: if operations failed, the error message explaining what failed
+        """
+        if self.journal.done(self.key, name):
+            LOGGER.info("%s: %s: completed before resuming, skipped", self.project, name)
+            return True, ''
+
+        finished, error_msg = self.limits.run(self.map[name])
+        if finished:
+            self.journal.record(self.key, name)
+
+        return finished, error_msg
+
+
+# pylint: disable=too-many-instance-attributes
 class Projects:
     """Projects holder class
 
     paths: paths and backup name
     plugins: loaded plug-ins
     project_configs: project configurations
+    pipeline_depth: number of projects whose background stages may wait to run, 0 runs every
+                    stage in sequence
+    max_parallel_projects: number of projects run at once
+    resource_limits: maximum number of stages using each resource at once, keyed by resource tag
+    history: durations of previous runs, used to start long projects first and updated after running
+    time_budget: minutes after which no new project is started, 0 does not limit the run
+    journal: records completed stages, and skips stages completed by the backup being resumed
+    continue_on_failure: keep running projects that do not depend on a failed project
     """
 
-    def __init__(self, paths: Paths, plugins: DictObj, project_configs: DictObj) -> None:
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, paths: Paths, plugins: DictObj, project_configs: DictObj, pipeline_depth: int = 0,
+                 max_parallel_projects: int = 1, resource_limits: Optional[Dict[str, int]] = None,
+                 history: Optional[History] = None, time_budget: float = 0,
+                 journal: Optional[Journal] = None, continue_on_failure: bool = False) -> None:
+        if not isinstance(pipeline_depth, int) or isinstance(pipeline_depth, bool) or pipeline_depth < 0:
+            raise ValueError('pipeline_depth must be a positive integer')
+        if not isinstance(max_parallel_projects, int) or isinstance(max_parallel_projects, bool) or \
+                max_parallel_projects < 1:
+            raise ValueError('max_parallel_projects must be an integer greater than zero')
+        if time_budget and not _positive_number(time_budget):
+            raise ValueError('time_budget must be a number of minutes greater than zero')
+        if not isinstance(continue_on_failure, bool):
+            raise ValueError('continue_on_failure must be true or false')
+
+        self.continue_on_failure = continue_on_failure
+        self.depends_on: Dict[str, List[str]] = {}
         self.error = ''
+        self.history = history or History('')
+        self.journal = journal or Journal('')
+        self.regressions: List[str] = []
+        self.status: Dict[str, str] = {}
+        self.limits = ResourceLimits(resource_limits)
         self.map = DictObj({})
+        self.max_parallel_projects = max_parallel_projects
+        self.pipeline_depth = pipeline_depth
+        self.time_budget = time_budget
 
         self._setup(paths, plugins, project_configs)
 
@@ -103,11 +268,22 @@ def _setup(self, paths: Paths, plugins: DictObj, project_configs: DictObj) -> No
             self.error = 'no projects defined'
             return
 
+        depends_on = {}
         for project_name, project_settings in project_configs.items():
             name = project_settings.pop('name', '')
             if not name:
                 name = project_name
 
+            depends_on[project_name] = project_settings.pop('depends_on', [])
+            if isinstance(depends_on[project_name], str):
+                depends_on[project_name] = [depends_on[project_name]]
+            if not isinstance(depends_on[project_name], list):
+                raise ValueError(f"{project_name}: depends_on must be a project or a list of projects")
+
+            timeout = project_settings.pop('timeout', None)
+            if timeout is not None and not _positive_number(timeout):
+                raise ValueError(f"{project_name}: timeout must be a number of seconds greater than zero")
+
             subdir = project_settings.pop('backup_dir', '')
             if subdir:
                 new_paths = paths.copy()
@@ -115,18 +291,91 @@ def _setup(self, paths: Paths, plugins: DictObj, project_configs: DictObj) -> No
                 self.map[project_name] = Project(new_paths, name, plugins, project_settings)
             else:
                 self.map[project_name] = Project(paths, name, plugins, project_settings)
+            self.map[project_name].journal = self.journal
+            self.map[project_name].key = project_name
+            self.map[project_name].limits = self.limits
+            self.map[project_name].timeout = timeout
+
+        self._setup_depends_on(depends_on)
+        self.limits.warn_unused(tag for project in self.map.values() for stage in project.map.values()
+                                for tag in stage.settings.resources)
+
+    def _setup_depends_on(self, depends_on: Dict[str, list]) -> None:
+        """Resolves dependencies, given as project keys or project names, to project keys
+
+        Args:
+            depends_on: dependencies from project configurations, keyed by project key
+
+        Raises:
+            ValueError: a dependency is not a defined project, or dependencies form a cycle
+        """
+        names = {project.project: key for key, project in self.map.items()}
+        for key, dependencies in depends_on.items():
+            self.depends_on[key] = []
+            for dependency in dependencies:
+                found = dependency if dependency in self.map else names.get(dependency)
+                if found is None:
+                    raise ValueError(f"{key}: depends_on project not found: {dependency}")
+                self.depends_on[key].append(found)
+
+        check_dependencies(self.depends_on)
 
     def run(self) -> Tuple[bool, str, str]:
         """Run all defined projects
 
+        Notes:
+            Up to max_parallel_projects projects run at once, each starting once the
+            projects it depends on have finished. With a pipeline depth set, background
+            stages of a project run while the following projects run. The first failure,
+            or running out of time_budget, stops new projects from starting, and all running
+            stages are waited on before returning. With continue_on_failure set, a failure
+            only skips the projects depending on the failed project.
+
+            The result of every project is kept in status, keyed by project name.
+
         Returns:
             bool: operations completed successfully
             str: if operations failed, the error message explaining what failed
             str: if operations failed, the name of the project that failed
         """
-        for pos in sorted(list(self.map.keys())):
-            finished, error_msg, project = self.map[pos].run()
-            if not finished:
-                return finished, error_msg, project
+        pipeline = None
+        if self.pipeline_depth > 0 and any(project.background for project in self.map.values()):
+            pipeline = Pipeline(self.pipeline_depth, self.continue_on_failure)
+
+        expected = {key: self.history.expected(key) for key in self.map}
+        deadline = time.monotonic() + self.time_budget * 60 if self.time_budget else 0.0
+        scheduler = Scheduler(self.map, self.depends_on, self.max_parallel_projects, pipeline, expected, deadline,
+                              self.continue_on_failure)
+        try:
+            ret = scheduler.run()
+        except BaseException:
+            if pipeline is not None:
+                pipeline.close(True)
+            raise
+
+        if pipeline is not None:
+            background = pipeline.close(not ret[0])
+            if ret[0]:
+                ret = background
+
+        self.status = {self.map[key].project: scheduler.status[key] for key in sorted(scheduler.status)}
+        self._record_history()
 
-        return True, '', ''
+        return ret
+
+    def summary(self) -> str:
+        """Returns the status of every project, one project per line"""
+        return '\n'.join(f"{name}: {status}" for name, status in self.status.items())
+
+    def _record_history(self) -> None:
+        """Records stage durations of projects that completed, flagging projects that regressed"""
+        for key in sorted(self.map.keys()):
+            durations = {stage_name: stage.state.duration for stage_name, stage in self.map[key].map.items()}
+            if durations and all(duration is not None for duration in durations.values()):
+                if self.history.record(key, durations):
+                    self.regressions.append(self.map[key].project)
+
+        try:
+            self.history.save()
+        except OSError as exception_object:
+            LOGGER.warning("history: cannot save %s: %s", self.history.path, exception_object)
@@ -0,0 +1,542 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Dependency Aware Project Scheduling"""
+
+import concurrent.futures
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional, Tuple)
+
+LOGGER = logging.getLogger(__name__)
+
+Done = Callable[[bool, str], None]
+"""Done is called with the result of a project once every stage of it has finished"""
+
+RunStage = Callable[[], Tuple[bool, str]]
+"""RunStage runs one stage of a project and returns its result"""
+
+
+def normalize_tag(tag: str) -> str:
+    """Returns a resource tag with the path of a disk: tag normalized, so /backups/ is /backups"""
+    if tag.startswith('disk:'):
+        return f"disk:{os.path.normpath(tag[len('disk:'):])}"
+
+    return tag
+
+
+class ResourceLimits:
+    """Limits how many stages use a resource at once
+
+    Each stage carries resource tags, such as cpu, disk:/backups or net:offsite. A stage
+    only starts once it holds a slot of every limited resource it is tagged with. Slots
+    are taken in sorted tag order, so stages waiting on several resources cannot deadlock.
+    Resources without a limit are not limited. Paths of disk: tags are compared
+    normalized, on both the limits and the tags of stages.
+
+    Args:
+        limits: maximum number of stages using each resource at once, keyed by resource tag
+
+    Raises:
+        ValueError: a limit is not an integer greater than zero, or a resource is limited twice
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None) -> None:
+        if not isinstance(limits or {}, dict):
+            raise ValueError('resource_limits must be a dictionary of resource tags and limits')
+
+        self.limits: Dict[str, int] = {}
+        for tag, limit in (limits or {}).items():
+            if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+                raise ValueError(f"resource_limits: {tag} must be an integer greater than zero")
+            if normalize_tag(tag) in self.limits:
+                raise ValueError(f"resource_limits: {tag} is limited more than once")
+            self.limits[normalize_tag(tag)] = limit
+
+        self._slots = {tag: threading.BoundedSemaphore(limit) for tag, limit in self.limits.items()}
+
+    @contextlib.contextmanager
+    def hold(self, tags: List[str]) -> Iterator[None]:
+        """Holds a slot of every limited resource in tags, waiting for slots to be free
+
+        Args:
+            tags: resource tags of a stage
+        """
+        held = []
+        try:
+            for tag in sorted({normalize_tag(tag) for tag in tags}):
+                if tag in self._slots:
+                    if not self._slots[tag].acquire(blocking=False):
+                        LOGGER.debug("waiting for resource: %s", tag)
+                        self._slots[tag].acquire()
+                    held.append(tag)
+            yield
+        finally:
+            for tag in reversed(held):
+                self._slots[tag].release()
+
+    def warn_unused(self, tags: Iterable[str]) -> None:
+        """Logs a warning for each limited resource no stage is tagged with
+
+        Args:
+            tags: resource tags of every stage
+        """
+        used = {normalize_tag(tag) for tag in tags}
+        for tag in sorted(set(self.limits) - used):
+            LOGGER.warning("resource_limits: no stage uses %s, its limit has no effect", tag)
+
+    @staticmethod
+    def _retry_delay(stage, attempt: int) -> Optional[float]:
+        """Returns how long to wait before retrying a failed stage
+
+        Args:
+            stage: plugin object that failed
+            attempt: number of retries already run
+
+        Returns:
+            seconds to wait, or None if the stage is not retried
+        """
+        settings, state = stage.settings, stage.state
+        if attempt >= settings.retries or (settings.retry_on and state.returncode not in settings.retry_on):
+            return None
+
+        delay = settings.retry_delay * 2 ** attempt
+        if state.project_deadline and time.monotonic() + delay >= state.project_deadline:
+            return None
+
+        return delay
+
+    def _run_once(self, stage) -> Tuple[bool, str]:
+        """Runs a stage once while holding the resources it is tagged with
+
+        Args:
+            stage: plugin object to run
+
+        Returns:
+            bool: operations completed successfully
+            str: if operations failed, the error message explaining what failed
+        """
+        state = stage.state
+        with self.hold(stage.settings.resources):
+            stage.start()
+            if state.deadline and state.deadline <= state.started:
+                return False, 'Timed out before starting: project timeout used'
+            finished, error_msg = stage.run()
+            if finished:
+                state.duration = time.monotonic() - state.started
+                if state.deadline and time.monotonic() > state.deadline:
+                    LOGGER.warning("%s: ran past its timeout, %.1f seconds", stage.project, state.duration)
+
+        return finished, error_msg
+
+    def run(self, stage) -> Tuple[bool, str]:
+        """Runs a stage while holding the resources it is tagged with, retrying it if it fails
+
+        Notes:
+            The stage timeout starts once the resources are held. A stage whose project
+            timed out while it waited is not run. Commands are stopped by the timeout, python
+            code of a plugin is not, so a stage running over it without commands only logs it.
+
+            A failed stage is run again up to settings.retries times, only when its failed
+            command exited with a status in settings.retry_on if that is set, and not when the
+            wait would run past the project timeout. Resources are released while waiting.
+            Only the failed stage is run again, the work of earlier stages is kept.
+
+            When the stage completes successfully, the seconds its last run took, not counting
+            time spent waiting for resources, are stored in state.duration.
+
+        Args:
+            stage: plugin object to run
+
+        Returns:
+            bool: operations completed successfully
+            str: if operations failed, the error message explaining what failed
+        """
+        attempt = 0
+        while True:
+            finished, error_msg = self._run_once(stage)
+            delay = None if finished else self._retry_delay(stage, attempt)
+            if delay is None:
+                return finished, error_msg
+
+            attempt += 1
+            LOGGER.warning("%s: %s, retry %d of %d in %.0f seconds", stage.project, error_msg, attempt,
+                           stage.settings.retries, delay)
+            time.sleep(delay)
+
+
+class Pipeline:
+    """Runs the background stages of projects on a worker thread
+
+    Background stages of each project are queued as one unit and run in order, and
+    projects are run in the order they are queued, so stage order within a project is
+    kept. Queueing blocks while depth projects are already waiting, which bounds how
+    far copying can run ahead of the background stages.
+
+    After a stage fails, unless continue_on_failure is set, or after cancel, the stages of
+    queued projects are skipped.
+
+    Args:
+        depth: number of projects whose background stages may wait to run
+        continue_on_failure: keep running the stages of queued projects after a stage fails
+    """
+
+    def __init__(self, depth: int, continue_on_failure: bool = False) -> None:
+        self.continue_on_failure = continue_on_failure
+        self.error = ('', '')
+
+        self._cancelled = threading.Event()
+        self._failed = threading.Event()
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._work, name='pipeline', daemon=True)
+        self._thread.start()
+
+    @property
+    def failed(self) -> bool:
+        """True once a background stage has failed"""
+        return self._failed.is_set()
+
+    def _run_stages(self, project: str, stages: List[RunStage]) -> Tuple[bool, str]:
+        """Runs the background stages of a project, recording the first failure
+
+        Args:
+            project: name of the project
+            stages: callables running each stage, in order
+
+        Returns:
+            bool: stages completed successfully
+            str: if a stage failed, the error message explaining what failed
+        """
+        LOGGER.info("Project: %s (background)", project)
+        for stage in stages:
+            try:
+                finished, error_msg = stage()
+            except Exception as exception_object:  # pylint: disable=broad-exception-caught
+                finished, error_msg = False, str(exception_object)
+            if not finished:
+                self.error = (error_msg, project)
+                self._failed.set()
+                return finished, error_msg
+
+        return True, ''
+
+    def _work(self) -> None:
+        """Runs queued projects until close queues the end marker"""
+        while True:
+            queued = self._queue.get()
+            if queued is None:
+                return
+            project, stages, done = queued
+            if (self._failed.is_set() and not self.continue_on_failure) or self._cancelled.is_set():
+                LOGGER.info("Project: %s (background): skipped", project)
+                finished, error_msg = False, 'skipped after an earlier failure'
+            else:
+                finished, error_msg = self._run_stages(project, stages)
+            if done is not None:
+                done(finished, error_msg)
+
+    def cancel(self) -> None:
+        """Skips background stages of projects that have not started yet"""
+        self._cancelled.set()
+
+    def close(self, cancel: bool = False) -> Tuple[bool, str, str]:
+        """Waits for queued background stages to finish
+
+        Args:
+            cancel: skip background stages of projects that have not started yet
+
+        Returns:
+            bool: background stages completed successfully
+            str: if background stages failed, the error message explaining what failed
+            str: if background stages failed, the name of the project that failed
+        """
+        if cancel:
+            self.cancel()
+        self._queue.put(None)
+        self._thread.join()
+
+        if self.failed:
+            return False, self.error[0], self.error[1]
+
+        return True, '', ''
+
+    def submit(self, project: str, stages: List[RunStage], done: Optional[Done] = None) -> None:
+        """Queues the background stages of a project, blocking while the queue is full
+
+        Args:
+            project: name of the project
+            stages: callables running each stage, in order
+            done: if set, called with the result once the stages have run or were skipped
+        """
+        self._queue.put((project, stages, done))
+
+
+# a _Run only carries the state of one Scheduler.run between its helpers
+# pylint: disable=too-few-public-methods
+class _Run:
+    """State of one run of a Scheduler
+
+    Args:
+        waiting: keys of the projects each project not yet started waits on, keyed by project key
+    """
+
+    def __init__(self, waiting: Dict[str, set]) -> None:
+        self.events: queue.Queue = queue.Queue()
+        self.finished: set = set()
+        self.waiting = waiting
+
+
+# a Scheduler is configured once and run once, its results are read from status afterwards
+# pylint: disable=too-many-instance-attributes,too-few-public-methods
+class Scheduler:
+    """Runs projects concurrently, starting each project once the projects it depends on have finished
+
+    Ready projects are started longest critical path first: the expected duration of the
+    project plus the longest chain of expected durations of projects depending on it. This
+    is longest processing time first scheduling, extended to dependencies, which shortens
+    the total run time when a few projects take much longer than the rest. Projects with
+    equal priority, such as every project when there is no history, are started in sorted
+    key order, so with max_parallel set to 1 and no dependencies projects run in the same
+    order as they always have. A project has finished once all of its stages have,
+    including stages queued on the pipeline.
+
+    After the first failure, or once deadline has passed, no new project is started, and
+    every running project is waited on before run returns. With continue_on_failure set, a
+    failure only skips the projects depending on the failed project, and projects that do
+    not depend on it keep being started.
+
+    The result of every project is kept in status, keyed by project key.
+
+    Args:
+        projects: projects keyed by project key, each with a project name and run(pipeline, done)
+        depends_on: keys of the projects each project depends on, keyed by project key
+        max_parallel: number of projects running their foreground stages at once
+        pipeline: pipeline background stages are queued on, None runs every stage in the project
+        expected: expected duration in seconds of each project, keyed by project key
+        deadline: time.monotonic() after which no new project is started, 0 does not limit it
+        continue_on_failure: keep starting projects that do not depend on a failed project
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, projects: dict, depends_on: Dict[str, List[str]], max_parallel: int,
+                 pipeline: Optional[Pipeline] = None, expected: Optional[Dict[str, float]] = None,
+                 deadline: float = 0.0, continue_on_failure: bool = False) -> None:
+        check_dependencies(depends_on)
+
+        self.continue_on_failure = continue_on_failure
+        self.deadline = deadline
+        self.depends_on = depends_on
+        self.max_parallel = max_parallel
+        self.pipeline = pipeline
+        self.priorities = critical_paths(list(projects), depends_on, expected or {})
+        self.projects = projects
+        self.status: Dict[str, str] = {}
+
+        self._run = _Run({})
+
+    def _run_project(self, key: str) -> None:
+        """Runs a project in a worker thread, reporting its result and the release of its worker
+
+        Args:
+            key: key of the project to run
+        """
+        def done(finished: bool, error_msg: str) -> None:
+            self._run.events.put((key, finished, error_msg))
+
+        try:
+            self.projects[key].run(self.pipeline, done)
+        except Exception as exception_object:  # pylint: disable=broad-exception-caught
+            done(False, str(exception_object))
+        finally:
+            self._run.events.put((key, None, ''))
+
+    def _ready(self) -> List[str]:
+        """Returns keys of waiting projects whose dependencies have all finished, highest priority first
+
+        Returns:
+            list of project keys ready to start
+        """
+        ready = [key for key in sorted(self._run.waiting) if self._run.waiting[key] <= self._run.finished]
+
+        return sorted(ready, key=lambda key: -self.priorities.get(key, 0))
+
+    def _finish(self, key: str, finished: bool, error_msg: str, ret: Tuple[bool, str, str]) -> Tuple[bool, str, str]:
+        """Records the result of a project
+
+        Args:
+            key: key of the project
+            finished: the project completed successfully
+            error_msg: if the project failed, the error message explaining what failed
+            ret: result of the run so far
+
+        Returns:
+            result of the run, the failure of this project if it is the first to fail and
+            continue_on_failure is not set
+        """
+        if finished:
+            self.status[key] = 'completed'
+            self._run.finished.add(key)
+            return ret
+
+        self.status[key] = f"failed: {error_msg}"
+        if self.continue_on_failure:
+            self._skip_dependents()
+            return ret
+        if ret[0] and self.pipeline is not None:
+            self.pipeline.cancel()
+
+        return (False, error_msg, self.projects[key].project) if ret[0] else ret
+
+    def _out_of_time(self) -> Tuple[bool, str, str]:
+        """Stops projects that have not started from starting once the deadline has passed
+
+        Returns:
+            bool: False
+            str: error message listing the projects that were not started
+            str: empty, as no project failed
+        """
+        names = ', '.join(self.projects[key].project for key in sorted(self._run.waiting))
+        LOGGER.error("time budget used, not starting: %s", names)
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+
+        return False, f"time budget used, not started: {names}", ''
+
+    def _result(self, ret: Tuple[bool, str, str]) -> Tuple[bool, str, str]:
+        """Records projects that were not started and returns the result of the run
+
+        Args:
+            ret: result of the run so far
+
+        Returns:
+            ret, or with continue_on_failure set, a failure counting the projects that did not complete
+        """
+        for key in self._run.waiting:
+            self.status[key] = 'not started'
+
+        failed = sorted(key for key, status in self.status.items() if status != 'completed')
+        if ret[0] and failed:
+            return False, f"{len(failed)} of {len(self.projects)} projects did not complete", ''
+
+        return ret
+
+    def _skip_dependents(self) -> None:
+        """Skips waiting projects that depend, directly or through other projects, on a project that did not complete"""
+        skipped = True
+        while skipped:
+            skipped = False
+            for key in sorted(self._run.waiting):
+                failed = sorted(dependency for dependency in self._run.waiting[key]
+                                if dependency in self.status and self.status[dependency] != 'completed')
+                if failed:
+                    del self._run.waiting[key]
+                    self.status[key] = f"skipped: depends on {self.projects[failed[0]].project}"
+                    LOGGER.info("Project: %s: %s", self.projects[key].project, self.status[key])
+                    skipped = True
+
+    def run(self) -> Tuple[bool, str, str]:
+        """Runs all projects
+
+        Returns:
+            bool: operations completed successfully
+            str: if operations failed, the error message explaining what failed
+            str: if operations failed, the name of the project that failed, empty when
+                 several projects did not complete
+        """
+        self._run = _Run({key: set(self.depends_on.get(key, [])) for key in self.projects})
+        running = 0
+        outstanding = 0
+        ret = (True, '', '')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel,
+                                                   thread_name_prefix='project') as pool:
+            while True:
+                if ret[0] and self._run.waiting and self.deadline and time.monotonic() >= self.deadline:
+                    ret = self._out_of_time()
+                if ret[0]:
+                    for key in self._ready()[:self.max_parallel - running]:
+                        del self._run.waiting[key]
+                        running += 1
+                        outstanding += 1
+                        pool.submit(self._run_project, key)
+
+                if not outstanding and not running:
+                    break
+
+                key, result, error_msg = self._run.events.get()
+                if result is None:
+                    running -= 1
+                    continue
+
+                outstanding -= 1
+                ret = self._finish(key, result, error_msg, ret)
+
+        return self._result(ret)
+
+
+def critical_paths(keys: List[str], depends_on: Dict[str, List[str]],
+                   expected: Dict[str, float]) -> Dict[str, float]:
+    """Returns the critical path length of each project
+
+    Args:
+        keys: keys of all projects
+        depends_on: keys of the projects each project depends on, keyed by project key
+        expected: expected duration in seconds of each project, keyed by project key
+
+    Returns:
+        expected duration of each project plus the longest chain of expected durations of
+        the projects depending on it, keyed by project key
+    """
+    dependents: Dict[str, List[str]] = {key: [] for key in keys}
+    for key, dependencies in depends_on.items():
+        for dependency in dependencies:
+            dependents.setdefault(dependency, []).append(key)
+
+    paths: Dict[str, float] = {}
+    for start in keys:
+        stack = [start]
+        while stack:
+            key = stack[-1]
+            pending = [dependent for dependent in dependents.get(key, []) if dependent not in paths]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            longest = max((paths[dependent] for dependent in dependents.get(key, [])), default=0)
+            paths[key] = expected.get(key, 0) + longest
+
+    return paths
+
+
+def check_dependencies(depends_on: Dict[str, List[str]]) -> None:
+    """Checks that project dependencies do not form a cycle
+
+    Args:
+        depends_on: keys of the projects each project depends on, keyed by project key
+
+    Raises:
+        ValueError: dependencies form a cycle
+    """
+    visited = set()
+    for start in sorted(depends_on):
+        if start in visited:
+            continue
+        path = [start]
+        stack = [iter(sorted(depends_on.get(start, [])))]
+        while stack:
+            dependency = next(stack[-1], None)
+            if dependency is None:
+                visited.add(path.pop())
+                stack.pop()
+                continue
+            if dependency in path:
+                cycle = path[path.index(dependency):] + [dependency]
+                raise ValueError(f"depends_on cycle: {' -> '.join(cycle)}")
+            if dependency not in visited:
+                path.append(dependency)
+                stack.append(iter(sorted(depends_on.get(dependency, []))))
@@ -0,0 +1,261 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Source Tree Sharding"""
+
+import concurrent.futures
+import heapq
+import json
+import logging
+import os
+import time
+
+from typing import (Dict, List, Optional, Tuple)
+
+from eljef.backup.sync import Excludes
+
+LOGGER = logging.getLogger(__name__)
+
+SHARD_CACHE = '.shards.json'
+"""SHARD_CACHE is the default name of the shard cache file in the backups path"""
+
+SHARD_DEPTH = 4
+"""SHARD_DEPTH is how many directory levels below a source entry counts are cached for, and shards are split to"""
+
+SHARD_MAX_ENTRIES = 10000
+"""SHARD_MAX_ENTRIES is the most entries a source is split into"""
+
+SHARD_REFRESH_DAYS = 7
+"""SHARD_REFRESH_DAYS is how many days cached entry counts are used for before a source is counted again"""
+
+
+def _depth(rel: str) -> int:
+    """Returns the number of path components of a relative path, 0 for the source itself"""
+    return rel.count('/') + 1 if rel else 0
+
+
+def _join(rel: str, name: str) -> str:
+    """Joins a name to a relative path, the source itself being the empty path"""
+    return f"{rel}/{name}" if rel else name
+
+
+def count_entries(source: str, rel: str, excludes: Optional[Excludes] = None) -> Dict[str, int]:
+    """Counts the entries below a directory of a source
+
+    Every file, directory and link counts as one entry, as walking the tree costs about
+    the same for each. Symbolic links to directories are not followed, as rsync -a copies
+    them as links. Directories that cannot be read are counted as empty. Excluded entries
+    are not counted, as rsync does not copy them.
+
+    Args:
+        source: full path to the source
+        rel: path of the directory relative to source
+        excludes: exclude patterns the source is copied with
+
+    Returns:
+        number of entries below rel and below each directory under it down to SHARD_DEPTH
+        levels below the source, keyed by relative path
+    """
+    counts = {rel: 0}
+    stack = [rel]
+    while stack:
+        current = stack.pop()
+        parts = current.split('/')
+        recorded = [rel] + ['/'.join(parts[:pos]) for pos in range(_depth(rel) + 1, min(len(parts), SHARD_DEPTH) + 1)]
+        try:
+            with os.scandir(os.path.join(source, current)) as entries:
+                children = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in entries]
+        except OSError:
+            continue
+        for name, is_dir in children:
+            child = _join(current, name)
+            if excludes is not None and excludes.match(child, is_dir):
+                continue
+            for ancestor in recorded:
+                counts[ancestor] += 1
+            if is_dir:
+                if _depth(child) <= SHARD_DEPTH:
+                    counts.setdefault(child, 0)
+                stack.append(child)
+
+    return counts
+
+
+class ShardCache:
+    """Caches entry counts of sources between runs
+
+    Counting the entries of a large tree costs about as much as walking it with rsync, so
+    counts are kept for SHARD_REFRESH_DAYS days before a source is counted again. Entries
+    are always listed fresh when planning, so the cache only affects how balanced shards
+    are, never what is copied.
+
+    Args:
+        path: full path to the cache file, an empty path keeps no cache
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.sources: Dict[str, dict] = {}
+
+        self._load()
+
+    def _load(self) -> None:
+        """Loads the cache file, starting an empty cache if it does not exist or cannot be read"""
+        if not self.path:
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as cache:
+                self.sources = json.load(cache).get('sources', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as exception_object:
+            LOGGER.warning("shards: starting a new cache, cannot read %s: %s", self.path, exception_object)
+            self.sources = {}
+
+    def counts(self, source: str, excludes: Optional[List[str]] = None) -> Dict[str, int]:
+        """Returns the cached counts of a source, starting them over once they are too old
+
+        Args:
+            source: full path to the source
+            excludes: exclude patterns the source is copied with, counts taken with other
+                      patterns are started over
+
+        Returns:
+            cached entry counts keyed by relative path, updated in place by the caller
+        """
+        excludes = list(excludes or [])
+        cached = self.sources.get(source)
+        if not isinstance(cached, dict) or time.time() - cached.get('time', 0) > SHARD_REFRESH_DAYS * 86400 or \
+                cached.get('excludes', []) != excludes:
+            cached = {'time': time.time(), 'counts': {}, 'excludes': excludes}
+            self.sources[source] = cached
+
+        return cached['counts']
+
+    def save(self) -> None:
+        """Atomically writes the cache file"""
+        if not self.path:
+            return
+
+        partial = f"{self.path}.part"
+        with open(partial, 'w', encoding='utf-8') as cache:
+            json.dump({'sources': self.sources}, cache, sort_keys=True)
+        os.replace(partial, self.path)
+
+
+def _list(source: str, rel: str, excludes: Optional[Excludes]) -> List[Tuple[str, bool]]:
+    """Lists a directory of a source
+
+    Args:
+        source: full path to the source
+        rel: path of the directory relative to source
+        excludes: exclude patterns the source is copied with
+
+    Returns:
+        sorted list of relative paths of the entries in rel that are not excluded, and
+        whether each is a directory
+    """
+    with os.scandir(os.path.join(source, rel)) as entries:
+        listed = [(_join(rel, entry.name), entry.is_dir(follow_symlinks=False)) for entry in entries]
+
+    return sorted(item for item in listed if excludes is None or not excludes.match(*item))
+
+
+def _weigh(source: str, items: List[Tuple[str, bool]], counts: Dict[str, int], workers: int,
+           excludes: Optional[Excludes]) -> Dict[str, int]:
+    """Returns the estimated cost of copying each entry, counting directories missing from counts
+
+    Args:
+        source: full path to the source
+        items: relative paths of entries and whether each is a directory
+        counts: cached entry counts, updated with the directories counted
+        workers: number of directories counted at once
+        excludes: exclude patterns the source is copied with
+
+    Returns:
+        entry count of each entry plus one for the entry itself, keyed by relative path
+    """
+    missing = [rel for rel, is_dir in items if is_dir and rel not in counts]
+    if missing:
+        LOGGER.debug("shards: counting %d directories of %s", len(missing), source)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for counted in pool.map(lambda rel: count_entries(source, rel, excludes), missing):
+                counts.update(counted)
+
+    return {rel: counts.get(rel, 0) + 1 if is_dir else 1 for rel, is_dir in items}
+
+
+def _split(source: str, shards: int, counts: Dict[str, int], workers: int,
+           excludes: Optional[Excludes]) -> Tuple[List[Tuple[int, str, bool]], List[str]]:
+    """Replaces the largest directory of a source by its own entries while it holds more than a shard's share
+
+    Args:
+        source: full path to the source directory
+        shards: number of shards to split the source into
+        counts: cached entry counts of the source, updated with the directories counted
+        workers: number of directories counted at once
+        excludes: exclude patterns the source is copied with
+
+    Returns:
+        List[Tuple[int, str, bool]]: heap of the negated weight, relative path and directory flag of each entry
+        List[str]: the source itself, as '.', and the directories that were split, parents first
+    """
+    items = _list(source, '', excludes)
+    weights = _weigh(source, items, counts, workers, excludes)
+    target = sum(weights.values()) / max(1, shards)
+    split = ['.']
+
+    heap = [(-weights[rel], rel, is_dir) for rel, is_dir in items]
+    heapq.heapify(heap)
+    while heap and len(heap) < SHARD_MAX_ENTRIES:
+        weight, rel, is_dir = heap[0]
+        if -weight <= target or not is_dir or _depth(rel) >= SHARD_DEPTH:
+            break
+        heapq.heappop(heap)
+        split.append(rel)
+        children = _list(source, rel, excludes)
+        weights.update(_weigh(source, children, counts, workers, excludes))
+        for child in children:
+            heapq.heappush(heap, (-weights[child[0]], *child))
+
+    return heap, split
+
+
+def plan_shards(source: str, shards: int, counts: Dict[str, int], workers: int = 1,
+                excludes: Optional[Excludes] = None) -> Tuple[List[List[str]], List[str]]:
+    """Splits a source into shards of about the same number of entries
+
+    The entries of the source are listed, and the largest directory is replaced by its own
+    entries while it holds more than a shard's share, down to SHARD_DEPTH levels. Entries
+    are then assigned largest first to the shard with the fewest entries so far.
+
+    Copying every shard with rsync -r --files-from copies every entry of the source exactly
+    once. The directories that were split are not in any shard: they are created by rsync
+    as implied directories, so copying them without recursion after the shards sets their
+    attributes as a single rsync -a would.
+
+    Excluded entries are left out of every shard and never split, as rsync copies entries
+    named in a --files-from list even below a directory excluded by a pattern like cache/.
+
+    Args:
+        source: full path to the source directory
+        shards: number of shards to split the source into
+        counts: cached entry counts of the source, updated with the directories counted
+        workers: number of directories counted at once
+        excludes: exclude patterns the source is copied with
+
+    Returns:
+        List[List[str]]: sorted relative paths in each shard, without empty shards
+        List[str]: the source itself, as '.', and the directories that were split, parents first
+    """
+    heap, split = _split(source, shards, counts, workers, excludes)
+
+    loads = [(0, pos) for pos in range(max(1, shards))]
+    planned: List[List[str]] = [[] for _ in loads]
+    for weight, rel, _ in sorted(heap):
+        load, pos = heapq.heappop(loads)
+        planned[pos].append(rel)
+        heapq.heappush(loads, (load - weight, pos))
+
+    return [sorted(shard) for shard in planned if shard], split
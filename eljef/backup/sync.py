@@ -0,0 +1,555 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+
+"""Native Tree Sync"""
+
+import concurrent.futures
+import contextlib
+import errno
+import itertools
+import logging
+import os
+import re
+import stat
+import time
+
+from typing import (Callable, Dict, List, Optional, Tuple)
+
+from eljef.backup.file_index import FileIndex
+
+LOGGER = logging.getLogger(__name__)
+
+COPY_CHUNK = 8 * 1024 * 1024
+"""COPY_CHUNK is the most bytes copied by one copy_file_range, sendfile or read call"""
+
+ERRORS_KEPT = 20
+"""ERRORS_KEPT is how many error messages a sync keeps for its failure message"""
+
+INDEX_RACY_NS = 2 * 1000 * 1000 * 1000
+"""INDEX_RACY_NS is how close to the start of a copy a directory may have been changed and still be indexed, as
+coarse modification times may not change again for entries added in the same seconds"""
+
+PENDING_PER_WORKER = 64
+"""PENDING_PER_WORKER is how many entries per worker are queued before the walk waits for copies to finish"""
+
+SMALL_FILE = 1024 * 1024
+"""SMALL_FILE is the size below which files are copied by the worker threads instead of the large file thread"""
+
+SYNC_WORKERS = 8
+"""SYNC_WORKERS is the default number of threads copying small files"""
+
+_FALLBACK_ERRNOS = {errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV}
+_TEMPORARY = itertools.count()
+
+
+def _copy_file_range(src: int, dst: int, offset: int) -> int:
+    """Copies up to COPY_CHUNK bytes at offset in the kernel, sharing extents where the filesystem can"""
+    return os.copy_file_range(src, dst, COPY_CHUNK, offset)
+
+
+def _sendfile(src: int, dst: int, offset: int) -> int:
+    """Copies up to COPY_CHUNK bytes at offset in the kernel"""
+    return os.sendfile(dst, src, offset, COPY_CHUNK)
+
+
+KERNEL_COPIES = [function for function, name in ((_copy_file_range, 'copy_file_range'), (_sendfile, 'sendfile'))
+                 if hasattr(os, name)]
+"""KERNEL_COPIES are the in kernel copy functions copy_data tries, in order"""
+
+
+def copy_data(src: int, dst: int, size: int) -> int:
+    """Copies the data of a file until the end of the file
+
+    copy_file_range is tried first, then sendfile, each falling back to the next when the
+    kernel or filesystem does not support it for the two files. If neither copies any
+    data of a file that is not empty, such as files in /proc, the data is read and written.
+
+    Args:
+        src: file descriptor to copy from, at any position
+        dst: file descriptor to copy to, at the position to write at
+        size: size of the file when it was listed
+
+    Returns:
+        number of bytes copied
+    """
+    copied = 0
+    for kernel_copy in KERNEL_COPIES:
+        copied, supported = _kernel_copy(kernel_copy, src, dst, copied)
+        if supported and (copied or not size):
+            return copied
+
+    return _read_write(src, dst, copied)
+
+
+def _kernel_copy(kernel_copy: Callable[[int, int, int], int], src: int, dst: int, copied: int) -> Tuple[int, bool]:
+    """Copies the data of a file from offset copied until the end of the file with an in kernel copy function
+
+    Returns:
+        int: number of bytes of the file copied so far
+        bool: the kernel and filesystem support kernel_copy for the two files
+    """
+    try:
+        while True:
+            count = kernel_copy(src, dst, copied)
+            if not count:
+                return copied, True
+            copied += count
+    except OSError as exception_object:
+        if exception_object.errno not in _FALLBACK_ERRNOS:
+            raise
+
+    return copied, False
+
+
+def _read_write(src: int, dst: int, copied: int) -> int:
+    """Copies the data of a file from offset copied until the end of the file by reading and writing it
+
+    Returns:
+        number of bytes of the file copied
+    """
+    while True:
+        data = memoryview(os.pread(src, COPY_CHUNK, copied))
+        if not data:
+            return copied
+        while data:
+            written = os.write(dst, data)
+            data = data[written:]
+            copied += written
+
+
+def _translate(pattern: str) -> str:
+    """Translates an rsync wildcard pattern to a regular expression
+
+    * matches anything but /, ** matches anything, ? matches one character but /, and
+    [...] matches a character class.
+
+    Args:
+        pattern: wildcard pattern
+
+    Returns:
+        regular expression matching what pattern matches
+    """
+    parts = []
+    pos = 0
+    while pos < len(pattern):
+        char = pattern[pos]
+        end = pattern.find(']', pos + 2) if char == '[' else -1
+        if pattern.startswith('**', pos):
+            parts.append('.*')
+            pos += 1
+        elif char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif end > 0:
+            body = pattern[pos + 1:end].replace('\\', '\\\\')
+            parts.append(f"[^{body[1:]}]" if body[0] == '!' else f"[{body}]")
+            pos = end
+        else:
+            parts.append(re.escape(char))
+        pos += 1
+
+    return ''.join(parts)
+
+
+# an Excludes is built once per source, and matched against every entry copied
+# pylint: disable=too-few-public-methods
+class Excludes:
+    """Matches paths against rsync --exclude patterns
+
+    A pattern without / matches the name of an entry at any depth. A pattern with / or
+    ** matches the end of the path of an entry relative to the source, or the whole path
+    if it starts with /. A pattern ending in / only matches directories.
+
+    Args:
+        patterns: exclude patterns
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        self.patterns = list(patterns)
+        self.rules: List[Tuple[re.Pattern, bool, bool]] = []
+        for pattern in patterns:
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            whole_path = '/' in pattern or '**' in pattern
+            prefix = '^' if pattern.startswith('/') or not whole_path else '(?:^|/)'
+            self.rules.append((re.compile(f"{prefix}{_translate(pattern.lstrip('/'))}$"), dir_only, whole_path))
+
+    def match(self, rel: str, is_dir: bool) -> bool:
+        """Returns True if an entry is excluded
+
+        Args:
+            rel: path of the entry relative to the source
+            is_dir: the entry is a directory
+        """
+        name = rel.rsplit('/', 1)[-1]
+        for regex, dir_only, whole_path in self.rules:
+            if (is_dir or not dir_only) and regex.search(rel if whole_path else name):
+                return True
+
+        return False
+
+
+def _hard_link(previous: str, dst: str) -> bool:
+    """Hard links dst to previous, returning False if the filesystem cannot link it"""
+    temporary = _temporary(dst)
+    try:
+        os.link(previous, temporary)
+    except OSError as exception_object:
+        if exception_object.errno in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+            return False
+        raise
+    os.replace(temporary, dst)
+
+    return True
+
+
+def _temporary(dst: str) -> str:
+    """Returns a unique temporary path in the directory of dst, to be renamed over it"""
+    return os.path.join(os.path.dirname(dst), f".sync.{os.getpid()}.{next(_TEMPORARY)}")
+
+
+# a TreeSync is run once, and its results are read from its counters afterwards
+# pylint: disable=too-many-instance-attributes,too-few-public-methods
+class TreeSync:
+    """Copies a directory in process, as rsync -a copying its contents into a directory would
+
+    The source is walked with os.scandir. Files already at the destination with the same
+    size and modification time are not copied again, only their mode and owner are set
+    if those changed, unless the copy is linked to another file, which is then copied
+    again so the other file is left as it is. With link_dest, files unchanged
+    from the copy in link_dest, including their mode and owner, are hard linked to it.
+    Every other file is copied with copy_data to a temporary file that is renamed into
+    place, so a file linked to another backup is never written to.
+
+    With an index, directories with the inode and modification time they had when
+    link_dest was copied have the same entries, so they are listed from link_dest instead
+    of being read in source. Each of their files is still looked up in source and
+    compared with its copy in link_dest, by the worker threads, so files written in
+    place are copied. On network filesystems, this saves reading large directories, and
+    files are looked up workers at a time instead of one at a time by the walk.
+
+    Files smaller than SMALL_FILE are copied by workers threads, larger files one at a
+    time by a thread of their own, as copying several large files at once only makes a
+    disk seek between them. Modes, modification times and, when running as root, owners
+    are preserved. Directory attributes are set once everything in them is copied.
+
+    Args:
+        source: full path to the directory to copy the contents of, or to a file to copy
+        dest: full path to the directory to copy into
+        excludes: rsync --exclude patterns
+        link_dest: full path to a previous copy of source, an empty path links nothing
+        workers: number of threads copying small files
+        deadline: time.monotonic() after which copying stops, 0 does not limit it
+        index: index of the directories of source when link_dest was copied, updated once
+               source is copied
+
+    Attributes:
+        copied: number of entries copied
+        copied_bytes: number of bytes copied
+        errors: the first ERRORS_KEPT error messages
+        failed: number of entries that could not be copied
+        linked: number of files hard linked to link_dest
+        listed_previous: number of directories listed from link_dest instead of source
+        skipped: number of devices skipped when not running as root, or entries skipped after timing out
+        unchanged: number of files left as they were at the destination
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, source: str, dest: str, excludes: Optional[List[str]] = None, link_dest: str = '',
+                 workers: int = SYNC_WORKERS, deadline: float = 0.0, index: Optional[FileIndex] = None) -> None:
+        self.source = source
+        self.dest = dest
+        self.excludes = Excludes(excludes or [])
+        self.index = index
+        self.link_dest = link_dest
+        self.workers = max(1, workers)
+        self.deadline = deadline
+
+        self.copied = 0
+        self.copied_bytes = 0
+        self.errors: List[str] = []
+        self.failed = 0
+        self.linked = 0
+        self.listed_previous = 0
+        self.skipped = 0
+        self.unchanged = 0
+
+        self._dirs: List[Tuple[str, os.stat_result]] = []
+        self._groups = set(os.getgroups()) | {os.getegid()}
+        self._indexed: Dict[str, Tuple[int, int]] = {}
+        self._listed: List[Tuple[str, int, int]] = []
+        self._owner = os.geteuid() == 0
+        self._pending: Dict[concurrent.futures.Future, str] = {}
+        self._started_ns = 0
+        self._stopped = False
+
+    def _error(self, rel: str, msg: str) -> None:
+        """Records an entry that could not be copied"""
+        LOGGER.warning("sync: %s: %s", os.path.join(self.source, rel), msg)
+        self.failed += 1
+        if len(self.errors) < ERRORS_KEPT:
+            self.errors.append(f"{rel or '.'}: {msg}")
+
+    def _out_of_time(self) -> bool:
+        """Returns True, stopping the sync, once the deadline has passed"""
+        if self.deadline and not self._stopped and time.monotonic() > self.deadline:
+            self._stopped = True
+            self._error('', 'timed out')
+
+        return self._stopped
+
+    def _set_attributes(self, target, stat_result: os.stat_result, follow_symlinks: bool = True) -> None:
+        """Sets the owner, mode and times of a copy
+
+        Args:
+            target: path or file descriptor of the copy
+            stat_result: lstat result of the original
+            follow_symlinks: False if target is a symbolic link
+        """
+        if self._owner:
+            os.chown(target, stat_result.st_uid, stat_result.st_gid, follow_symlinks=follow_symlinks)
+        elif stat_result.st_gid in self._groups:
+            os.chown(target, -1, stat_result.st_gid, follow_symlinks=follow_symlinks)
+        if follow_symlinks:
+            os.chmod(target, stat.S_IMODE(stat_result.st_mode))
+        os.utime(target, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns), follow_symlinks=follow_symlinks)
+
+    def _copy_file(self, src: str, dst: str, stat_result: os.stat_result) -> int:
+        """Copies a regular file, returning the number of bytes copied"""
+        temporary = _temporary(dst)
+        src_fd = os.open(src, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            dst_fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                copied = copy_data(src_fd, dst_fd, stat_result.st_size)
+                self._set_attributes(dst_fd, stat_result)
+            finally:
+                os.close(dst_fd)
+            os.replace(temporary, dst)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+            raise
+        finally:
+            os.close(src_fd)
+
+        return copied
+
+    def _link(self, rel: str, dst: str, stat_result: os.stat_result) -> bool:
+        """Hard links a file to its copy in link_dest if it is unchanged, returning True if it was linked"""
+        try:
+            previous = os.lstat(os.path.join(self.link_dest, rel))
+        except OSError:
+            return False
+        if (previous.st_size, previous.st_mtime_ns, previous.st_mode) != \
+                (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_mode) or \
+                (self._owner and (previous.st_uid, previous.st_gid) != (stat_result.st_uid, stat_result.st_gid)):
+            return False
+
+        return _hard_link(os.path.join(self.link_dest, rel), dst)
+
+    def _sync_listed(self, rel: str) -> Tuple[str, int]:
+        """Copies an entry of a directory listed from link_dest, looking it up in source first
+
+        Args:
+            rel: path of the entry relative to the source
+
+        Returns:
+            str: what was done, copied, linked, skipped or unchanged
+            int: number of bytes copied
+        """
+        if self._stopped:
+            return 'skipped', 0
+
+        return self._sync_entry(rel, os.lstat(os.path.join(self.source, rel)))
+
+    def _copy_other(self, src: str, dst: str, stat_result: os.stat_result) -> None:
+        """Copies a symbolic link, fifo, socket or, when running as root, device"""
+        temporary = _temporary(dst)
+        if stat.S_ISLNK(stat_result.st_mode):
+            os.symlink(os.readlink(src), temporary)
+            self._set_attributes(temporary, stat_result, False)
+        else:
+            os.mknod(temporary, stat_result.st_mode, stat_result.st_rdev)
+            self._set_attributes(temporary, stat_result)
+        os.replace(temporary, dst)
+
+    def _up_to_date(self, dst: str, stat_result: os.stat_result) -> bool:
+        """Returns True if dst already holds the file, setting its mode and owner if only those changed
+
+        A copy linked to another file is never changed, False is returned for it instead, so
+        it is copied again.
+        """
+        try:
+            current = os.lstat(dst)
+        except FileNotFoundError:
+            return False
+        if not stat.S_ISREG(current.st_mode) or \
+                (current.st_size, current.st_mtime_ns) != (stat_result.st_size, stat_result.st_mtime_ns):
+            return False
+
+        uid = stat_result.st_uid if self._owner else current.st_uid
+        gid = stat_result.st_gid if self._owner or stat_result.st_gid in self._groups else current.st_gid
+        if (current.st_mode, current.st_uid, current.st_gid) == (stat_result.st_mode, uid, gid):
+            return True
+        if current.st_nlink > 1:
+            return False
+        self._set_attributes(dst, stat_result)
+
+        return True
+
+    def _sync_entry(self, rel: str, stat_result: os.stat_result) -> Tuple[str, int]:
+        """Copies an entry that is not a directory
+
+        Args:
+            rel: path of the entry relative to the source, empty if the source is a file
+            stat_result: lstat result of the entry
+
+        Returns:
+            str: what was done, copied, linked, skipped or unchanged
+            int: number of bytes copied
+        """
+        src = os.path.join(self.source, rel) if rel else self.source
+        dst = os.path.join(self.dest, rel or os.path.basename(self.source))
+        if self._stopped:
+            return 'skipped', 0
+        if not stat.S_ISREG(stat_result.st_mode):
+            if (stat.S_ISCHR(stat_result.st_mode) or stat.S_ISBLK(stat_result.st_mode)) and not self._owner:
+                LOGGER.debug("sync: skipping device %s", src)
+                return 'skipped', 0
+            self._copy_other(src, dst, stat_result)
+            return 'copied', 0
+
+        if self._up_to_date(dst, stat_result):
+            return 'unchanged', 0
+        if self.link_dest and self._link(rel or os.path.basename(self.source), dst, stat_result):
+            return 'linked', 0
+
+        return 'copied', self._copy_file(src, dst, stat_result)
+
+    def _drain(self, limit: int) -> None:
+        """Waits for queued entries until at most limit are left, counting their results"""
+        while len(self._pending) > limit:
+            done, _ = concurrent.futures.wait(self._pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                rel = self._pending.pop(future)
+                try:
+                    result, copied = future.result()
+                except OSError as exception_object:
+                    self._error(rel, exception_object.strerror or str(exception_object))
+                    continue
+                setattr(self, result, getattr(self, result) + 1)
+                self.copied_bytes += copied
+
+    def _make_dir(self, rel: str, stat_result: os.stat_result) -> bool:
+        """Creates a directory at the destination, its attributes set once the walk is done
+
+        Returns:
+            True if the directory exists at the destination
+        """
+        dst = os.path.join(self.dest, rel)
+        try:
+            os.mkdir(dst, 0o700)
+        except FileExistsError:
+            if not os.path.isdir(dst) or os.path.islink(dst):
+                self._error(rel, 'destination exists and is not a directory')
+                return False
+            if not os.access(dst, os.W_OK | os.X_OK):
+                os.chmod(dst, stat.S_IMODE(os.stat(dst).st_mode) | stat.S_IRWXU)
+        except OSError as exception_object:
+            self._error(rel, exception_object.strerror or str(exception_object))
+            return False
+        self._dirs.append((dst, stat_result))
+
+        return True
+
+    def _list(self, rel: str, stat_result: os.stat_result) -> Tuple[list, bool]:
+        """Lists a directory, from link_dest if the index shows it is unchanged
+
+        Args:
+            rel: path of the directory relative to the source
+            stat_result: stat result of the directory in source
+
+        Returns:
+            list: name, whether it is a directory, and lstat result of each entry, taken from
+                  source for directories and from where the entry was listed otherwise
+            bool: the directory was listed from link_dest
+        """
+        state = (stat_result.st_ino, stat_result.st_mtime_ns)
+        if stat_result.st_mtime_ns < self._started_ns - INDEX_RACY_NS:
+            self._listed.append((rel, *state))
+        if self._indexed.get(rel) == state:
+            try:
+                with os.scandir(os.path.join(self.link_dest, rel)) as entries:
+                    listed = [(entry.name, entry.is_dir(follow_symlinks=False), entry.stat(follow_symlinks=False))
+                              for entry in entries]
+                return [(name, is_dir, os.lstat(os.path.join(self.source, rel, name)) if is_dir else previous)
+                        for name, is_dir, previous in listed], True
+            except OSError:
+                LOGGER.debug("sync: listing %s from source, its copy in %s cannot be listed", rel, self.link_dest)
+
+        with os.scandir(os.path.join(self.source, rel)) as entries:
+            return [(entry.name, entry.is_dir(follow_symlinks=False), entry.stat(follow_symlinks=False))
+                    for entry in entries], False
+
+    def _walk(self, small: concurrent.futures.Executor, large: concurrent.futures.Executor,
+              root: os.stat_result) -> None:
+        """Walks the source, creating directories and queueing every other entry to be copied"""
+        stack = [('', root)]
+        while stack and not self._out_of_time():
+            rel, dir_stat = stack.pop()
+            try:
+                listed, previous = self._list(rel, dir_stat)
+            except OSError as exception_object:
+                self._error(rel, exception_object.strerror or str(exception_object))
+                continue
+            self.listed_previous += previous
+            for name, is_dir, stat_result in sorted(listed, key=lambda item: item[0]):
+                child = f"{rel}/{name}" if rel else name
+                if self.excludes.match(child, is_dir):
+                    continue
+                if is_dir:
+                    if self._make_dir(child, stat_result):
+                        stack.append((child, stat_result))
+                    continue
+                pool = large if stat_result.st_size >= SMALL_FILE else small
+                if previous:
+                    self._pending[pool.submit(self._sync_listed, child)] = child
+                else:
+                    self._pending[pool.submit(self._sync_entry, child, stat_result)] = child
+                self._drain(self.workers * PENDING_PER_WORKER)
+
+    def run(self) -> bool:
+        """Copies the source
+
+        Returns:
+            True if every entry was copied
+        """
+        self._started_ns = time.time_ns()
+        indexed = self.index is not None and os.path.isdir(self.source)
+        if indexed:
+            self._indexed = self.index.load(self.source, self.link_dest, self.excludes.patterns)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as small, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as large:
+            try:
+                if os.path.isdir(self.source):
+                    self._dirs.append((self.dest, os.stat(self.source)))
+                    self._walk(small, large, self._dirs[0][1])
+                elif not self.excludes.match(os.path.basename(self.source), False):
+                    self._pending[small.submit(self._sync_entry, '', os.lstat(self.source))] = ''
+            except OSError as exception_object:
+                self._error('', exception_object.strerror or str(exception_object))
+            self._drain(0)
+
+        for dst, stat_result in reversed(self._dirs):
+            try:
+                self._set_attributes(dst, stat_result)
+            except OSError as exception_object:
+                self._error(os.path.relpath(dst, self.dest), exception_object.strerror or str(exception_object))
+
+        if indexed and not self.failed:
+            self.index.save(self.source, self.dest, self.excludes.patterns, self._listed, not self._indexed)
+
+        return not self.failed
@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Streaming Archiver Testing"""
+
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from eljef.backup import archive
+
+
+def make_tree(path: str) -> None:
+    os.makedirs(os.path.join(path, 'a', 'b'))
+    os.makedirs(os.path.join(path, 'z'))
+    for num, name in enumerate(('a/x', 'a/b/y', 'z/q', 'top')):
+        with open(os.path.join(path, name), 'wb') as test_file:
+            test_file.write(b'data' * num * 300)
+    os.link(os.path.join(path, 'a', 'x'), os.path.join(path, 'z', 'hard'))
+    os.symlink('a/x', os.path.join(path, 'sym'))
+
+
+class TestWriteTree(unittest.TestCase):
+    def test_write_tree_matches_tarfile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            expected = io.BytesIO()
+            with tarfile.open(fileobj=expected, mode='w|') as tar:
+                tar.add(tmp, arcname='backup')
+            got = io.BytesIO()
+            size = archive.write_tree(got, tmp, 'backup')
+
+        self.assertTrue(got.getvalue() == expected.getvalue(), 'archive differs from tarfile output')
+        self.assertTrue(size == len(expected.getvalue()), 'incorrect archive size')
+
+    def test_write_tree_hard_link(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            got = io.BytesIO()
+            archive.write_tree(got, tmp, 'backup')
+
+        got.seek(0)
+        with tarfile.open(fileobj=got) as tar:
+            member = tar.getmember('backup/z/hard')
+
+        self.assertTrue(member.islnk(), 'hard link not archived as a link')
+        self.assertTrue(member.linkname == 'backup/a/x', 'incorrect hard link target')
+
+    def test_write_tree_hard_links_forgotten(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            writer = archive.TarWriter(io.BytesIO())
+            writer.add(tmp, 'backup')
+            got = len(writer._links)
+            writer.close()
+
+        self.assertEqual(got, 0, 'inode kept after all its links were archived')
+
+    def test_write_tree_link_dest(self):
+        links_in_memory = archive.LINKS_IN_MEMORY
+        archive.LINKS_IN_MEMORY = 2
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                previous = os.path.join(tmp, 'previous')
+                current = os.path.join(tmp, 'current')
+                make_tree(previous)
+                for root, dirs, files in os.walk(previous):
+                    for name in dirs:
+                        os.makedirs(os.path.join(current, os.path.relpath(os.path.join(root, name), previous)))
+                    for name in files:
+                        path = os.path.join(root, name)
+                        os.link(path, os.path.join(current, os.path.relpath(path, previous)), follow_symlinks=False)
+                expected = io.BytesIO()
+                with tarfile.open(fileobj=expected, mode='w|') as tar:
+                    tar.add(current, arcname='backup')
+                got = io.BytesIO()
+                writer = archive.TarWriter(got)
+                writer.add(current, 'backup')
+                in_memory = len(writer._links._memory)
+                remembered = len(writer._links)
+                writer.close()
+        finally:
+            archive.LINKS_IN_MEMORY = links_in_memory
+
+        self.assertTrue(got.getvalue() == expected.getvalue(), 'archive differs from tarfile output')
+        self.assertEqual(in_memory, 2, 'inodes linked outside the tree not moved out of memory')
+        self.assertEqual(remembered, 4, 'incorrect number of inodes remembered')
+
+
+class TestIsIncompressible(unittest.TestCase):
+    def test_is_incompressible_extension(self):
+        self.assertTrue(archive.is_incompressible('/path/to/photo.JPG', 10), 'jpeg not incompressible')
+
+    def test_is_incompressible_sample(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            random_path = os.path.join(tmp, 'random.bin')
+            with open(random_path, 'wb') as test_file:
+                test_file.write(os.urandom(archive.SAMPLE_SIZE * 2))
+            text_path = os.path.join(tmp, 'text.sql')
+            with open(text_path, 'wb') as test_file:
+                test_file.write(b'INSERT INTO test VALUES (1);\n' * archive.SAMPLE_SIZE)
+
+            self.assertTrue(archive.is_incompressible(random_path, archive.SAMPLE_SIZE * 2),
+                            'random data not incompressible')
+            self.assertFalse(archive.is_incompressible(text_path, archive.SAMPLE_SIZE * 29),
+                             'text data incompressible')
+
+
+class TestSplitTarWriter(unittest.TestCase):
+    def test_split_tar_writer(self):
+        stored = io.BytesIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            with open(os.path.join(tmp, 'a', 'photo.jpg'), 'wb') as test_file:
+                test_file.write(b'jpeg')
+            got = io.BytesIO()
+            archive.write_tree(got, tmp, 'backup', lambda: stored)
+
+        got.seek(0)
+        with tarfile.open(fileobj=got) as tar:
+            main_names = tar.getnames()
+        stored.seek(0)
+        with tarfile.open(fileobj=stored) as tar:
+            stored_names = tar.getnames()
+
+        self.assertListEqual(stored_names, ['backup/a/photo.jpg'], 'incorrect stored members')
+        self.assertTrue('backup/a/photo.jpg' not in main_names, 'stored member in main archive')
+        self.assertTrue('backup/a/x' in main_names, 'compressible member not in main archive')
+
+    def test_split_tar_writer_hard_link(self):
+        stored = io.BytesIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            with open(os.path.join(tmp, 'a', 'photo.jpg'), 'wb') as test_file:
+                test_file.write(b'jpeg')
+            os.link(os.path.join(tmp, 'a', 'photo.jpg'), os.path.join(tmp, 'z', 'photo.jpg'))
+            got = io.BytesIO()
+            archive.write_tree(got, tmp, 'backup', lambda: stored)
+
+        stored.seek(0)
+        with tarfile.open(fileobj=stored) as tar:
+            members = {member.name: member for member in tar.getmembers()}
+
+        self.assertListEqual(sorted(members), ['backup/a/photo.jpg', 'backup/z/photo.jpg'], 'incorrect stored members')
+        self.assertTrue(members['backup/z/photo.jpg'].islnk(), 'hard link not archived as a link')
+        self.assertTrue(members['backup/z/photo.jpg'].linkname == 'backup/a/photo.jpg', 'incorrect hard link target')
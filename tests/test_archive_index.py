@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Archive Index Testing"""
+
+import os
+import tempfile
+import unittest
+
+from eljef.backup.archive import write_tree
+from eljef.backup.archive_index import (ArchiveIndex, extract)
+from eljef.backup.compression import ParallelCompressor
+
+
+def make_indexed_archive(tmp: str) -> str:
+    source = os.path.join(tmp, 'source')
+    for subdir in ('etc', 'data'):
+        os.makedirs(os.path.join(source, subdir))
+    with open(os.path.join(source, 'etc', 'app.conf'), 'wb') as test_file:
+        test_file.write(b'setting = 1\n')
+    for num in range(8):
+        with open(os.path.join(source, 'data', f"blob{num}"), 'wb') as test_file:
+            test_file.write(os.urandom(8192))
+    os.link(os.path.join(source, 'data', 'blob0'), os.path.join(source, 'etc', 'blob0'))
+
+    archive_path = os.path.join(tmp, 'backup.tar.gz')
+    with ParallelCompressor(archive_path, 'gzip', None, 2, 4096, ArchiveIndex(archive_path)) as stream:
+        write_tree(stream, source, 'backup')
+
+    return archive_path
+
+
+class TestExtract(unittest.TestCase):
+    def test_extract_single_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = make_indexed_archive(tmp)
+            output = os.path.join(tmp, 'output')
+            got = extract(archive_path, ['backup/etc/app.conf'], output)
+            with open(os.path.join(output, 'backup', 'etc', 'app.conf'), 'rb') as test_file:
+                data = test_file.read()
+
+        self.assertTrue(got == 1, 'incorrect number of members extracted')
+        self.assertTrue(data == b'setting = 1\n', 'extracted data differs')
+
+    def test_extract_across_frames(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = make_indexed_archive(tmp)
+            output = os.path.join(tmp, 'output')
+            extract(archive_path, ['backup/data/blob3'], output)
+            with open(os.path.join(tmp, 'source', 'data', 'blob3'), 'rb') as test_file:
+                expected = test_file.read()
+            with open(os.path.join(output, 'backup', 'data', 'blob3'), 'rb') as test_file:
+                data = test_file.read()
+
+        self.assertTrue(data == expected, 'extracted data differs')
+
+    def test_extract_subtree_with_hard_link(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = make_indexed_archive(tmp)
+            output = os.path.join(tmp, 'output')
+            got = extract(archive_path, ['backup/etc'], output)
+            names = sorted(os.listdir(os.path.join(output, 'backup', 'etc')))
+            with open(os.path.join(tmp, 'source', 'data', 'blob0'), 'rb') as test_file:
+                expected = test_file.read()
+            with open(os.path.join(output, 'backup', 'etc', 'blob0'), 'rb') as test_file:
+                data = test_file.read()
+
+        self.assertTrue(got == 4, 'incorrect number of members extracted')
+        self.assertListEqual(names, ['app.conf', 'blob0'], 'incorrect members extracted')
+        self.assertTrue(data == expected, 'hard linked data differs')
+
+    def test_extract_not_found(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = make_indexed_archive(tmp)
+            with self.assertRaises(FileNotFoundError):
+                extract(archive_path, ['backup/missing'], os.path.join(tmp, 'output'))
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Automatic Codec Selection Testing"""
+
+import os
+import tempfile
+import unittest
+
+from eljef.backup import autocodec
+
+
+class TestAutoCodecSetup(unittest.TestCase):
+    def test_auto_codec_setup_candidates(self):
+        auto = autocodec.AutoCodec()
+        got = auto.setup({'candidates': [{'codec': 'gzip', 'level': 1}, {'codec': 'xz'}]})
+        self.assertTrue(got == '', 'error message not empty')
+        self.assertListEqual(auto.candidates, [('gzip', 1), ('xz', 6)], 'incorrect candidates')
+
+    def test_auto_codec_setup_bad_target(self):
+        auto = autocodec.AutoCodec()
+        got = auto.setup({'max_minutes': 'ten'})
+        self.assertTrue(got == 'max_minutes must be a positive number', 'incorrect error message')
+
+
+class TestPickCodec(unittest.TestCase):
+    def setUp(self):
+        self.measured = [autocodec.CodecSample('lz4', 0, 0.6, 500.0),
+                         autocodec.CodecSample('zstd', 3, 0.4, 250.0),
+                         autocodec.CodecSample('xz', 6, 0.3, 5.0)]
+
+    def test_pick_codec_best_ratio(self):
+        got = autocodec.pick_codec(self.measured, 10 ** 9, 1, 0, 0)
+        self.assertTrue(got.codec == 'xz', 'best ratio not picked')
+
+    def test_pick_codec_min_speed(self):
+        got = autocodec.pick_codec(self.measured, 10 ** 9, 1, 0, 200)
+        self.assertTrue(got.codec == 'zstd', 'best ratio above min_speed not picked')
+
+    def test_pick_codec_max_minutes(self):
+        got = autocodec.pick_codec(self.measured, 10 ** 12, 1, 60, 0)
+        self.assertTrue(got.codec == 'lz4', 'fastest codec not picked when no codec meets target')
+
+
+class TestSampleDirectory(unittest.TestCase):
+    def test_sample_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for num in range(10):
+                with open(os.path.join(tmp, f"file{num}"), 'wb') as test_file:
+                    test_file.write(b'a' * 100)
+            sample, total_size = autocodec.sample_directory(tmp, 4, 10)
+
+        self.assertTrue(total_size == 1000, 'incorrect total size')
+        self.assertTrue(sample == b'a' * 40, 'incorrect sample')
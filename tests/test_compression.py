@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Compression Testing"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import tempfile
+import unittest
+
+from eljef.backup import compression
+
+
+class TestArchiveName(unittest.TestCase):
+    def test_archive_name(self):
+        self.assertTrue(compression.archive_name('2023-01-01.tar.gz') == '2023-01-01', 'incorrect gzip name')
+        self.assertTrue(compression.archive_name('2023-01-01.tar') == '2023-01-01', 'incorrect tar name')
+        self.assertTrue(compression.archive_name('2023-01-01.stored.tar') == '2023-01-01', 'incorrect stored name')
+        self.assertTrue(compression.archive_name('2023-01-01.tar.gz.idx') == '2023-01-01', 'incorrect index name')
+        self.assertTrue(compression.archive_name('2023-01-01.txt') == '', 'non-archive returned a name')
+
+
+class TestFindArchives(unittest.TestCase):
+    def test_find_archives(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('test.tar.xz', 'test.tar.xz.idx', 'test.stored.tar', 'other.tar.gz'):
+                with open(os.path.join(tmp, name), 'wb'):
+                    pass
+            got = sorted(os.path.basename(path) for path in compression.find_archives(tmp, 'test'))
+            main = [os.path.basename(path) for path in compression.find_archives(tmp, 'test', False)]
+
+        self.assertListEqual(got, ['test.stored.tar', 'test.tar.xz', 'test.tar.xz.idx'], 'incorrect archives found')
+        self.assertListEqual(main, ['test.tar.xz'], 'incorrect main archive found')
+
+
+class TestValidateCodec(unittest.TestCase):
+    def test_validate_codec_default_level(self):
+        got = compression.validate_codec('xz', None)
+        self.assertTupleEqual(got, ('xz', 6, ''), 'incorrect default level')
+
+    def test_validate_codec_bad_level(self):
+        got = compression.validate_codec('bz2', 10)
+        self.assertTrue(got[2] == 'bz2 level must be between 1 and 9', 'incorrect error message')
+
+    def test_validate_codec_unknown(self):
+        got = compression.validate_codec('unknown', None)
+        self.assertTrue(got[2].startswith('codec must be one of'), 'incorrect error message')
+
+
+class TestWorkerCount(unittest.TestCase):
+    def test_worker_count_set(self):
+        self.assertTrue(compression.worker_count(3) == 3, 'worker count != 3')
+
+    def test_worker_count_default(self):
+        self.assertTrue(compression.worker_count(0) >= 1, 'worker count < 1')
+
+
+class TestParallelCompressor(unittest.TestCase):
+    def test_parallel_compressor_bad_format(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(ValueError):
+                compression.ParallelCompressor(os.path.join(tmp, 'out.bz2'), 'unknown')
+
+    def test_parallel_compressor_multi_stream(self):
+        data = os.urandom(1000) * 50
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.bz2')
+            with compression.ParallelCompressor(path, 'bz2', 9, 4, 4096) as stream:
+                stream.write(data)
+            with open(path, 'rb') as compressed:
+                got = compressed.read()
+
+        self.assertTrue(got.count(b'BZh9') > 1, 'output is not multi-stream')
+        self.assertTrue(bz2.decompress(got) == data, 'decompressed data differs')
+
+    def test_parallel_compressor_tar(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.tar.bz2')
+            with compression.ParallelCompressor(path, 'bz2', None, 2, 1024) as stream:
+                with tarfile.open(fileobj=stream, mode='w|') as tar:
+                    info = tarfile.TarInfo('test/file')
+                    info.size = 5000
+                    tar.addfile(info, io.BytesIO(b'a' * 5000))
+            with tarfile.open(path, 'r:bz2') as tar:
+                member = tar.extractfile('test/file')
+                got = member.read()
+
+        self.assertTrue(got == b'a' * 5000, 'archived data differs')
+
+    def test_parallel_compressor_codecs(self):
+        data = b'test data ' * 1000
+        with tempfile.TemporaryDirectory() as tmp:
+            for codec, decompress in (('gzip', gzip.decompress), ('xz', lzma.decompress), ('none', bytes)):
+                path = os.path.join(tmp, f"out.{codec}")
+                with compression.ParallelCompressor(path, codec, None, 2, 4096) as stream:
+                    stream.write(data)
+                with open(path, 'rb') as compressed:
+                    got = decompress(compressed.read())
+
+                self.assertTrue(got == data, f"{codec}: decompressed data differs")
+
+    def test_parallel_compressor_partial(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.bz2')
+            with compression.ParallelCompressor(path, 'bz2', None, 2, 1024) as stream:
+                stream.write(b'test data')
+                self.assertFalse(os.path.exists(path), 'archive exists before close')
+                self.assertTrue(os.path.exists(f"{path}.part"), 'partial archive does not exist')
+            self.assertTrue(os.path.exists(path), 'archive does not exist after close')
+
+    def test_parallel_compressor_abort(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.bz2')
+            with self.assertRaises(RuntimeError):
+                with compression.ParallelCompressor(path, 'bz2', None, 2, 1024) as stream:
+                    stream.write(b'test data')
+                    raise RuntimeError('test')
+            self.assertListEqual(os.listdir(tmp), [], 'partial archive not removed')
+
+
+class TestRecompressArchive(unittest.TestCase):
+    def test_recompress_archive(self):
+        data = b'test data ' * 1000
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'test.tar.gz')
+            with compression.ParallelCompressor(source, 'gzip', None, 2, 4096) as stream:
+                stream.write(data)
+            target = os.path.join(tmp, 'test.tar.xz')
+            compression.recompress_archive(source, target, 'xz', 9, 2)
+            with open(target, 'rb') as compressed:
+                got = lzma.decompress(compressed.read())
+
+        self.assertTrue(got == data, 'recompressed data differs')
+
+    def test_recompress_archive_deadline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'test.tar.gz')
+            with compression.ParallelCompressor(source, 'gzip', None, 2, 4096) as stream:
+                stream.write(b'test data')
+            with self.assertRaises(TimeoutError):
+                compression.recompress_archive(source, os.path.join(tmp, 'test.tar.xz'), 'xz', None, 1, 1)
+            got = os.listdir(tmp)
+
+        self.assertListEqual(got, ['test.tar.gz'], 'partial archive not removed')
@@ -0,0 +1,42 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup File Index Testing"""
+
+import os
+import tempfile
+import unittest
+
+from eljef.backup.file_index import FileIndex
+
+
+class TestFileIndex(unittest.TestCase):
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index = FileIndex(os.path.join(tmp, 'index.sqlite'))
+            index.save('/src', '/backups/1/test/', ['*.log'], [('', 1, 10), ('a', 2, 20)], True)
+            index.close()
+            index = FileIndex(os.path.join(tmp, 'index.sqlite'))
+            got = index.load('/src', '/backups/1/test', ['*.log'])
+            other_dest = index.load('/src', '/backups/0/test', ['*.log'])
+            other_excludes = index.load('/src', '/backups/1/test', [])
+            other_source = index.load('/other', '/backups/1/test', ['*.log'])
+            index.full_days = 0
+            expired = index.load('/src', '/backups/1/test', ['*.log'])
+            index.close()
+
+        self.assertDictEqual(got, {'': (1, 10), 'a': (2, 20)}, 'incorrect directory states')
+        self.assertDictEqual(other_dest, {}, 'index trusted for another copy')
+        self.assertDictEqual(other_excludes, {}, 'index trusted with other excludes')
+        self.assertDictEqual(other_source, {}, 'index trusted for another source')
+        self.assertDictEqual(expired, {}, 'index trusted after a full walk was due')
+
+    def test_unreadable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'index.sqlite'), 'wb') as index_file:
+                index_file.write(b'not a database' * 100)
+            index = FileIndex(os.path.join(tmp, 'index.sqlite'))
+            index.save('/src', '/backups/1/test', [], [('', 1, 10)], True)
+            got = index.load('/src', '/backups/1/test', [])
+            index.close()
+
+        self.assertDictEqual(got, {}, 'unreadable index trusted')
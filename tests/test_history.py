@@ -0,0 +1,46 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup History Testing"""
+
+import os
+import tempfile
+import unittest
+
+from eljef.backup.history import (HISTORY_RUNS, History)
+
+
+class TestHistory(unittest.TestCase):
+    def test_expected_empty(self):
+        self.assertTrue(History('').expected('missing') == 0, 'expected duration without history != 0')
+
+    def test_expected_median(self):
+        history = History('')
+        for copy, compress in ((10, 100), (12, 110), (500, 120)):
+            history.record('project', {'00_copy': copy, '01_compress': compress})
+
+        self.assertTrue(history.expected('project') == 122, 'expected duration != sum of stage medians')
+
+    def test_record_keeps_last_runs(self):
+        history = History('')
+        for duration in range(HISTORY_RUNS + 5):
+            history.record('project', {'00_copy': duration})
+
+        self.assertListEqual(history.projects['project']['00_copy'], list(range(5, HISTORY_RUNS + 5)),
+                             'incorrect durations kept')
+
+    def test_record_regression(self):
+        history = History('')
+        history.record('project', {'00_copy': 100})
+
+        self.assertFalse(history.record('project', {'00_copy': 150}), 'small slowdown flagged')
+        self.assertTrue(history.record('project', {'00_copy': 1000}), 'regression not flagged')
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'history.json')
+            history = History(path)
+            history.record('project', {'00_copy': 1.5})
+            history.save()
+            got = History(path).projects
+
+        self.assertDictEqual(got, {'project': {'00_copy': [1.5]}}, 'history not saved')
@@ -0,0 +1,46 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Journal Testing"""
+
+import os
+import tempfile
+import unittest
+
+from eljef.backup.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    def test_record_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'backup.journal')
+            journal = Journal(path)
+            journal.record('a', '00_copy')
+            journal.record('a', '01_compress')
+            with open(path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write('{"project": "b", "st')
+            got = Journal(path, True)
+
+        self.assertTrue(got.done('a', '00_copy') and got.done('a', '01_compress'), 'completed stages not loaded')
+        self.assertFalse(got.done('b', '00_copy'), 'cut short entry loaded')
+
+    def test_new_journal_replaces_old(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'backup.journal')
+            Journal(path).record('a', '00_copy')
+            got = Journal(Journal(path).path, True)
+
+        self.assertFalse(got.done('a', '00_copy'), 'stages of an older journal kept')
+
+    def test_resume_missing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(FileNotFoundError):
+                Journal(os.path.join(tmp, 'missing.journal'), True)
+
+    def test_delete(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'backup.journal')
+            journal = Journal(path)
+            journal.delete()
+            journal.delete()
+
+            self.assertFalse(os.path.exists(path), 'journal not deleted')
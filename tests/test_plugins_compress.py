@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Compress Plugin Testing"""
+
+import os
+import tarfile
+import tempfile
+import unittest
+
+from eljef.backup.plugins.compress import SetupCompressPlugin
+from eljef.backup.project import Paths
+
+
+def make_backup(tmp: str) -> Paths:
+    backup_path = os.path.join(tmp, '2023-01-01_00-00-00')
+    for project in ('one', 'two'):
+        os.makedirs(os.path.join(backup_path, project))
+        with open(os.path.join(backup_path, project, 'data'), 'wb') as test_file:
+            test_file.write(project.encode() * 100)
+
+    return Paths(tmp, backup_path, '2023-01-01_00-00-00')
+
+
+class TestCompressPluginSetup(unittest.TestCase):
+    def test_setup_bad_scope(self):
+        setup = SetupCompressPlugin()
+        got = setup.setup(Paths('', '', ''), 'test', {'scope': 'unknown'})
+
+        self.assertIsNone(got, 'plugin returned for unknown scope')
+        self.assertTrue(setup.error.startswith('compress: scope must be one of'), 'incorrect error message')
+
+
+class TestCompressPluginRun(unittest.TestCase):
+    def test_run_projects(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = make_backup(tmp)
+            compress_plugin = SetupCompressPlugin().setup(paths, 'compress', {'do_compress': True, 'codec': 'gzip',
+                                                                              'scope': 'projects'})
+            got = compress_plugin.run()
+            files = sorted(os.listdir(paths.backup_path))
+            with tarfile.open(os.path.join(paths.backup_path, 'one.tar.gz')) as tar:
+                names = tar.getnames()
+
+        self.assertTupleEqual(got, (True, ''), 'compression failed')
+        self.assertListEqual(files, ['one.tar.gz', 'one.tar.gz.idx', 'two.tar.gz', 'two.tar.gz.idx'],
+                             'incorrect per project archives')
+        self.assertListEqual(names, ['one', 'one/data'], 'incorrect archive members')
+
+    def test_run_project(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = make_backup(tmp)
+            paths.subdir = 'two'
+            compress_plugin = SetupCompressPlugin().setup(paths, 'test', {'do_compress': True, 'codec': 'gzip',
+                                                                          'scope': 'project'})
+            got = compress_plugin.run()
+            files = sorted(os.listdir(paths.backup_path))
+
+        self.assertTupleEqual(got, (True, ''), 'compression failed')
+        self.assertListEqual(files, ['one', 'two.tar.gz', 'two.tar.gz.idx'], 'incorrect project compressed')
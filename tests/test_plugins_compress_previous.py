@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Compress Previous Plugin Testing"""
+
+import os
+import tempfile
+import unittest
+
+from eljef.backup.plugins.compress_previous import SetupCompressPreviousPlugin
+from eljef.backup.project import Paths
+
+
+def make_backups(tmp: str, names: list) -> Paths:
+    for name in names:
+        os.makedirs(os.path.join(tmp, name, 'test'))
+        with open(os.path.join(tmp, name, 'test', 'data'), 'wb') as test_file:
+            test_file.write(b'data' * 100)
+
+    return Paths(tmp, os.path.join(tmp, names[-1]), names[-1])
+
+
+class TestCompressPreviousPending(unittest.TestCase):
+    def test_pending_backups_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = make_backups(tmp, ['2023-01-01_00-00-00', '2023-01-02_00-00-00', '2023-01-03_00-00-00'])
+            with open(os.path.join(tmp, '2023-01-01_00-00-00.journal'), 'w', encoding='utf-8'):
+                pass
+            test_plugin = SetupCompressPreviousPlugin().setup(paths, 'test', {'codec': 'gzip'})
+            got = test_plugin._pending_backups()
+
+        self.assertTupleEqual(got, (['2023-01-02_00-00-00'], []), 'backup with a journal compressed')
+
+    def test_run_archived(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = make_backups(tmp, ['2023-01-01_00-00-00', '2023-01-02_00-00-00', '2023-01-03_00-00-00'])
+            with open(os.path.join(tmp, '2023-01-01_00-00-00.tar.gz'), 'wb') as test_file:
+                test_file.write(b'archive')
+            test_plugin = SetupCompressPreviousPlugin().setup(paths, 'test', {'codec': 'gzip'})
+            pending = test_plugin._pending_backups()
+            success, msg = test_plugin.run()
+            got = sorted(os.listdir(tmp))
+
+        self.assertTupleEqual(pending, (['2023-01-02_00-00-00'], ['2023-01-01_00-00-00']), 'incorrect pending backups')
+        self.assertTrue(success, msg)
+        self.assertListEqual(got, ['2023-01-01_00-00-00.tar.gz', '2023-01-02_00-00-00.tar.gz',
+                                   '2023-01-02_00-00-00.tar.gz.idx', '2023-01-03_00-00-00'],
+                             'archived backup not deleted')
@@ -0,0 +1,39 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Limit Backups Plugin Testing"""
+
+import os
+import stat
+import tempfile
+import unittest
+
+from eljef.backup.plugins.limit_backups import SetupLimitPlugin
+from eljef.backup.project import Paths
+
+
+class TestLimitPluginRun(unittest.TestCase):
+    def test_run_hard_links(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            old = os.path.join(tmp, '2023-01-01_00-00-00', 'test')
+            new = os.path.join(tmp, '2023-01-02_00-00-00', 'test')
+            os.makedirs(old)
+            os.makedirs(new)
+            with open(os.path.join(old, 'data'), 'wb') as test_file:
+                test_file.write(b'data')
+            os.chmod(os.path.join(old, 'data'), 0o444)
+            os.link(os.path.join(old, 'data'), os.path.join(new, 'data'))
+            os.chmod(old, 0o555)
+            with open(os.path.join(tmp, '2023-01-01_00-00-00.journal'), 'w', encoding='utf-8'):
+                pass
+            test_plugin = SetupLimitPlugin().setup(Paths(tmp, new, '2023-01-02_00-00-00'), 'test', {'total': 1})
+            success, _ = test_plugin.run()
+            got = sorted(os.listdir(tmp))
+            with open(os.path.join(new, 'data'), 'rb') as test_file:
+                data = test_file.read()
+            file_stat = os.stat(os.path.join(new, 'data'))
+
+        self.assertTrue(success, 'limit failed')
+        self.assertListEqual(got, ['2023-01-02_00-00-00'], 'old backup not deleted')
+        self.assertEqual(data, b'data', 'linked file changed')
+        self.assertEqual(stat.S_IMODE(file_stat.st_mode), 0o444, 'linked file mode changed')
+        self.assertEqual(file_stat.st_nlink, 1, 'incorrect link count')
@@ -0,0 +1,151 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Local Rsync Plugin Testing"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from eljef.backup.backup import find_previous_backup
+from eljef.backup.plugins.local_rsync import SetupLocalRsyncPlugin
+from eljef.backup.project import Paths
+from eljef.backup.shard import ShardCache
+
+
+class TestLocalRsyncIncremental(unittest.TestCase):
+    def test_find_previous_backup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('2023-01-01_00-00-00', '2023-01-02_00-00-00', '2023-01-03_00-00-00', '2023-01-05_00-00-00',
+                         'other'):
+                os.makedirs(os.path.join(tmp, name))
+            with open(os.path.join(tmp, '2023-01-03_00-00-00.journal'), 'w', encoding='utf-8'):
+                pass
+            with open(os.path.join(tmp, '2023-01-04_00-00-00.tar.bz2'), 'wb'):
+                pass
+            got = find_previous_backup(tmp, '2023-01-05_00-00-00')
+
+        self.assertEqual(got, os.path.join(tmp, '2023-01-02_00-00-00'), 'incorrect previous backup')
+
+    def test_link_dest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            os.makedirs(source)
+            os.makedirs(os.path.join(tmp, '2023-01-01_00-00-00', 'test', 'etc'))
+            info = {'paths': [{'path': source, 'backup_dir': 'etc'}, {'path': source, 'backup_dir': 'home'}],
+                    'incremental': True}
+            backup_path = os.path.join(tmp, '2023-01-02_00-00-00')
+            test_plugin = SetupLocalRsyncPlugin().setup(Paths(tmp, backup_path, '2023-01-02_00-00-00'), 'test', info)
+            test_plugin.previous = find_previous_backup(tmp, '2023-01-02_00-00-00')
+            linked, _ = test_plugin._path_cmds(info['paths'][0], f"{backup_path}/test/", '', ShardCache(''))
+            unlinked, _ = test_plugin._path_cmds(info['paths'][1], f"{backup_path}/test/", '', ShardCache(''))
+
+        self.assertListEqual(linked[0][1], ['rsync', '-a', f"--link-dest={tmp}/2023-01-01_00-00-00/test/etc",
+                                            f"{source}/", f"{backup_path}/test/etc/"], 'incorrect incremental command')
+        self.assertListEqual(unlinked[0][1], ['rsync', '-a', f"{source}/", f"{backup_path}/test/home/"],
+                             'link-dest set for a directory missing from the previous backup')
+
+    def test_bad_incremental(self):
+        setup = SetupLocalRsyncPlugin()
+
+        self.assertIsNone(setup.setup(Paths('', '', ''), 'test', {'paths': [{'path': '/'}], 'incremental': 'yes'}),
+                          'non boolean incremental accepted')
+
+
+class TestLocalRsyncNative(unittest.TestCase):
+    def test_run_native(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            os.makedirs(os.path.join(source, 'sub'))
+            for name in ('keep', 'drop.log'):
+                with open(os.path.join(source, 'sub', name), 'wb') as test_file:
+                    test_file.write(b'data')
+            backup_path = os.path.join(tmp, '2023-01-01_00-00-00')
+            info = {'paths': [{'path': source, 'backup_dir': 'etc', 'excludes': ['*.log']}], 'engine': 'native'}
+            test_plugin = SetupLocalRsyncPlugin().setup(Paths(tmp, backup_path, '2023-01-01_00-00-00'), 'test', info)
+            success, _ = test_plugin.run()
+            got = os.listdir(os.path.join(backup_path, 'test', 'etc', 'sub'))
+
+        self.assertTrue(success, 'native copy failed')
+        self.assertListEqual(got, ['keep'], 'incorrect files copied')
+
+    def test_bad_engine(self):
+        setup = SetupLocalRsyncPlugin()
+
+        self.assertIsNone(setup.setup(Paths('', '', ''), 'test', {'paths': [{'path': '/'}], 'engine': 'cp'}),
+                          'unknown engine accepted')
+
+    def test_native_shards(self):
+        got = [SetupLocalRsyncPlugin().setup(Paths('', '', ''), 'test', {'paths': [{'path': '/'}], 'engine': 'native',
+                                                                         name: value})
+               for name, value in (('shards', 4), ('max_parallel', 2))]
+
+        self.assertListEqual(got, [None, None], 'shards or max_parallel accepted with engine native')
+
+
+class TestLocalRsyncShards(unittest.TestCase):
+    def test_shard_cmds(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            for rel in ('a', 'b', 'c'):
+                os.makedirs(os.path.join(source, rel))
+            info = {'paths': [{'path': source, 'excludes': ['*.log']}], 'shards': 2}
+            test_plugin = SetupLocalRsyncPlugin().setup(Paths(tmp, tmp, 'backup'), 'test', info)
+            cmds, last_cmds = test_plugin._path_cmds(info['paths'][0], f"{tmp}/backup/", os.path.join(tmp, 'list'),
+                                                     ShardCache(''))
+            with open(os.path.join(tmp, 'list.dirs'), 'rb') as dirs:
+                got_dirs = dirs.read()
+
+        self.assertEqual(len(cmds), 2, 'incorrect number of shard commands')
+        for pos, (_, cmd) in enumerate(cmds):
+            self.assertListEqual(cmd, ['rsync', '-a', '--exclude', '*.log', '-r', '--from0',
+                                       f"--files-from={tmp}/list.{pos}", '--ignore-missing-args', f"{source}/",
+                                       f"{tmp}/backup/"], 'incorrect shard command')
+        self.assertListEqual(last_cmds[0][1], ['rsync', '-a', '--exclude', '*.log', '--from0',
+                                               f"--files-from={tmp}/list.dirs", '--ignore-missing-args',
+                                               f"{source}/", f"{tmp}/backup/"], 'incorrect directories command')
+        self.assertEqual(got_dirs, b'.\0', 'incorrect directories list')
+
+    def test_bad_shards(self):
+        setup = SetupLocalRsyncPlugin()
+
+        self.assertIsNone(setup.setup(Paths('', '', ''), 'test', {'paths': [{'path': '/'}], 'shards': -1}),
+                          'negative shards accepted')
+
+
+def tree_state(path: str) -> list:
+    found = []
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            entry = os.lstat(os.path.join(root, name))
+            found.append((os.path.relpath(os.path.join(root, name), path), entry.st_mode, entry.st_mtime_ns))
+
+    return sorted(found)
+
+
+@unittest.skipUnless(shutil.which('rsync'), 'rsync is not installed')
+class TestLocalRsyncShardParity(unittest.TestCase):
+    def test_shards_match_rsync(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            for rel, files in (('cache/a/b', 40), ('cache/c', 40), ('data/x/y', 20), ('data/z', 20), ('small', 2)):
+                os.makedirs(os.path.join(source, rel))
+                for num in range(files):
+                    with open(os.path.join(source, rel, f"file{num}.{'log' if num % 5 == 0 else 'dat'}"), 'wb') as f:
+                        f.write(b'data')
+            os.chmod(os.path.join(source, 'data', 'z'), 0o750)
+            excludes = ['cache/', '*.log', '/small/file1.dat']
+            info = {'paths': [{'path': source, 'excludes': excludes}], 'shards': 3, 'max_parallel': 2,
+                    'shard_cache': os.path.join(tmp, 'shards.json')}
+            test_plugin = SetupLocalRsyncPlugin().setup(Paths(tmp, os.path.join(tmp, 'sharded'), 'sharded'), 'test',
+                                                        info)
+            success, err_msg = test_plugin.run()
+            plain = os.path.join(tmp, 'plain')
+            subprocess.run(['rsync', '-a'] + [arg for exclude in excludes for arg in ('--exclude', exclude)] +
+                           [f"{source}/", f"{plain}/"], check=True)
+            sharded_state = tree_state(os.path.join(tmp, 'sharded', 'test'))
+            plain_state = tree_state(plain)
+
+        self.assertTrue(success, err_msg)
+        self.assertListEqual(sharded_state, plain_state, 'sharded copy differs from a single rsync -a')
@@ -0,0 +1,31 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Recompress Plugin Testing"""
+
+import os
+import tarfile
+import tempfile
+import unittest
+
+from eljef.backup.backup import compress_backup_directory
+from eljef.backup.plugins.recompress import SetupRecompressPlugin
+from eljef.backup.project import Paths
+
+
+class TestRecompressPluginRun(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, '2023-01-01_00-00-00', 'test'))
+            with open(os.path.join(tmp, '2023-01-01_00-00-00', 'test', 'data'), 'wb') as test_file:
+                test_file.write(b'data' * 100)
+            compress_backup_directory(tmp, os.path.join(tmp, '2023-01-01_00-00-00'), '2023-01-01_00-00-00', 'gzip')
+            paths = Paths(tmp, os.path.join(tmp, '2023-01-02_00-00-00'), '2023-01-02_00-00-00')
+            recompress_plugin = SetupRecompressPlugin().setup(paths, 'test', {'codec': 'bz2'})
+            success, msg = recompress_plugin.run()
+            got = sorted(name for name in os.listdir(tmp) if name.endswith('.bz2') or name.endswith('.gz'))
+            with tarfile.open(os.path.join(tmp, '2023-01-01_00-00-00.tar.bz2')) as archive:
+                members = archive.getnames()
+
+        self.assertTrue(success, msg)
+        self.assertListEqual(got, ['2023-01-01_00-00-00.tar.bz2'], 'archive not recompressed')
+        self.assertIn('2023-01-01_00-00-00/test/data', members, 'recompressed archive missing members')
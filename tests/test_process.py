@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Process Engine Testing"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+from eljef.backup import process
+from eljef.backup.plugins.plugin import Plugin
+from eljef.backup.process import (ENGINE, RingBuffer, credentials, run_command)
+from eljef.backup.project import Paths
+
+
+class TestRunCommand(unittest.TestCase):
+    def test_run_command_output(self):
+        lines = []
+        cmd = [sys.executable, '-c', 'import sys; print("one"); print("two"); print("err", file=sys.stderr)']
+        got = ENGINE.run(run_command(cmd, on_stdout=lines.append, stdout=RingBuffer(1024), stderr=RingBuffer(1024)))
+
+        self.assertTrue(got.returncode == 0, 'returncode != 0')
+        self.assertTrue(got.stdout == b'one\ntwo\n', 'incorrect stdout')
+        self.assertTrue(got.stderr == b'err\n', 'incorrect stderr')
+        self.assertListEqual(lines, [b'one\n', b'two\n'], 'stdout lines not streamed')
+
+    def test_run_command_discards(self):
+        cmd = [sys.executable, '-c', 'import sys; print("x" * 1000000); print("err" * 1000, file=sys.stderr)']
+        got = ENGINE.run(run_command(cmd, stderr=RingBuffer(8)))
+
+        self.assertTrue(got.stdout == b'', 'stdout kept without a sink')
+        self.assertTrue(got.stderr == b'rerrerr\n', 'incorrect stderr tail')
+
+    def test_run_command_spool(self):
+        with tempfile.TemporaryFile() as spool:
+            ENGINE.run(run_command([sys.executable, '-c', 'print("spooled")'], stdout=spool))
+            spool.seek(0)
+            got = spool.read()
+
+        self.assertTrue(got == b'spooled\n', 'stdout not spooled')
+
+    def test_run_command_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(asyncio.TimeoutError):
+            ENGINE.run(run_command([sys.executable, '-c', 'import time; time.sleep(30)'], 0.2))
+
+        self.assertTrue(time.monotonic() - start < 10, 'child not killed on timeout')
+
+    def test_run_command_timeout_group(self):
+        pids = RingBuffer(64)
+        with self.assertRaises(asyncio.TimeoutError):
+            ENGINE.run(run_command(['sh', '-c', 'sleep 30 & echo $!; wait'], 0.5, stdout=pids))
+
+        time.sleep(0.2)
+        try:
+            with open(f"/proc/{int(pids.getvalue())}/stat", 'r', encoding='utf-8') as stat:
+                state = stat.read().rsplit(')', 1)[1].split()[0]
+        except FileNotFoundError:
+            state = 'gone'
+
+        self.assertIn(state, ('Z', 'gone'), 'process started by the child left running')
+
+    def test_run_command_timeout_kills_after_grace(self):
+        start = time.monotonic()
+        with mock.patch.object(process, 'TERMINATE_GRACE', 0.2), self.assertRaises(asyncio.TimeoutError):
+            ENGINE.run(run_command(['sh', '-c', 'trap "" TERM; sleep 30'], 0.2))
+
+        self.assertTrue(time.monotonic() - start < 5, 'child ignoring SIGTERM not killed')
+
+    def test_run_command_concurrent(self):
+        async def run_all():
+            cmd = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+            return await asyncio.gather(*(run_command(cmd) for _ in range(6)))
+
+        start = time.monotonic()
+        got = ENGINE.run(run_all())
+
+        self.assertTrue(all(result.returncode == 0 for result in got), 'a child failed')
+        self.assertTrue(time.monotonic() - start < 2.5, 'children were not supervised at once')
+
+
+class TestCredentials(unittest.TestCase):
+    @unittest.skipIf(sys.version_info < (3, 9), 'user and group arguments need python 3.9')
+    def test_credentials(self):
+        got = credentials(os.getuid(), os.getgid())
+
+        self.assertNotIn('preexec_fn', got, 'preexec_fn used')
+        self.assertEqual((got['user'], got['group']), (os.getuid(), os.getgid()), 'incorrect user or group')
+        self.assertEqual('extra_groups' in got, os.geteuid() == 0, 'extra_groups only set when root')
+
+    def test_credentials_run(self):
+        got = ENGINE.run(run_command(['id', '-u'], stdout=RingBuffer(64), **credentials(os.getuid(), os.getgid())))
+
+        self.assertEqual(got.stdout.strip(), str(os.getuid()).encode(), 'incorrect user')
+
+    def test_plugin_demote(self):
+        got = subprocess.run(['id', '-u'], stdout=subprocess.PIPE, check=True,
+                             preexec_fn=Plugin.demote(os.getuid(), os.getgid()))
+
+        self.assertEqual(got.stdout.strip(), str(os.getuid()).encode(), 'incorrect user')
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_ring_buffer(self):
+        buffer = RingBuffer(10)
+        for data in (b'abc', b'defgh', b'ijklmnop', b'q'):
+            buffer.write(data)
+
+        self.assertTrue(buffer.getvalue() == b'hijklmnopq', 'incorrect tail kept')
+
+
+class TestPluginExec(unittest.TestCase):
+    def test_exec(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+
+        self.assertTupleEqual(test_plugin.exec(['true']), (True, ''), 'exec failed')
+        self.assertTupleEqual(test_plugin.exec(['false']), (False, 'Failed: false'), 'exec did not fail')
+
+    def test_exec_stage_timeout(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+        test_plugin.settings.timeout = 0.3
+        test_plugin.start()
+        got = test_plugin.exec(['sleep', '30'])
+
+        self.assertFalse(got[0], 'exec did not time out')
+        self.assertTrue(got[1].startswith('Timed out after 0.') and got[1].endswith(' seconds: sleep 30'),
+                        'incorrect timeout message')
+        got = test_plugin.exec(['true'])
+        self.assertTrue(not got[0] and got[1].endswith(' seconds: true'), 'command started after the stage timed out')
+
+    def test_exec_run_as(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+        test_plugin.run_as = True
+        test_plugin.uid = os.getuid()
+        test_plugin.gid = os.getgid()
+
+        self.assertTupleEqual(test_plugin.exec(['true']), (True, ''), 'exec as user failed')
+
+    def test_exec_async_gather(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+
+        async def run_all():
+            return await asyncio.gather(test_plugin.exec_async(['true']), test_plugin.exec_async(['false']))
+
+        got = test_plugin.run_async(run_all())
+
+        self.assertListEqual(got, [(True, ''), (False, 'Failed: false')], 'incorrect results')
+
+    def test_exec_parallel(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+        cmds = [(f"path{num}", ['sleep', '0.5']) for num in range(4)]
+        start = time.monotonic()
+        got = test_plugin.exec_parallel(cmds, 4)
+
+        self.assertTupleEqual(got, (True, ''), 'exec_parallel failed')
+        self.assertTrue(time.monotonic() - start < 1.5, 'commands not run at once')
+
+    def test_exec_parallel_errors(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+        got = test_plugin.exec_parallel([('one', ['false']), ('two', ['true']), ('three', ['false'])])
+
+        self.assertTupleEqual(got, (False, 'one: Failed: false; three: Failed: false'), 'errors not collected')
+
+    def test_exec_stdout_file(self):
+        test_plugin = Plugin(Paths('', '', ''), 'test')
+        with tempfile.TemporaryDirectory() as tmp:
+            test_plugin.settings.stdout_file = os.path.join(tmp, 'stdout.log')
+            test_plugin.exec(['echo', 'one'])
+            test_plugin.exec(['echo', 'two'])
+            with open(test_plugin.settings.stdout_file, 'rb') as spool:
+                got = spool.read()
+
+        self.assertTrue(got == b'one\ntwo\n', 'stdout not appended to stdout_file')
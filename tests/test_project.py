@@ -0,0 +1,247 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Project Testing"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from eljef.backup.history import History
+from eljef.backup.journal import Journal
+from eljef.backup.plugins import plugin
+from eljef.backup.project import (Paths, Projects)
+from eljef.core.dictobj import DictObj
+
+
+class RecordPlugin(plugin.Plugin):
+    def __init__(self, paths: Paths, project: str, info: dict) -> None:
+        super().__init__(paths, project)
+        self.info = info
+
+    def implied_resources(self):
+        return ['cpu']
+
+    def run(self):
+        if self.info.get('cmd'):
+            return self.exec(self.info['cmd'])
+        gate = self.info.get('gate')
+        if gate is not None:
+            gate.wait(5)
+        self.info['log'].append(f"{self.project}:{self.info['step']}")
+        release = self.info.get('release')
+        if release is not None:
+            release.set()
+        if self.info.get('fail'):
+            return False, 'failed'
+        return True, ''
+
+
+class SetupRecordPlugin(plugin.SetupPlugin):
+    def __init__(self) -> None:
+        super().__init__()
+        self.name = 'record'
+
+    def setup(self, paths: Paths, project: str, info: dict) -> object:
+        return RecordPlugin(paths, project, info)
+
+
+def make_projects(log: list, depth: int, extra: dict = None, journal: Journal = None) -> Projects:
+    configs = {}
+    for project in ('a', 'b', 'c'):
+        configs[project] = {
+            '00_copy': {'plugin': 'record', 'step': 'copy', 'log': log},
+            '01_compress': {'plugin': 'record', 'step': 'compress', 'log': log, 'background': True},
+            '02_verify': {'plugin': 'record', 'step': 'verify', 'log': log},
+        }
+    for project, steps in (extra or {}).items():
+        for step, settings in steps.items():
+            configs[project][step].update(settings)
+
+    return Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs), depth,
+                    journal=journal)
+
+
+class TestProjectsRun(unittest.TestCase):
+    def test_run_sequential(self):
+        log = []
+        got = make_projects(log, 0).run()
+
+        self.assertTupleEqual(got, (True, '', ''), 'projects failed')
+        self.assertListEqual(log, ['a:copy', 'a:compress', 'a:verify', 'b:copy', 'b:compress', 'b:verify',
+                                   'c:copy', 'c:compress', 'c:verify'], 'incorrect sequential order')
+
+    def test_run_pipelined_overlaps(self):
+        log = []
+        copied = threading.Event()
+        projects = make_projects(log, 1, {'a': {'01_compress': {'gate': copied}},
+                                          'b': {'00_copy': {'release': copied}}})
+        got = projects.run()
+
+        self.assertTupleEqual(got, (True, '', ''), 'projects failed')
+        self.assertTrue(log.index('b:copy') < log.index('a:compress'), 'compress of a did not overlap copy of b')
+        for project in ('a', 'b', 'c'):
+            steps = [entry for entry in log if entry.startswith(f"{project}:")]
+            self.assertListEqual(steps, [f"{project}:copy", f"{project}:compress", f"{project}:verify"],
+                                 f"incorrect order for project {project}")
+
+    def test_run_pipelined_fail_fast(self):
+        log = []
+        copied = threading.Event()
+        projects = make_projects(log, 1, {'a': {'01_compress': {'fail': True, 'gate': copied}},
+                                          'b': {'00_copy': {'release': copied}}})
+        got = projects.run()
+
+        self.assertTupleEqual(got, (False, 'failed', 'a'), 'background failure not returned')
+        for step in ('a:verify', 'b:compress', 'c:compress'):
+            self.assertNotIn(step, log, f"{step} was run after a background failure")
+
+
+class TestProjectsContinueOnFailure(unittest.TestCase):
+    def test_run_continue_on_failure(self):
+        log = []
+        configs = {}
+        for project in ('a', 'b', 'c'):
+            configs[project] = {
+                '00_copy': {'plugin': 'record', 'step': 'copy', 'log': log},
+                '01_compress': {'plugin': 'record', 'step': 'compress', 'log': log, 'background': True,
+                                'fail': project == 'a'},
+            }
+        configs['b']['depends_on'] = 'a'
+        projects = Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs), 1,
+                            continue_on_failure=True)
+        got = projects.run()
+
+        self.assertTupleEqual(got, (False, '2 of 3 projects did not complete', ''), 'incorrect result')
+        self.assertListEqual(sorted(log), ['a:compress', 'a:copy', 'c:compress', 'c:copy'], 'incorrect stages run')
+        self.assertEqual(projects.summary(), 'a: failed: failed\nb: skipped: depends on a\nc: completed',
+                         'incorrect summary')
+
+
+class TestProjectsTimeout(unittest.TestCase):
+    def test_run_project_timeout(self):
+        log = []
+        configs = {'a': {'timeout': 0.3, '00_mount': {'plugin': 'record', 'cmd': ['sleep', '30']},
+                         '01_copy': {'plugin': 'record', 'step': 'copy', 'log': log}},
+                   'b': {'00_copy': {'plugin': 'record', 'step': 'copy', 'log': log}}}
+        projects = Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs))
+        start = time.monotonic()
+        got = projects.run()
+
+        self.assertTrue(time.monotonic() - start < 10, 'hung stage not stopped')
+        self.assertFalse(got[0], 'project did not fail')
+        self.assertTrue(got[1].startswith('Timed out after') and got[2] == 'a', 'incorrect failure')
+        self.assertListEqual(log, [], 'stages run after a timeout')
+
+    def test_bad_timeout(self):
+        for configs in ({'a': {'timeout': 0, '00_copy': {'plugin': 'record'}}},
+                        {'a': {'00_copy': {'plugin': 'record', 'timeout': 'soon'}}}):
+            with self.assertRaises(ValueError):
+                Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs))
+
+
+class TestProjectsRetry(unittest.TestCase):
+    @staticmethod
+    def run_flaky(tmp: str, settings: dict) -> tuple:
+        attempts = os.path.join(tmp, 'attempts')
+        cmd = ['sh', '-c', f"echo x >> {attempts}; test $(wc -l < {attempts}) -ge 3 || exit 23"]
+        configs = {'a': {'00_copy': dict({'plugin': 'record', 'cmd': cmd, 'retry_delay': 0}, **settings)}}
+        got = Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs)).run()
+        with open(attempts, 'r', encoding='utf-8') as attempts_file:
+            return got, len(attempts_file.readlines())
+
+    def test_retry(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            got, attempts = self.run_flaky(tmp, {'retries': 2, 'retry_on': [23, 24]})
+
+        self.assertTupleEqual(got, (True, '', ''), 'stage not retried until it succeeded')
+        self.assertEqual(attempts, 3, 'incorrect number of attempts')
+
+    def test_retry_exhausted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            got, attempts = self.run_flaky(tmp, {'retries': 1})
+
+        self.assertFalse(got[0], 'stage did not fail')
+        self.assertEqual(attempts, 2, 'incorrect number of attempts')
+
+    def test_retry_on_other_status(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            got, attempts = self.run_flaky(tmp, {'retries': 2, 'retry_on': [30]})
+
+        self.assertFalse(got[0], 'stage did not fail')
+        self.assertEqual(attempts, 1, 'stage retried on an exit status not in retry_on')
+
+    def test_bad_retries(self):
+        for settings in ({'retries': -1}, {'retry_delay': 'soon'}, {'retry_on': 23}):
+            configs = {'a': {'00_copy': dict({'plugin': 'record'}, **settings)}}
+            with self.assertRaises(ValueError):
+                Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs))
+
+
+class TestProjectsResume(unittest.TestCase):
+    def test_resume_skips_completed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'backup.journal')
+            first = make_projects([], 0, {'b': {'01_compress': {'fail': True}}}, Journal(path)).run()
+            log = []
+            got = make_projects(log, 0, journal=Journal(path, True)).run()
+
+        self.assertFalse(first[0], 'first run did not fail')
+        self.assertTupleEqual(got, (True, '', ''), 'resumed run failed')
+        self.assertListEqual(log, ['b:compress', 'b:verify', 'c:copy', 'c:compress', 'c:verify'],
+                             'completed stages not skipped')
+
+    def test_resume_skips_completed_background(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'backup.journal')
+            make_projects([], 1, {'a': {'02_verify': {'fail': True}}}, Journal(path)).run()
+            log = []
+            got = make_projects(log, 1, journal=Journal(path, True)).run()
+
+        self.assertTupleEqual(got, (True, '', ''), 'resumed run failed')
+        self.assertListEqual(log[:1], ['a:verify'], 'completed background stage not skipped')
+
+
+class TestProjectsHistory(unittest.TestCase):
+    def test_run_records_history(self):
+        history = History('')
+        projects = make_projects([], 0)
+        projects.history = history
+        projects.run()
+
+        self.assertListEqual(sorted(history.projects), ['a', 'b', 'c'], 'projects not recorded')
+        self.assertListEqual(sorted(history.projects['a']), ['00_copy', '01_compress', '02_verify'],
+                             'stages not recorded')
+
+
+class TestProjectsSetup(unittest.TestCase):
+    def test_bad_pipeline_depth(self):
+        with self.assertRaises(ValueError):
+            make_projects([], -1)
+
+    def test_depends_on(self):
+        configs = {
+            '00_mount': {'name': 'mount', '00_run': {'plugin': 'record'}},
+            '01_copy': {'depends_on': 'mount', '00_run': {'plugin': 'record'}},
+            '02_compress': {'depends_on': ['00_mount', '01_copy'], '00_run': {'plugin': 'record'}},
+        }
+        projects = Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs))
+
+        self.assertDictEqual(projects.depends_on, {'00_mount': [], '01_copy': ['00_mount'],
+                                                   '02_compress': ['00_mount', '01_copy']},
+                             'incorrect dependencies')
+
+    def test_resources(self):
+        configs = {'00_copy': {'00_implied': {'plugin': 'record'},
+                               '01_set': {'plugin': 'record', 'resources': ['net:offsite']}}}
+        projects = Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs))
+        stages = projects.map['00_copy'].map
+
+        self.assertListEqual(stages['00_implied'].settings.resources, ['cpu'], 'implied resources not used')
+        self.assertListEqual(stages['01_set'].settings.resources, ['net:offsite'], 'configured resources not used')
+
+    def test_depends_on_not_found(self):
+        configs = {'00_copy': {'depends_on': ['missing'], '00_run': {'plugin': 'record'}}}
+        with self.assertRaises(ValueError):
+            Projects(Paths('', '', ''), DictObj({'record': SetupRecordPlugin}), DictObj(configs))
@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Scheduler Testing"""
+
+import threading
+import time
+import unittest
+
+from eljef.backup.scheduler import (ResourceLimits, Scheduler, check_dependencies, critical_paths)
+
+
+class FakeProject:
+    def __init__(self, name: str, log: list, fail: bool = False, delay: float = 0.0) -> None:
+        self.project = name
+        self.delay = delay
+        self.fail = fail
+        self.log = log
+
+    def run(self, _, done):
+        self.log.append(f"{self.project}:start")
+        time.sleep(self.delay)
+        self.log.append(f"{self.project}:end")
+        if self.fail:
+            done(False, 'failed')
+            return False, 'failed', self.project
+        done(True, '')
+        return True, '', ''
+
+
+class TestCheckDependencies(unittest.TestCase):
+    def test_check_dependencies(self):
+        check_dependencies({'a': [], 'b': ['a'], 'c': ['a', 'b']})
+
+    def test_check_dependencies_cycle(self):
+        with self.assertRaises(ValueError) as context:
+            check_dependencies({'a': ['c'], 'b': ['a'], 'c': ['b']})
+
+        self.assertTrue(str(context.exception) == 'depends_on cycle: a -> c -> b -> a', 'incorrect error message')
+
+
+class TestScheduler(unittest.TestCase):
+    def test_run_dependency_order(self):
+        log = []
+        projects = {key: FakeProject(key, log, delay=0.01) for key in ('mount', 'rsync', 'compress', 'limit')}
+        depends_on = {'rsync': ['mount'], 'compress': ['rsync'], 'limit': ['compress']}
+        got = Scheduler(projects, depends_on, 4).run()
+
+        self.assertTupleEqual(got, (True, '', ''), 'scheduler failed')
+        self.assertListEqual(log, ['mount:start', 'mount:end', 'rsync:start', 'rsync:end', 'compress:start',
+                                   'compress:end', 'limit:start', 'limit:end'], 'dependency order not kept')
+
+    def test_run_independent_concurrently(self):
+        log = []
+        barrier = threading.Barrier(3, timeout=5)
+
+        class BarrierProject(FakeProject):
+            def run(self, pipeline, done):
+                barrier.wait()
+                return super().run(pipeline, done)
+
+        projects = {key: BarrierProject(key, log) for key in ('a', 'b', 'c')}
+        got = Scheduler(projects, {}, 3).run()
+
+        self.assertTupleEqual(got, (True, '', ''), 'independent projects did not run at once')
+
+    def test_run_failure_skips_dependents(self):
+        log = []
+        projects = {'a': FakeProject('a', log, fail=True), 'b': FakeProject('b', log)}
+        got = Scheduler(projects, {'b': ['a']}, 2).run()
+
+        self.assertTupleEqual(got, (False, 'failed', 'a'), 'failure not returned')
+        self.assertNotIn('b:start', log, 'dependent of failed project was run')
+
+    def test_run_continue_on_failure(self):
+        log = []
+        projects = {key: FakeProject(key, log, fail=key == 'a') for key in ('a', 'b', 'c', 'd')}
+        scheduler = Scheduler(projects, {'b': ['a'], 'c': ['b']}, 1, continue_on_failure=True)
+        got = scheduler.run()
+
+        self.assertTupleEqual(got, (False, '3 of 4 projects did not complete', ''), 'incorrect result')
+        self.assertDictEqual(scheduler.status, {'a': 'failed: failed', 'b': 'skipped: depends on a',
+                                                'c': 'skipped: depends on b', 'd': 'completed'},
+                             'incorrect status')
+        self.assertIn('d:end', log, 'independent project not run')
+
+    def test_run_failure_status(self):
+        projects = {key: FakeProject(key, [], fail=key == 'a') for key in ('a', 'b')}
+        scheduler = Scheduler(projects, {}, 1)
+        scheduler.run()
+
+        self.assertDictEqual(scheduler.status, {'a': 'failed: failed', 'b': 'not started'}, 'incorrect status')
+
+    def test_run_time_budget(self):
+        log = []
+        projects = {key: FakeProject(key, log, delay=0.2) for key in ('a', 'b', 'c')}
+        got = Scheduler(projects, {}, 1, None, None, time.monotonic() + 0.1).run()
+
+        self.assertTupleEqual(got, (False, 'time budget used, not started: b, c', ''), 'budget not enforced')
+        self.assertListEqual(log, ['a:start', 'a:end'], 'project started after the budget was used')
+
+
+class TestResourceLimits(unittest.TestCase):
+    def test_bad_limit(self):
+        with self.assertRaises(ValueError):
+            ResourceLimits({'cpu': 0})
+
+    def test_disk_tags_normalized(self):
+        limits = ResourceLimits({'disk:/backups/': 1})
+        with limits.hold(['disk:/backups//']):
+            got = limits._slots['disk:/backups'].acquire(blocking=False)
+
+        self.assertFalse(got, 'disk: tags with different paths to the same directory not limited together')
+        with self.assertRaises(ValueError):
+            ResourceLimits({'disk:/backups': 1, 'disk:/backups/': 2})
+
+    def test_warn_unused(self):
+        limits = ResourceLimits({'cpu': 1, 'disk:/backups': 1, 'net:offsite': 1})
+        with self.assertLogs('eljef.backup.scheduler', level='WARNING') as logs:
+            limits.warn_unused(['cpu', 'disk:/backups/'])
+
+        self.assertEqual(len(logs.output), 1, 'incorrect number of warnings')
+        self.assertIn('net:offsite', logs.output[0], 'unused limit not warned about')
+
+    def test_hold_limits_concurrency(self):
+        limits = ResourceLimits({'disk:/backups': 2})
+        lock = threading.Lock()
+        counts = {'now': 0, 'max': 0}
+
+        def use_disk():
+            with limits.hold(['cpu', 'disk:/backups']):
+                with lock:
+                    counts['now'] += 1
+                    counts['max'] = max(counts['max'], counts['now'])
+                time.sleep(0.02)
+                with lock:
+                    counts['now'] -= 1
+
+        threads = [threading.Thread(target=use_disk) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(counts['max'] == 2, f"{counts['max']} stages held disk:/backups at once")
+
+
+class TestCriticalPaths(unittest.TestCase):
+    def test_critical_paths(self):
+        got = critical_paths(['a', 'b', 'c', 'd'], {'c': ['a'], 'd': ['a', 'b']}, {'a': 5, 'b': 1, 'c': 10, 'd': 2})
+
+        self.assertDictEqual(got, {'a': 15, 'b': 3, 'c': 10, 'd': 2}, 'incorrect critical paths')
+
+    def test_run_longest_first(self):
+        log = []
+        projects = {key: FakeProject(key, log) for key in ('a_short', 'b_short', 'c_long')}
+        got = Scheduler(projects, {}, 1, None, {'a_short': 300, 'b_short': 300, 'c_long': 10800}).run()
+
+        self.assertTupleEqual(got, (True, '', ''), 'scheduler failed')
+        self.assertListEqual([entry for entry in log if entry.endswith(':start')],
+                             ['c_long:start', 'a_short:start', 'b_short:start'], 'longest project not started first')
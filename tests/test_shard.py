@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Shard Testing"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from eljef.backup import shard
+from eljef.backup.shard import (ShardCache, count_entries, plan_shards)
+from eljef.backup.sync import Excludes
+
+
+def make_tree(path: str) -> None:
+    for rel, files in (('big/a', 30), ('big/b', 30), ('big/c/d', 30), ('small', 5), ('tiny', 1)):
+        os.makedirs(os.path.join(path, rel))
+        for num in range(files):
+            with open(os.path.join(path, rel, f"file{num}"), 'w', encoding='utf-8'):
+                pass
+    with open(os.path.join(path, 'big', 'top'), 'w', encoding='utf-8'):
+        pass
+    with open(os.path.join(path, 'file'), 'w', encoding='utf-8'):
+        pass
+    os.symlink('big', os.path.join(path, 'link'))
+
+
+def all_entries(path: str) -> list:
+    found = []
+    for root, dirs, files in os.walk(path):
+        rel = os.path.relpath(root, path)
+        found += [os.path.normpath(os.path.join(rel, name)) for name in dirs + files]
+
+    return found
+
+
+class TestCountEntries(unittest.TestCase):
+    def test_count_entries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            got = count_entries(tmp, 'big')
+
+        self.assertDictEqual(got, {'big': 95, 'big/a': 30, 'big/b': 30, 'big/c': 31, 'big/c/d': 30},
+                             'incorrect counts')
+
+
+    def test_count_entries_excludes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            got = count_entries(tmp, 'big', Excludes(['c/', 'file1*']))
+
+        self.assertDictEqual(got, {'big': 41, 'big/a': 19, 'big/b': 19}, 'excluded entries counted')
+
+
+class TestPlanShards(unittest.TestCase):
+    def test_plan_covers_tree_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            shards, split = plan_shards(tmp, 3, {}, 2)
+            entries = all_entries(tmp)
+
+        planned = [rel for planned_shard in shards for rel in planned_shard]
+        for entry in entries:
+            covering = [rel for rel in planned if entry == rel or entry.startswith(f"{rel}/")]
+            self.assertTrue(len(covering) == 1 or entry in split, f"{entry} copied {len(covering)} times")
+        for rel in planned:
+            self.assertIn(os.path.dirname(rel) or '.', split, f"parent of {rel} not split")
+        self.assertListEqual(split, ['.', 'big'], 'incorrect directories split')
+        self.assertIn('link', planned, 'link not copied')
+
+    def test_plan_excludes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            shards, split = plan_shards(tmp, 3, {}, 1, Excludes(['big/a/', 'file']))
+
+        planned = [rel for planned_shard in shards for rel in planned_shard]
+        self.assertListEqual([rel for rel in planned + split if rel == 'big/a' or rel.startswith('big/a/')], [],
+                             'excluded directory planned')
+        self.assertNotIn('file', planned, 'excluded file planned')
+        self.assertIn('big/b/file0', planned, 'directory next to excluded directory not planned')
+
+    def test_plan_balanced(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            counts = {}
+            shards, _ = plan_shards(tmp, 3, counts)
+            sizes = [sum(counts.get(rel, 0) + 1 for rel in planned_shard) for planned_shard in shards]
+
+        self.assertEqual(len(shards), 3, 'incorrect number of shards')
+        self.assertTrue(max(sizes) - min(sizes) <= 8, f"shards not balanced: {sizes}")
+
+    def test_plan_uses_cached_counts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp)
+            shards, split = plan_shards(tmp, 2, {'big': 1, 'small': 500, 'tiny': 1})
+
+        self.assertListEqual(split, ['.', 'small'], 'cached counts not used')
+        self.assertTrue(any(planned_shard == ['big'] or 'big' in planned_shard for planned_shard in shards),
+                        'big split despite cached count')
+
+
+class TestShardCache(unittest.TestCase):
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'shards.json')
+            cache = ShardCache(path)
+            cache.counts('/source')['big'] = 10
+            cache.save()
+
+            self.assertDictEqual(ShardCache(path).counts('/source'), {'big': 10}, 'counts not loaded')
+
+    def test_excludes_changed(self):
+        cache = ShardCache('')
+        cache.counts('/source', ['cache/'])['big'] = 10
+
+        self.assertDictEqual(cache.counts('/source', ['cache/']), {'big': 10}, 'counts not kept')
+        self.assertDictEqual(cache.counts('/source'), {}, 'counts taken with other excludes used')
+
+    def test_refresh(self):
+        cache = ShardCache('')
+        cache.counts('/source')['big'] = 10
+        cache.sources['/source']['time'] = time.time() - shard.SHARD_REFRESH_DAYS * 86400 - 1
+
+        self.assertDictEqual(cache.counts('/source'), {}, 'old counts used')
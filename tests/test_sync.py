@@ -0,0 +1,186 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: 0BSD
+"""ElJef Backup Native Tree Sync Testing"""
+
+import os
+import stat
+import tempfile
+import unittest
+
+from eljef.backup import sync
+from eljef.backup.file_index import FileIndex
+
+
+def make_tree(path: str) -> None:
+    os.makedirs(os.path.join(path, 'a', 'b'))
+    os.makedirs(os.path.join(path, 'logs'))
+    os.makedirs(os.path.join(path, 'empty'))
+    for name, data in (('a/x', b'x' * 100), ('a/b/y', b'y' * (sync.SMALL_FILE + 1)), ('logs/app.log', b'log'),
+                       ('top', b'')):
+        with open(os.path.join(path, name), 'wb') as test_file:
+            test_file.write(data)
+    os.symlink('a/x', os.path.join(path, 'sym'))
+    os.chmod(os.path.join(path, 'a', 'x'), 0o640)
+    os.utime(os.path.join(path, 'a', 'x'), ns=(1_000_000_000, 1_500_000_000_123))
+    os.chmod(os.path.join(path, 'a', 'b'), 0o555)
+
+
+class TestCopyData(unittest.TestCase):
+    def test_copy_data(self):
+        data = os.urandom(sync.COPY_CHUNK + 100)
+        kernel_copies = sync.KERNEL_COPIES
+        got = []
+        with tempfile.NamedTemporaryFile() as src:
+            src.write(data)
+            src.flush()
+            try:
+                for pos in range(len(kernel_copies) + 1):
+                    sync.KERNEL_COPIES = kernel_copies[pos:]
+                    with tempfile.TemporaryFile() as dst:
+                        copied = sync.copy_data(src.fileno(), dst.fileno(), len(data))
+                        dst.seek(0)
+                        got.append((copied, dst.read() == data))
+            finally:
+                sync.KERNEL_COPIES = kernel_copies
+
+        self.assertListEqual(got, [(len(data), True)] * (len(kernel_copies) + 1), 'incorrect data copied')
+
+
+class TestExcludes(unittest.TestCase):
+    def test_match(self):
+        excludes = sync.Excludes(['*.log', '/top', 'b/', 'c/**/d', 'f[!0-9]'])
+
+        self.assertTrue(excludes.match('logs/app.log', False), 'name pattern not matched at depth')
+        self.assertTrue(excludes.match('top', False), 'anchored pattern not matched')
+        self.assertFalse(excludes.match('a/top', False), 'anchored pattern matched below the source')
+        self.assertTrue(excludes.match('a/b', True), 'directory pattern not matched')
+        self.assertFalse(excludes.match('a/b', False), 'directory pattern matched a file')
+        self.assertTrue(excludes.match('x/c/1/2/d', False), '** not matched across directories')
+        self.assertTrue(excludes.match('fa', False), 'character class not matched')
+        self.assertFalse(excludes.match('f1', False), 'negated character class matched')
+
+
+class TestTreeSync(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            dest = os.path.join(tmp, 'dest')
+            make_tree(source)
+            os.makedirs(dest)
+            tree = sync.TreeSync(source, dest, ['*.log'], workers=2)
+            success = tree.run()
+            got = sorted(os.path.relpath(os.path.join(root, name), dest)
+                         for root, dirs, files in os.walk(dest) for name in dirs + files)
+            x_stat = os.stat(os.path.join(dest, 'a', 'x'))
+            with open(os.path.join(dest, 'a', 'b', 'y'), 'rb') as test_file:
+                y_size = len(test_file.read())
+            link = os.readlink(os.path.join(dest, 'sym'))
+            b_mode = stat.S_IMODE(os.stat(os.path.join(dest, 'a', 'b')).st_mode)
+
+        self.assertTrue(success, 'sync failed')
+        self.assertListEqual(got, ['a', 'a/b', 'a/b/y', 'a/x', 'empty', 'logs', 'sym', 'top'], 'incorrect tree copied')
+        self.assertEqual(stat.S_IMODE(x_stat.st_mode), 0o640, 'mode not preserved')
+        self.assertEqual(x_stat.st_mtime_ns, 1_500_000_000_123, 'mtime not preserved')
+        self.assertEqual(y_size, sync.SMALL_FILE + 1, 'large file not copied')
+        self.assertEqual(link, 'a/x', 'symbolic link not copied')
+        self.assertEqual(b_mode, 0o555, 'directory mode not preserved')
+        self.assertEqual((tree.copied, tree.linked, tree.unchanged), (4, 0, 0), 'incorrect counts')
+
+    def test_run_unchanged_and_link_dest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            make_tree(source)
+            for name in ('first', 'linked'):
+                os.makedirs(os.path.join(tmp, name))
+            sync.TreeSync(source, os.path.join(tmp, 'first')).run()
+            again = sync.TreeSync(source, os.path.join(tmp, 'first'))
+            again.run()
+            with open(os.path.join(source, 'top'), 'wb') as test_file:
+                test_file.write(b'changed')
+            linked = sync.TreeSync(source, os.path.join(tmp, 'linked'), link_dest=os.path.join(tmp, 'first'))
+            success = linked.run()
+            x_inodes = {os.stat(os.path.join(tmp, name, 'a', 'x')).st_ino for name in ('first', 'linked')}
+            with open(os.path.join(tmp, 'first', 'top'), 'rb') as test_file:
+                first_top = test_file.read()
+
+        self.assertEqual((again.copied, again.unchanged), (1, 4), 'unchanged files copied again')
+        self.assertTrue(success, 'sync failed')
+        self.assertEqual((linked.copied, linked.linked), (2, 3), 'incorrect link counts')
+        self.assertEqual(len(x_inodes), 1, 'unchanged file not linked')
+        self.assertEqual(first_top, b'', 'linked backup changed')
+
+    def test_run_attributes_changed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            make_tree(source)
+            os.makedirs(os.path.join(tmp, 'dest'))
+            sync.TreeSync(source, os.path.join(tmp, 'dest')).run()
+            os.link(os.path.join(tmp, 'dest', 'top'), os.path.join(tmp, 'other'))
+            for name in ('a/x', 'top'):
+                os.chmod(os.path.join(source, name), 0o600)
+            x_inode = os.stat(os.path.join(tmp, 'dest', 'a', 'x')).st_ino
+            again = sync.TreeSync(source, os.path.join(tmp, 'dest'))
+            success = again.run()
+            x_stat = os.stat(os.path.join(tmp, 'dest', 'a', 'x'))
+            top_mode = stat.S_IMODE(os.stat(os.path.join(tmp, 'dest', 'top')).st_mode)
+            other_mode = stat.S_IMODE(os.stat(os.path.join(tmp, 'other')).st_mode)
+
+        self.assertTrue(success, 'sync failed')
+        self.assertEqual((again.copied, again.unchanged), (2, 3), 'incorrect counts')
+        self.assertEqual((stat.S_IMODE(x_stat.st_mode), x_stat.st_ino), (0o600, x_inode), 'mode not updated in place')
+        self.assertEqual(top_mode, 0o600, 'mode of linked copy not updated')
+        self.assertNotEqual(other_mode, 0o600, 'file linked to the copy changed')
+
+    def test_run_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            make_tree(source)
+            for root, dirs, _ in os.walk(source):
+                for name in dirs + ['']:
+                    os.utime(os.path.join(root, name), (1_000_000_000, 1_000_000_000))
+            for name in ('first', 'second', 'third'):
+                os.makedirs(os.path.join(tmp, name))
+            index = FileIndex(os.path.join(tmp, 'index.sqlite'))
+            sync.TreeSync(source, os.path.join(tmp, 'first'), index=index).run()
+            second = sync.TreeSync(source, os.path.join(tmp, 'second'), link_dest=os.path.join(tmp, 'first'),
+                                   index=index)
+            second.run()
+            with open(os.path.join(source, 'a', 'new'), 'wb') as test_file:
+                test_file.write(b'new')
+            with open(os.path.join(source, 'logs', 'app.log'), 'ab') as test_file:
+                test_file.write(b'appended')
+            third = sync.TreeSync(source, os.path.join(tmp, 'third'), link_dest=os.path.join(tmp, 'second'),
+                                  index=index)
+            success = third.run()
+            index.close()
+            got = sorted(os.listdir(os.path.join(tmp, 'third', 'a')))
+            y_inodes = {os.stat(os.path.join(tmp, name, 'a', 'b', 'y')).st_ino for name in ('first', 'third')}
+            with open(os.path.join(tmp, 'third', 'logs', 'app.log'), 'rb') as test_file:
+                app_log = test_file.read()
+
+        self.assertEqual((second.listed_previous, second.copied, second.linked), (5, 1, 4),
+                         'unchanged directories not listed from the previous copy')
+        self.assertTrue(success, 'sync failed')
+        self.assertEqual((third.listed_previous, third.copied), (4, 3), 'changed directory not listed from source')
+        self.assertListEqual(got, ['b', 'new', 'x'], 'new file not copied')
+        self.assertEqual(len(y_inodes), 1, 'unchanged file not linked')
+        self.assertEqual(app_log, b'logappended', 'file written in place in an unchanged directory not copied')
+
+    def test_run_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'file'), 'wb') as test_file:
+                test_file.write(b'data')
+            os.makedirs(os.path.join(tmp, 'dest'))
+            success = sync.TreeSync(os.path.join(tmp, 'file'), os.path.join(tmp, 'dest')).run()
+            got = os.listdir(os.path.join(tmp, 'dest'))
+
+        self.assertTrue(success, 'sync failed')
+        self.assertListEqual(got, ['file'], 'file not copied into destination')
+
+    def test_run_missing_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tree = sync.TreeSync(os.path.join(tmp, 'missing'), tmp)
+            success = tree.run()
+
+        self.assertFalse(success, 'missing source copied')
+        self.assertEqual(tree.failed, 1, 'incorrect failure count')